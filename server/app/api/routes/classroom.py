@@ -3,7 +3,6 @@ import logging
 import asyncio
 from typing import Optional, List, Union
 from datetime import datetime
-import yt_dlp
 
 from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, status
 from fastapi.responses import JSONResponse
@@ -16,8 +15,8 @@ from app.schemas.classroom import (
     AddAdminRequest, AdminAddedResponse, DeleteResponse
 )
 from app.services.auth import verify_token
-from app.services.rag_processing import upload_file_to_blob, validate_file
 from app.services.document_queue import document_queue
+from app.services.ingestion import attachment_ingestion
 
 router = APIRouter()
 settings = get_settings()
@@ -467,6 +466,8 @@ async def add_blog_to_classroom(
     if actual_files and len(actual_files) > 3:
         raise HTTPException(status_code=400, detail="You can upload a maximum of 3 files.")
 
+    document_queue.ensure_capacity(len(actual_files) + (1 if youtube_url else 0))
+
     supabase = client_manager.get_supabase_client()
     blog_id = str(uuid.uuid4())
 
@@ -482,73 +483,17 @@ async def add_blog_to_classroom(
             raise HTTPException(status_code=500, detail="Failed to create blog post.")
 
         new_blog = blog_response.data[0]
-        uploaded_documents_data = []
-        uploaded_videos_data = []
-
-        if actual_files:
-            for file in actual_files:
-                if file.filename:
-                    file_id = str(uuid.uuid4())
-                    data = await file.read()
-                    content_type = file.content_type
-                    
-                    if content_type.startswith("video/"):
-                        video_url = await upload_file_to_blob(data, settings.AZURE_VIDEOS_CONTAINER_NAME, f"{file_id}_{file.filename}")
-                        video_record = {
-                            'video_id': file_id, 'video_name': file.filename, 'video_url': video_url,
-                            'uploaded_by': user_id, 'classroom_id': classroom_id, 'origin_blog': blog_id, 
-                            'origin_work': None, 'status': 'processing'
-                        }
-                        video_insert_res = await asyncio.to_thread(supabase.table('videos_uploaded').insert(video_record).execute)
-                        if video_insert_res.data:
-                            uploaded_videos_data.append(video_insert_res.data[0])
-                            task_data = {
-                                "doc_id": file_id, "user_id": user_id, "classroom_id": classroom_id,
-                                "file_data": data, "filename": file.filename, "content_type": content_type, "task_type": "video"
-                            }
-                            await document_queue.add_to_queue(task_data)
-                    else:
-                        validate_file(file, data)
-                        doc_url = await upload_file_to_blob(data, settings.AZURE_DOCS_CONTAINER_NAME, f"{file_id}_{file.filename}")
-                        doc_record = {
-                            'document_id': file_id, 'uploaded_by': user_id, 'document_name': file.filename,
-                            'document_url': doc_url, 'classroom_id': classroom_id, 'origin_blog': blog_id,
-                            'is_class_context': True, 'status': 'processing'
-                        }
-                        doc_insert_res = await asyncio.to_thread(supabase.table('documents_uploaded').insert(doc_record).execute)
-                        if doc_insert_res.data:
-                            uploaded_documents_data.append(doc_insert_res.data[0])
-                            task_data = {
-                                "doc_id": file_id, "user_id": user_id, "classroom_id": classroom_id,
-                                "file_data": data, "filename": file.filename, "content_type": content_type, "task_type": "document"
-                            }
-                            await document_queue.add_to_queue(task_data)
-
-        if youtube_url:
-            video_id = str(uuid.uuid4())
-            with yt_dlp.YoutubeDL({'quiet': True, 'no_warnings': True}) as ydl:
-                info = ydl.extract_info(youtube_url, download=False)
-                video_title = info.get('title', 'YouTube Video')
-
-            video_record = {
-                'video_id': video_id, 'video_name': video_title, 'video_url': youtube_url,
-                'uploaded_by': user_id, 'classroom_id': classroom_id, 'origin_blog': blog_id, 
-                'origin_work': None, 'status': 'processing'
-            }
-            video_insert_res = await asyncio.to_thread(supabase.table('videos_uploaded').insert(video_record).execute)
-            if video_insert_res.data:
-                uploaded_videos_data.append(video_insert_res.data[0])
-                task_data = {
-                    "doc_id": video_id, "user_id": user_id, "classroom_id": classroom_id,
-                    "youtube_url": youtube_url, "task_type": "youtube"
-                }
-                await document_queue.add_to_queue(task_data)
-
-        new_blog['documents_uploaded'] = [DocumentsUploaded.model_validate(doc) for doc in uploaded_documents_data]
-        new_blog['videos_uploaded'] = [VideoUploaded.model_validate(vid) for vid in uploaded_videos_data]
+        ingested = await attachment_ingestion.ingest(
+            actual_files, youtube_url, user_id, classroom_id, origin_blog=blog_id
+        )
+        new_blog['documents_uploaded'] = [DocumentsUploaded.model_validate(doc) for doc in ingested.documents]
+        new_blog['videos_uploaded'] = [VideoUploaded.model_validate(vid) for vid in ingested.videos]
+        new_blog['job_ids'] = ingested.job_ids
 
         return BlogsUploaded.model_validate(new_blog)
 
+    except HTTPException:
+        raise
     except Exception as e:
         logger.critical(f"Error creating blog post in classroom {classroom_id}: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
@@ -573,6 +518,8 @@ async def assign_work_to_classroom(
     if actual_files and len(actual_files) > 3:
         raise HTTPException(status_code=400, detail="You can upload a maximum of 3 files.")
 
+    document_queue.ensure_capacity(len(actual_files) + (1 if youtube_url else 0))
+
     supabase = client_manager.get_supabase_client()
     work_id = str(uuid.uuid4())
 
@@ -589,73 +536,17 @@ async def assign_work_to_classroom(
             raise HTTPException(status_code=500, detail="Failed to assign work.")
 
         new_work = work_response.data[0]
-        uploaded_documents_data = []
-        uploaded_videos_data = []
-
-        if actual_files:
-            for file in actual_files:
-                if file.filename:
-                    file_id = str(uuid.uuid4())
-                    data = await file.read()
-                    content_type = file.content_type
-
-                    if content_type.startswith("video/"):
-                        video_url = await upload_file_to_blob(data, settings.AZURE_VIDEOS_CONTAINER_NAME, f"{file_id}_{file.filename}")
-                        video_record = {
-                            'video_id': file_id, 'video_name': file.filename, 'video_url': video_url,
-                            'uploaded_by': user_id, 'classroom_id': classroom_id, 'origin_work': work_id, 
-                            'origin_blog': None, 'status': 'processing'
-                        }
-                        video_insert_res = await asyncio.to_thread(supabase.table('videos_uploaded').insert(video_record).execute)
-                        if video_insert_res.data:
-                            uploaded_videos_data.append(video_insert_res.data[0])
-                            task_data = {
-                                "doc_id": file_id, "user_id": user_id, "classroom_id": classroom_id,
-                                "file_data": data, "filename": file.filename, "content_type": content_type, "task_type": "video"
-                            }
-                            await document_queue.add_to_queue(task_data)
-                    else:
-                        validate_file(file, data)
-                        doc_url = await upload_file_to_blob(data, settings.AZURE_DOCS_CONTAINER_NAME, f"{file_id}_{file.filename}")
-                        doc_record = {
-                            'document_id': file_id, 'uploaded_by': user_id, 'document_name': file.filename,
-                            'document_url': doc_url, 'classroom_id': classroom_id, 'origin_work': work_id,
-                            'is_class_context': True, 'status': 'processing'
-                        }
-                        doc_insert_res = await asyncio.to_thread(supabase.table('documents_uploaded').insert(doc_record).execute)
-                        if doc_insert_res.data:
-                            uploaded_documents_data.append(doc_insert_res.data[0])
-                            task_data = {
-                                "doc_id": file_id, "user_id": user_id, "classroom_id": classroom_id,
-                                "file_data": data, "filename": file.filename, "content_type": content_type, "task_type": "document"
-                            }
-                            await document_queue.add_to_queue(task_data)
-
-        if youtube_url:
-            video_id = str(uuid.uuid4())
-            with yt_dlp.YoutubeDL({'quiet': True, 'no_warnings': True}) as ydl:
-                info = ydl.extract_info(youtube_url, download=False)
-                video_title = info.get('title', 'YouTube Video')
-
-            video_record = {
-                'video_id': video_id, 'video_name': video_title, 'video_url': youtube_url,
-                'uploaded_by': user_id, 'classroom_id': classroom_id, 'origin_work': work_id, 
-                'origin_blog': None, 'status': 'processing'
-            }
-            video_insert_res = await asyncio.to_thread(supabase.table('videos_uploaded').insert(video_record).execute)
-            if video_insert_res.data:
-                uploaded_videos_data.append(video_insert_res.data[0])
-                task_data = {
-                    "doc_id": video_id, "user_id": user_id, "classroom_id": classroom_id,
-                    "youtube_url": youtube_url, "task_type": "youtube"
-                }
-                await document_queue.add_to_queue(task_data)
-
-        new_work['documents_uploaded'] = [DocumentsUploaded.model_validate(doc) for doc in uploaded_documents_data]
-        new_work['videos_uploaded'] = [VideoUploaded.model_validate(vid) for vid in uploaded_videos_data]
+        ingested = await attachment_ingestion.ingest(
+            actual_files, youtube_url, user_id, classroom_id, origin_work=work_id
+        )
+        new_work['documents_uploaded'] = [DocumentsUploaded.model_validate(doc) for doc in ingested.documents]
+        new_work['videos_uploaded'] = [VideoUploaded.model_validate(vid) for vid in ingested.videos]
+        new_work['job_ids'] = ingested.job_ids
 
         return WorkAssigned.model_validate(new_work)
 
+    except HTTPException:
+        raise
     except Exception as e:
         logger.critical(f"Error assigning work to classroom {classroom_id}: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
@@ -0,0 +1,35 @@
+from fastapi import APIRouter, Depends
+
+from app.services.answer_cache import answer_cache
+from app.services.auth import verify_token
+from app.services.call_governor import call_governor
+from app.services.compute_pool import compute_pool
+from app.services.content_cache import content_cache
+from app.services.diagram_index import diagram_index
+from app.services.document_queue import document_queue
+from app.services.loop_monitor import loop_monitor
+from app.services.pdf_text import extraction_stats
+from app.services.query_embedder import query_embedder
+from app.services.retrieval import retrieval_index
+
+router = APIRouter()
+
+@router.get("/metrics")
+async def get_metrics(token: dict = Depends(verify_token)):
+    """
+    Returns in-process performance counters: external calls per service,
+    processing queue depth, content cache hit rate, how PDF pages got their text, diagram reuse,
+    compute pool usage, event-loop lag, search index state, query embedding reuse and answer cache reuse.
+    """
+    return {
+        "external_calls": call_governor.stats(),
+        "queue": document_queue.stats(),
+        "content_cache": {"hits": content_cache.hits, "misses": content_cache.misses},
+        "pdf_pages": extraction_stats.stats(),
+        "diagram_dedup": diagram_index.stats(),
+        "compute_pool": compute_pool.stats(),
+        "event_loop": loop_monitor.stats(),
+        "retrieval": retrieval_index.stats(),
+        "query_embeddings": query_embedder.stats(),
+        "answer_cache": answer_cache.stats(),
+    }
@@ -0,0 +1,54 @@
+import logging
+
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi.responses import StreamingResponse
+
+from app.core.config import get_settings
+from app.schemas.search import AskRequest, SearchResponse, SearchResult
+from app.services.answering import stream_answer
+from app.services.auth import verify_token
+from app.services.membership import classroom_membership
+from app.services.retrieval import embed_query, retrieval_index
+
+router = APIRouter()
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+@router.get("/classroom/{classroom_id}/search", response_model=SearchResponse)
+async def search_classroom(
+    classroom_id: int,
+    q: str = Query(..., min_length=1, max_length=1000),
+    k: int = Query(settings.RETRIEVAL_DEFAULT_K, ge=1, le=settings.RETRIEVAL_MAX_K),
+    token: dict = Depends(verify_token)
+):
+    """Semantic search over the classroom's processed documents and videos."""
+    if not await classroom_membership.is_member(classroom_id, token["sub"]):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="You are not a member of this classroom.")
+
+    try:
+        query = q.strip()
+        hits = await retrieval_index.search(classroom_id, await embed_query(query), k, query_text=query)
+    except Exception as e:
+        logger.error(f"Search failed in classroom {classroom_id}: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Search failed.")
+
+    return SearchResponse(
+        query=q,
+        classroom_id=classroom_id,
+        results=[SearchResult.model_validate(hit) for hit in hits]
+    )
+
+@router.post("/classroom/{classroom_id}/ask")
+async def ask_classroom(classroom_id: int, request: AskRequest, token: dict = Depends(verify_token)):
+    """
+    Answers a question from the classroom's material, streamed as Server-Sent Events:
+    `citations` first, then `token` events as the answer is generated, then `done` (or `error`).
+    """
+    if not await classroom_membership.is_member(classroom_id, token["sub"]):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="You are not a member of this classroom.")
+
+    return StreamingResponse(
+        stream_answer(classroom_id, request.question.strip(), request.k or settings.ASK_TOP_K),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
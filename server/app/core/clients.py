@@ -68,6 +68,8 @@ class ClientManager:
             settings.AZURE_DOCS_CONTAINER_NAME,
             settings.AZURE_VIDEOS_CONTAINER_NAME
         ]
+        if settings.CONTENT_CACHE_BACKEND.lower() == "blob":
+            containers.append(settings.CONTENT_CACHE_CONTAINER_NAME)
         
         for container_name in containers:
             try:
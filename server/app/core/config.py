@@ -46,20 +46,123 @@ class Settings(BaseSettings):
     AZURE_VIDEOS_CONTAINER_NAME: str = "uploaded-videos"
     MAX_FILE_SIZE: int = 50_000_000
     MAX_PAGES: int = 500
-    BATCH_SIZE: int = 2
+    BATCH_SIZE: int = 2  # minimum pages per OCR request
+    OCR_MAX_BATCH_PAGES: int = 32
+    OCR_MAX_BATCH_BYTES: int = 20_000_000
+    OCR_PAGE_SELECT_MAX_BYTES: int = 4_000_000  # smaller PDFs are sent whole with a page range instead of sliced
+    PDF_TEXT_LAYER: bool = True  # use embedded PDF text where it scores well, OCR the rest
+    TEXT_LAYER_MIN_QUALITY: float = 0.9
+    TEXT_LAYER_MIN_DENSITY: float = 0.5  # chars per 1000 pt² expected on image-dominated pages
+    TEXT_LAYER_IMAGE_COVERAGE: float = 0.5
+    LAYOUT_MIN_PAGES_PER_TASK: int = 25
+    DIAGRAM_THRESHOLD: float = 0.5
+    DIAGRAM_CLASSIFIER_PATH: Optional[str] = None  # JSON weights from DiagramClassifier.fit/save
+    DIAGRAM_DEDUP: bool = True
+    DIAGRAM_DEDUP_PHASH_DISTANCE: int = 6
+    DIAGRAM_DEDUP_DHASH_DISTANCE: int = 10
+    DIAGRAM_INDEX_PATH: str = "data/diagram_hashes.sqlite3"
+    KEYFRAME_ANALYSIS_FPS: float = 2.0
+    KEYFRAME_HIST_THRESHOLD: float = 0.2
+    KEYFRAME_PIXEL_THRESHOLD: float = 0.003  # share of changed pixels that marks a new slide
+    KEYFRAME_MAX_FRAMES: int = 60
+    KEYFRAME_MIN_GAP_SECONDS: float = 2.0
+    WHISPER_SEGMENT_MAX_SECONDS: float = 600.0  # 16 kHz mono WAV: ~19 MB, under Whisper's 25 MB upload limit
     MAX_CHUNK_SIZE: int = 800
     CHUNK_OVERLAP: int = 100
     EMBEDDING_BATCH_SIZE: int = 16
     DIAGRAM_MAX_WIDTH: int = 1024
     DIAGRAM_MAX_HEIGHT: int = 1024
     DIAGRAM_JPEG_QUALITY: int = 75
+    SUMMARY_BATCHING: bool = True
+    SUMMARY_BATCH_TOKEN_BUDGET: int = 3000
+    SUMMARY_BATCH_MAX_CHUNKS: int = 20
+    PIPELINE_PAGE_GROUP_SIZE: int = 8
+    PIPELINE_QUEUE_SIZE: int = 2
+    PIPELINE_EXTRACT_LOOKAHEAD: int = 2
+    YOUTUBE_METADATA_TIMEOUT: float = 15.0
+    YOUTUBE_METADATA_CACHE_TTL: float = 3600.0
+    YOUTUBE_METADATA_CACHE_SIZE: int = 512
 
     # Rate Limiting (Requests Per Minute)
     OCR_RPM: int = 50
     EMBEDDING_RPM: int = 250
     GPT4O_RPM: int = 30
     DEEPSEEK_RPM: int = 180
-    
+    WHISPER_RPM: int = 3
+
+    # Rate Limiting (Tokens Per Minute, 0 = unmetered)
+    EMBEDDING_TPM: int = 240_000
+    GPT4O_TPM: int = 30_000
+    DEEPSEEK_TPM: int = 150_000
+    RATE_LIMIT_BURST_SECONDS: float = 10.0
+    RATE_LIMIT_BACKEND: str = "sqlite"  # "sqlite" shares limits across worker processes, "memory" is per process
+    RATE_LIMIT_STATE_PATH: str = "data/rate_limits.sqlite3"
+
+    # Max in-flight requests per external service
+    DEEPSEEK_CONCURRENCY: int = 16
+    GPT4O_CONCURRENCY: int = 4
+    EMBEDDING_CONCURRENCY: int = 4
+    OCR_CONCURRENCY: int = 8
+    WHISPER_CONCURRENCY: int = 2
+    BLOB_CONCURRENCY: int = 16
+    BLOB_BLOCK_SIZE: int = 4 * 1024 * 1024  # uploads/downloads stream in blocks of this size
+    BLOB_BLOCKS_IN_FLIGHT: int = 4  # staged blocks uploading at once per file
+    UPLOAD_TEMP_DIR: Optional[str] = None  # spool directory for uploads/downloads (system temp dir if unset)
+    GOVERNOR_MAX_RETRIES: int = 3
+
+    # Document Processing Queue
+    QUEUE_WORKERS: int = 4
+    QUEUE_MAX_SIZE: int = 200
+    QUEUE_PUT_TIMEOUT: float = 10.0
+    QUEUE_DOCUMENT_CONCURRENCY: int = 4
+    QUEUE_VIDEO_CONCURRENCY: int = 1
+    QUEUE_YOUTUBE_CONCURRENCY: int = 1
+
+    # Durable Ingestion Jobs
+    JOB_STORE_PATH: str = "data/ingestion_jobs.sqlite3"
+    JOB_LEASE_SECONDS: int = 120
+    JOB_MAX_ATTEMPTS: int = 5
+    JOB_RETRY_BASE_DELAY: float = 30.0
+    JOB_RETRY_MAX_DELAY: float = 900.0
+    CHECKPOINT_STORE_PATH: str = "data/stage_checkpoints.sqlite3"
+
+    # Content-Addressed Cache ("sqlite", "blob" or "none")
+    CONTENT_CACHE_BACKEND: str = "sqlite"
+    CONTENT_CACHE_PATH: str = "data/content_cache.sqlite3"
+    CONTENT_CACHE_MAX_BYTES: int = 2_000_000_000
+    CONTENT_CACHE_CONTAINER_NAME: str = "content-cache"
+
+    # CPU-Bound Work (process pool)
+    COMPUTE_WORKERS: int = 2
+    COMPUTE_MAX_CONCURRENCY: int = 8
+    COMPUTE_TASK_TIMEOUT: float = 300.0
+    COMPUTE_VIDEO_TASK_TIMEOUT: float = 1800.0
+    LOOP_LAG_INTERVAL: float = 0.5
+
+    # Retrieval (in-process vector index per classroom)
+    RETRIEVAL_MAX_CLASSROOMS: int = 32  # loaded classroom indexes kept in memory (LRU)
+    RETRIEVAL_LOAD_PAGE_SIZE: int = 1000
+    RETRIEVAL_IVF_MIN_VECTORS: int = 20_000  # exact search below this many chunks
+    RETRIEVAL_IVF_NPROBE: int = 16
+    RETRIEVAL_IVF_TRAIN_SAMPLE: int = 50_000
+    RETRIEVAL_HYBRID: bool = True  # fuse BM25 with vector results (reciprocal rank fusion) for queries with a rare term
+    RETRIEVAL_RARE_TERM_SHARE: float = 0.001  # a term in at most this share of a classroom's chunks is rare...
+    RETRIEVAL_RARE_TERM_MIN_DF: int = 3  # ...or in at most this many
+    RETRIEVAL_CANDIDATES: int = 50  # results taken from each ranking before fusion
+    RETRIEVAL_RRF_K: int = 60
+    RETRIEVAL_DEFAULT_K: int = 8
+    RETRIEVAL_MAX_K: int = 50
+    MEMBERSHIP_CACHE_TTL: float = 60.0
+    QUERY_EMBEDDING_CACHE_SIZE: int = 4096  # normalized query -> embedding (LRU)
+    QUERY_EMBEDDING_BATCH_WINDOW_MS: float = 5.0  # how long a query embedding waits for others to share its request
+    ASK_TOP_K: int = 8
+    ASK_CONTEXT_TOKEN_BUDGET: int = 3000  # retrieved chunks included in the prompt, measured with cl100k_base
+    ASK_MAX_ANSWER_TOKENS: int = 800
+    ANSWER_CACHE_SIMILARITY: float = 0.95  # question embeddings at least this similar (cosine) share an answer
+    ANSWER_CACHE_TTL: float = 3600.0
+    ANSWER_CACHE_PER_CLASSROOM: int = 128
+    ANSWER_CACHE_MAX_CLASSROOMS: int = 64
+
     class Config:
         env_file = ".env"
         extra = 'ignore'
@@ -37,6 +37,7 @@ class BlogsUploaded(BaseModel):
     context: str
     documents_uploaded: List[DocumentsUploaded] = Field(default_factory=list)
     videos_uploaded: List[VideoUploaded] = Field(default_factory=list)
+    job_ids: List[str] = Field(default_factory=list)
     uploaded_at: Any
     uploaded_by: str
     classroom_id: int
@@ -49,6 +50,7 @@ class WorkAssigned(BaseModel):
     work_description: str
     documents_uploaded: List[DocumentsUploaded] = Field(default_factory=list)
     videos_uploaded: List[VideoUploaded] = Field(default_factory=list)
+    job_ids: List[str] = Field(default_factory=list)
     due_date: Any
     assigned_by: str
     classroom_id: int
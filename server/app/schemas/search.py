@@ -0,0 +1,25 @@
+from pydantic import BaseModel, Field
+from typing import Any, Dict, List, Optional
+
+class SearchResult(BaseModel):
+    document_id: str = Field(..., alias="documentId")
+    chunk_index: int = Field(..., alias="chunkIndex")
+    content: str
+    score: float
+    metadata: Dict[str, Any] = Field(default_factory=dict)
+
+    class Config:
+        populate_by_name = True
+        from_attributes = True
+
+class AskRequest(BaseModel):
+    question: str = Field(..., min_length=1, max_length=2000)
+    k: Optional[int] = Field(None, ge=1, le=50)
+
+class SearchResponse(BaseModel):
+    query: str
+    classroom_id: int = Field(..., alias="classroomId")
+    results: List[SearchResult] = Field(default_factory=list)
+
+    class Config:
+        populate_by_name = True
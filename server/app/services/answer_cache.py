@@ -0,0 +1,96 @@
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from app.core.config import get_settings
+
+settings = get_settings()
+
+@dataclass
+class CachedAnswer:
+    text: str
+    citations: List[Dict[str, Any]]
+    tokens: int  # prompt + completion tokens a hit saves
+    k: int
+    corpus_version: int
+    vector: np.ndarray = field(repr=False)
+    expires_at: float = 0.0
+
+class AnswerCache:
+    """
+    Recent answers per classroom, reused for questions whose embedding is within
+    ANSWER_CACHE_SIMILARITY (cosine) of an answered one.
+
+    An answer is only served for the classroom corpus version it was generated
+    against, so chunks landing for the classroom (which bump the version in the
+    retrieval index) retire its answers. Entries expire after ANSWER_CACHE_TTL, each
+    classroom keeps its ANSWER_CACHE_PER_CLASSROOM most recently used answers, and
+    at most ANSWER_CACHE_MAX_CLASSROOMS classrooms are cached. Only touched from the
+    event loop, so there is no lock.
+    """
+    def __init__(self, max_classrooms: int, per_classroom: int, ttl: float, similarity: float):
+        self.max_classrooms = max_classrooms
+        self.per_classroom = per_classroom
+        self.ttl = ttl
+        self.similarity = similarity
+        self._classrooms: "OrderedDict[int, List[CachedAnswer]]" = OrderedDict()
+        self.lookups = 0
+        self.hits = 0
+        self.saved_tokens = 0
+
+    @staticmethod
+    def _unit(vector) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+    def lookup(self, classroom_id: int, query_vector, k: int, corpus_version: int) -> Optional[CachedAnswer]:
+        """The cached answer closest to the question, if similar enough and still current."""
+        self.lookups += 1
+        entries = self._classrooms.get(classroom_id)
+        if not entries:
+            return None
+        now = time.monotonic()
+        entries[:] = [e for e in entries if e.expires_at > now and e.corpus_version == corpus_version]
+        candidates = [e for e in entries if e.k == k]
+        if not candidates:
+            return None
+        similarities = np.stack([e.vector for e in candidates]) @ self._unit(query_vector)
+        best = int(np.argmax(similarities))
+        if similarities[best] < self.similarity:
+            return None
+        entry = candidates[best]
+        # Most recently used last; eviction takes from the front.
+        entries.remove(entry)
+        entries.append(entry)
+        self._classrooms.move_to_end(classroom_id)
+        self.hits += 1
+        self.saved_tokens += entry.tokens
+        return entry
+
+    def store(self, classroom_id: int, query_vector, k: int, corpus_version: int, text: str, citations: List[Dict[str, Any]], tokens: int):
+        entries = self._classrooms.setdefault(classroom_id, [])
+        entries.append(CachedAnswer(
+            text=text, citations=citations, tokens=tokens, k=k, corpus_version=corpus_version,
+            vector=self._unit(query_vector), expires_at=time.monotonic() + self.ttl,
+        ))
+        del entries[:-self.per_classroom]
+        self._classrooms.move_to_end(classroom_id)
+        while len(self._classrooms) > self.max_classrooms:
+            self._classrooms.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "hit_rate": round(self.hits / self.lookups, 3) if self.lookups else None,
+            "saved_tokens": self.saved_tokens,
+            "entries": sum(len(entries) for entries in self._classrooms.values()),
+        }
+
+answer_cache = AnswerCache(
+    settings.ANSWER_CACHE_MAX_CLASSROOMS, settings.ANSWER_CACHE_PER_CLASSROOM,
+    settings.ANSWER_CACHE_TTL, settings.ANSWER_CACHE_SIMILARITY,
+)
@@ -0,0 +1,164 @@
+import json
+import logging
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from langchain_core.messages import HumanMessage, SystemMessage
+
+from app.core.clients import client_manager
+from app.core.config import get_settings
+from app.services.answer_cache import answer_cache
+from app.services.call_governor import call_governor
+from app.services.rate_limiter import count_tokens
+from app.services.retrieval import SearchHit, embed_query, retrieval_index
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+ANSWER_SYSTEM_PROMPT = "You are a teaching assistant for a classroom. Answer the student's question using only the numbered course sources provided. Cite the sources you use inline as [n]. If the sources do not contain the answer, say so briefly instead of guessing. Be clear and concise."
+
+CITATION_FIELDS = ("page_number", "image_url", "start_time_ms", "end_time_ms")
+
+@dataclass
+class AnswerPrompt:
+    messages: List[Any]
+    citations: List[Dict[str, Any]] = field(default_factory=list)
+    prompt_tokens: int = 0
+
+def _format_time(ms: int) -> str:
+    seconds = int(ms) // 1000
+    return f"{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}" if seconds >= 3600 else f"{seconds // 60}:{seconds % 60:02d}"
+
+def _source_label(hit: SearchHit) -> str:
+    meta = hit.metadata
+    name = meta.get('filename') or meta.get('source') or hit.document_id
+    if meta.get('page_number') is not None:
+        return f"{name}, page {meta['page_number']}"
+    if meta.get('start_time_ms') is not None:
+        return f"{name}, at {_format_time(meta['start_time_ms'])}"
+    return name
+
+def build_prompt(question: str, hits: List[SearchHit], token_budget: int) -> AnswerPrompt:
+    """
+    Numbered sources from the best-ranked hits that fit in `token_budget` tokens, plus
+    the citation metadata for each source included.
+    """
+    sources, citations, used = [], [], 0
+    for hit in hits:
+        label = _source_label(hit)
+        source = f"[{len(sources) + 1}] ({label})\n{hit.content}"
+        tokens = count_tokens(source)
+        if used + tokens > token_budget:
+            continue
+        used += tokens
+        sources.append(source)
+        citation = {
+            "index": len(sources), "document_id": hit.document_id, "chunk_index": hit.chunk_index,
+            "source": label, "score": hit.score,
+        }
+        citation.update({name: hit.metadata[name] for name in CITATION_FIELDS if hit.metadata.get(name) is not None})
+        citations.append(citation)
+
+    context = "\n\n".join(sources) if sources else "(no relevant course material was found)"
+    user_prompt = f"Sources:\n{context}\n\nQuestion: {question}"
+    return AnswerPrompt(
+        messages=[SystemMessage(content=ANSWER_SYSTEM_PROMPT), HumanMessage(content=user_prompt)],
+        citations=citations,
+        prompt_tokens=count_tokens(ANSWER_SYSTEM_PROMPT) + count_tokens(user_prompt),
+    )
+
+def _answer_llm() -> Tuple[Optional[Any], str]:
+    """The chat model used for answers and its governor service name."""
+    if client_manager.deepseek_llm is not None:
+        return client_manager.deepseek_llm, 'deepseek'
+    return client_manager.gpt4o_chat_llm, 'gpt4o'
+
+THINK_END = "</think>"
+
+class ReasoningFilter:
+    """
+    Drops a reasoning model's `<think>...</think>` preamble from streamed text, as
+    `split('</think>')[-1]` does for whole DeepSeek responses: nothing is released
+    until `</think>` has arrived. If it never does, the output is released at the
+    end, unless it is an unfinished `<think>` block.
+    """
+    def __init__(self):
+        self._buffer = ""
+        self._answering = False
+        self._started = False
+
+    def feed(self, text: str) -> str:
+        if not self._answering:
+            self._buffer += text
+            if THINK_END not in self._buffer:
+                return ""
+            self._answering = True
+            text = self._buffer.split(THINK_END, 1)[1]
+        if not self._started:
+            # The whitespace between `</think>` and the answer may span deltas.
+            text = text.lstrip()
+            self._started = bool(text)
+        return text
+
+    def flush(self) -> str:
+        if self._answering or self._buffer.lstrip().startswith("<think>"):
+            return ""
+        return self._buffer.strip()
+
+def sse_event(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+async def stream_answer(classroom_id: int, question: str, k: int) -> AsyncIterator[str]:
+    """
+    Answers a question over the classroom's material as Server-Sent Events:
+    `citations` (sent before generation starts), then a `token` event per streamed
+    text delta, then `done` with usage, or `error` if something failed.
+
+    A near-identical question already answered against the same classroom material
+    is replayed from the answer cache (one `token` event, `done` with cached=true).
+    """
+    try:
+        query_vector = await embed_query(question)
+        # Read before retrieval, so an answer built while new chunks land is stored as already stale.
+        corpus_version = retrieval_index.corpus_version(classroom_id)
+        cached = answer_cache.lookup(classroom_id, query_vector, k, corpus_version)
+        if cached is not None:
+            yield sse_event("citations", {"citations": cached.citations})
+            yield sse_event("token", {"text": cached.text})
+            yield sse_event("done", {"cached": True, "saved_tokens": cached.tokens})
+            return
+
+        hits = await retrieval_index.search(classroom_id, query_vector, k, query_text=question)
+        prompt = build_prompt(question, hits, settings.ASK_CONTEXT_TOKEN_BUDGET)
+        yield sse_event("citations", {"citations": prompt.citations})
+
+        llm, service = _answer_llm()
+        if llm is None:
+            raise RuntimeError("No chat model is configured for answering.")
+        # Only DeepSeek emits a reasoning preamble; other models stream as-is.
+        reasoning = ReasoningFilter() if service == 'deepseek' else None
+        parts, deltas = [], 0
+        async for chunk in call_governor.stream(
+            service, llm.astream, prompt.messages,
+            tokens=prompt.prompt_tokens + settings.ASK_MAX_ANSWER_TOKENS, max_tokens=settings.ASK_MAX_ANSWER_TOKENS
+        ):
+            if not chunk.content:
+                continue
+            deltas += 1
+            text = reasoning.feed(chunk.content) if reasoning else chunk.content
+            if text:
+                parts.append(text)
+                yield sse_event("token", {"text": text})
+        tail = reasoning.flush() if reasoning else ""
+        if tail:
+            parts.append(tail)
+            yield sse_event("token", {"text": tail})
+        answer = "".join(parts)
+        answer_cache.store(
+            classroom_id, query_vector, k, corpus_version, answer, prompt.citations,
+            tokens=prompt.prompt_tokens + count_tokens(answer),
+        )
+        yield sse_event("done", {"prompt_tokens": prompt.prompt_tokens, "completion_chunks": deltas})
+    except Exception as e:
+        logger.error(f"Answer generation failed in classroom {classroom_id}: {e}", exc_info=True)
+        yield sse_event("error", {"detail": "Failed to generate an answer."})
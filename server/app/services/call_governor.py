@@ -0,0 +1,124 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, asdict
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict
+
+from app.core.config import get_settings
+from app.services.rate_limiter import rate_limiter, retry_after_from_error
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+@dataclass
+class CallMetrics:
+    calls: int = 0
+    errors: int = 0
+    throttled: int = 0
+    in_flight: int = 0
+    queued: int = 0
+    total_latency: float = 0.0
+    total_wait: float = 0.0
+
+    def snapshot(self) -> Dict[str, Any]:
+        data = asdict(self)
+        data["avg_latency_ms"] = round(1000 * self.total_latency / self.calls, 1) if self.calls else 0.0
+        data["avg_wait_ms"] = round(1000 * self.total_wait / self.calls, 1) if self.calls else 0.0
+        return data
+
+class CallGovernor:
+    """
+    Single entry point for every external API call.
+
+    Each service gets a semaphore capping in-flight requests, a rate limiter
+    reservation before each attempt, retries on 429 (reported back to the limiter),
+    and counters for calls, errors, throttling, latency and time spent waiting.
+    """
+    def __init__(self, settings):
+        concurrency = {
+            'deepseek': settings.DEEPSEEK_CONCURRENCY,
+            'gpt4o': settings.GPT4O_CONCURRENCY,
+            'embedding': settings.EMBEDDING_CONCURRENCY,
+            'ocr': settings.OCR_CONCURRENCY,
+            'whisper': settings.WHISPER_CONCURRENCY,
+            'blob': settings.BLOB_CONCURRENCY,
+        }
+        self._semaphores = {service: asyncio.Semaphore(max(1, limit)) for service, limit in concurrency.items()}
+        self.metrics: Dict[str, CallMetrics] = {service: CallMetrics() for service in concurrency}
+        self.max_retries = settings.GOVERNOR_MAX_RETRIES
+
+    async def call(self, service: str, func: Callable[..., Awaitable[Any]], *args, tokens: int = 0, **kwargs) -> Any:
+        """
+        Awaits `func(*args, **kwargs)` under the limits of `service`. `func` is called
+        again on each retry, so it must not depend on consumed state (e.g. an open file).
+        `tokens` is the estimated prompt + completion size used for TPM limiting.
+        """
+        semaphore, metrics = self._semaphores[service], self.metrics[service]
+        for attempt in range(self.max_retries + 1):
+            metrics.queued += 1
+            queued_at = time.monotonic()
+            async with semaphore:
+                await rate_limiter.acquire(service, tokens)
+                metrics.queued -= 1
+                metrics.total_wait += time.monotonic() - queued_at
+                metrics.in_flight += 1
+                started_at = time.monotonic()
+                try:
+                    result = await func(*args, **kwargs)
+                except Exception as e:
+                    retry_after = retry_after_from_error(e)
+                    if retry_after is None or attempt == self.max_retries:
+                        metrics.errors += 1
+                        raise
+                    metrics.throttled += 1
+                    await rate_limiter.report_throttled(service, retry_after)
+                    continue
+                finally:
+                    metrics.in_flight -= 1
+                    metrics.calls += 1
+                    metrics.total_latency += time.monotonic() - started_at
+
+            await rate_limiter.report_success(service)
+            return result
+
+    async def stream(self, service: str, func: Callable[..., AsyncIterator[Any]], *args, tokens: int = 0, **kwargs) -> AsyncIterator[Any]:
+        """
+        Like `call` for streaming APIs: iterates `func(*args, **kwargs)` under the limits of
+        `service`, holding its concurrency slot until the stream ends. A 429 is retried only
+        if it arrives before the first item, since items already yielded can't be taken back.
+        """
+        semaphore, metrics = self._semaphores[service], self.metrics[service]
+        for attempt in range(self.max_retries + 1):
+            metrics.queued += 1
+            queued_at = time.monotonic()
+            yielded = False
+            async with semaphore:
+                await rate_limiter.acquire(service, tokens)
+                metrics.queued -= 1
+                metrics.total_wait += time.monotonic() - queued_at
+                metrics.in_flight += 1
+                started_at = time.monotonic()
+                try:
+                    async for item in func(*args, **kwargs):
+                        yielded = True
+                        yield item
+                except Exception as e:
+                    retry_after = retry_after_from_error(e)
+                    if yielded or retry_after is None or attempt == self.max_retries:
+                        metrics.errors += 1
+                        raise
+                    metrics.throttled += 1
+                    await rate_limiter.report_throttled(service, retry_after)
+                    continue
+                finally:
+                    metrics.in_flight -= 1
+                    metrics.calls += 1
+                    metrics.total_latency += time.monotonic() - started_at
+
+            await rate_limiter.report_success(service)
+            return
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {service: metrics.snapshot() for service, metrics in self.metrics.items()}
+
+call_governor = CallGovernor(settings)
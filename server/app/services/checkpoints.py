@@ -0,0 +1,111 @@
+import asyncio
+import json
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from app.core.config import get_settings
+from app.services.content_cache import file_content_hash
+from app.utils.sqlite import SQLiteStore
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS stage_checkpoints (
+    doc_id TEXT NOT NULL,
+    content_hash TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    data TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (doc_id, stage)
+);
+"""
+
+class CheckpointStore(SQLiteStore):
+    """Persists the output of each processing stage, keyed by doc id and content hash."""
+    schema = _SCHEMA
+
+    def _load(self, doc_id: str, content_hash: str) -> Dict[str, Any]:
+        with self._connection() as conn:
+            rows = conn.execute(
+                "SELECT stage, data FROM stage_checkpoints WHERE doc_id = ? AND content_hash = ?",
+                (doc_id, content_hash)
+            ).fetchall()
+        return {row["stage"]: json.loads(row["data"]) for row in rows}
+
+    def _save(self, doc_id: str, content_hash: str, stage: str, data: Any):
+        with self._connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO stage_checkpoints (doc_id, content_hash, stage, data, created_at) VALUES (?, ?, ?, ?, ?)",
+                (doc_id, content_hash, stage, json.dumps(data), time.time())
+            )
+
+    def _clear(self, doc_id: str):
+        with self._connection() as conn:
+            conn.execute("DELETE FROM stage_checkpoints WHERE doc_id = ?", (doc_id,))
+
+    async def load(self, doc_id: str, content_hash: str) -> Dict[str, Any]:
+        """Returns completed stages for this doc; checkpoints for other content are ignored."""
+        return await asyncio.to_thread(self._load, doc_id, content_hash)
+
+    async def save(self, doc_id: str, content_hash: str, stage: str, data: Any):
+        await asyncio.to_thread(self._save, doc_id, content_hash, stage, data)
+
+    async def clear(self, doc_id: str):
+        await asyncio.to_thread(self._clear, doc_id)
+
+checkpoint_store = CheckpointStore(settings.CHECKPOINT_STORE_PATH)
+
+class DocumentCheckpoints:
+    """
+    Resumable stage runner for a single document.
+
+    `run(stage, producer)` returns the saved output of `stage` if an earlier attempt
+    completed it, otherwise awaits `producer()` and saves its result. `encode`/`decode`
+    convert values that don't survive a JSON round trip (e.g. dicts with int keys).
+    """
+    def __init__(self, doc_id: str, content_hash: str, completed: Dict[str, Any], enabled: bool = True):
+        self.doc_id = doc_id
+        self.content_hash = content_hash
+        self.completed = completed
+        self.enabled = enabled
+        # True when an earlier attempt left checkpoints behind.
+        self.resumed = bool(completed)
+
+    @classmethod
+    async def open(cls, doc_id: str, file_path: str) -> "DocumentCheckpoints":
+        content_hash = await asyncio.to_thread(file_content_hash, file_path)
+        completed = await checkpoint_store.load(doc_id, content_hash)
+        if completed:
+            logger.info(f"Doc '{doc_id}': resuming with completed stages {sorted(completed)}.")
+        return cls(doc_id, content_hash, completed)
+
+    @classmethod
+    def disabled(cls) -> "DocumentCheckpoints":
+        return cls(doc_id="", content_hash="", completed={}, enabled=False)
+
+    async def run(
+        self,
+        stage: str,
+        producer: Callable[[], Awaitable[Any]],
+        encode: Optional[Callable[[Any], Any]] = None,
+        decode: Optional[Callable[[Any], Any]] = None
+    ) -> Any:
+        if stage in self.completed:
+            data = self.completed[stage]
+            return decode(data) if decode else data
+
+        result = await producer()
+        if self.enabled:
+            data = encode(result) if encode else result
+            try:
+                await checkpoint_store.save(self.doc_id, self.content_hash, stage, data)
+                self.completed[stage] = data
+            except Exception as e:
+                logger.warning(f"Doc '{self.doc_id}': failed to checkpoint stage '{stage}': {e}")
+        return result
+
+    async def clear(self):
+        if self.enabled:
+            await checkpoint_store.clear(self.doc_id)
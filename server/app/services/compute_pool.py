@@ -0,0 +1,129 @@
+import asyncio
+import logging
+import multiprocessing
+import time
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, Optional
+
+from app.core.config import get_settings
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+class ComputePoolRecycled(RuntimeError):
+    """A task was lost because its worker pool was recycled for another task; it can be retried."""
+
+def _discard_result(future: asyncio.Future):
+    """Retrieves an abandoned task's outcome so asyncio doesn't log it as never retrieved."""
+    if not future.cancelled():
+        future.exception()
+
+class ComputePool:
+    """
+    Process pool for CPU-bound work (PyMuPDF, OpenCV, python-docx) so it never runs on
+    the event loop or holds the GIL there.
+
+    At most `max_concurrency` tasks are submitted at once; the rest wait here instead of
+    piling up in the executor. A task that exceeds its timeout is abandoned and the pool
+    is recycled, since a running worker process cannot be cancelled individually; the
+    other tasks on that pool then fail with ComputePoolRecycled, which callers (e.g. the
+    document queue) can retry. Functions must be top-level and picklable (see
+    app.services.compute_tasks).
+    """
+    def __init__(self, max_workers: int, max_concurrency: int, timeout: float):
+        self.max_workers = max(1, max_workers)
+        self.timeout = timeout
+        self._semaphore = asyncio.Semaphore(max(1, max_concurrency))
+        self._executor: Optional[ProcessPoolExecutor] = None
+        # Recycled executors -> why, for failing the tasks they took down with them.
+        self._recycled: "weakref.WeakKeyDictionary[ProcessPoolExecutor, str]" = weakref.WeakKeyDictionary()
+        self.completed = 0
+        self.failed = 0
+        self.timeouts = 0
+        self.interrupted = 0
+        self.in_flight = 0
+        self.total_seconds = 0.0
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # spawn: forking a process that runs threads and an event loop is not safe.
+            self._executor = ProcessPoolExecutor(self.max_workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._executor
+
+    def _recycle(self, executor: ProcessPoolExecutor, reason: str):
+        """Shuts `executor` down, unless a newer executor has already replaced it."""
+        if self._executor is not executor:
+            return
+        self._executor = None
+        self._recycled[executor] = reason
+        # ProcessPoolExecutor has no per-task cancel; terminate its workers so a runaway task stops.
+        for process in list(getattr(executor, "_processes", {}).values()):
+            process.terminate()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    async def run(self, func: Callable[..., Any], *args, timeout: Optional[float] = None) -> Any:
+        """
+        Runs `func(*args)` in a worker process. Raises TimeoutError after `timeout` seconds,
+        or ComputePoolRecycled if another task's failure took the pool down first.
+        """
+        timeout = timeout or self.timeout
+        async with self._semaphore:
+            self.in_flight += 1
+            started_at = time.monotonic()
+            executor = self._get_executor()
+            future = None
+            try:
+                future = asyncio.wrap_future(executor.submit(func, *args))
+                # Shielded so the future is only ever cancelled by a recycle, which tells the two apart.
+                result = await asyncio.wait_for(asyncio.shield(future), timeout)
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                future.add_done_callback(_discard_result)
+                logger.error(f"Compute task {func.__name__} exceeded {timeout:.1f}s; recycling the worker pool.")
+                self._recycle(executor, f"{func.__name__} timed out")
+                raise TimeoutError(f"{func.__name__} exceeded {timeout:.1f}s")
+            except (BrokenProcessPool, asyncio.CancelledError) as e:
+                reason = self._recycled.get(executor)
+                if reason is not None and (isinstance(e, BrokenProcessPool) or future.cancelled()):
+                    self.interrupted += 1
+                    raise ComputePoolRecycled(
+                        f"{func.__name__} was interrupted because the compute pool was recycled ({reason}); retry it."
+                    ) from None
+                if isinstance(e, asyncio.CancelledError):
+                    if future is not None:
+                        future.cancel()  # drops it if still queued; a running task finishes on its own
+                        future.add_done_callback(_discard_result)
+                    raise
+                self.failed += 1
+                logger.error(f"Compute pool broke while running {func.__name__}; it will be restarted.")
+                self._recycle(executor, f"pool broke running {func.__name__}")
+                raise
+            except Exception:
+                self.failed += 1
+                raise
+            finally:
+                self.in_flight -= 1
+                self.total_seconds += time.monotonic() - started_at
+            self.completed += 1
+            return result
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self) -> Dict[str, Any]:
+        finished = self.completed + self.failed + self.timeouts
+        return {
+            "workers": self.max_workers,
+            "in_flight": self.in_flight,
+            "completed": self.completed,
+            "failed": self.failed,
+            "timeouts": self.timeouts,
+            "interrupted": self.interrupted,
+            "avg_task_ms": round(1000 * self.total_seconds / finished, 1) if finished else 0.0,
+        }
+
+compute_pool = ComputePool(settings.COMPUTE_WORKERS, settings.COMPUTE_MAX_CONCURRENCY, settings.COMPUTE_TASK_TIMEOUT)
@@ -0,0 +1,246 @@
+"""
+CPU-bound functions run by the compute pool in worker processes.
+
+Everything here must be a picklable top-level function taking and returning plain
+data, and this module must stay cheap to import: workers import it, not the app.
+"""
+import io
+import os
+import wave
+from typing import List, Optional, Tuple, Union
+
+import cv2
+import docx
+import fitz  # PyMuPDF
+import numpy as np
+from PIL import Image
+
+from app.services.pdf_text import PageLayout, grid_occupancy, score_page
+
+# A file path, or the file's bytes.
+Source = Union[str, bytes]
+
+def open_pdf(source: Source) -> fitz.Document:
+    if isinstance(source, str):
+        return fitz.open(source, filetype='pdf')
+    return fitz.open(stream=source, filetype='pdf')
+
+# Paths covering more of the page than this are frames or backgrounds, not artwork.
+PAGE_FRAME_COVERAGE = 0.9
+
+def read_pdf_layouts(source: Source, page_indices: List[int]) -> List[PageLayout]:
+    """Collects the layout of the given pages in one pass over the document."""
+    layouts = []
+    with open_pdf(source) as doc:
+        for page_idx in page_indices:
+            page = doc[page_idx]
+            area = float(abs(page.rect)) or 1.0
+            text_blocks = [b for b in page.get_text("blocks") if b[6] == 0]
+            image_bboxes = [tuple(info["bbox"]) for info in page.get_image_info()]
+            drawings = page.get_cdrawings()
+            artwork = [tuple(d["rect"]) for d in drawings if abs(fitz.Rect(d["rect"])) < PAGE_FRAME_COVERAGE * area]
+            layouts.append(PageLayout(
+                page_idx=page_idx,
+                area=area,
+                text_blocks=text_blocks,
+                image_bboxes=image_bboxes,
+                drawing_items=sum(len(d.get("items", ())) for d in drawings),
+                drawing_coverage=round(grid_occupancy(artwork, page.rect), 3),
+                text_layer=score_page(page, text_blocks, image_bboxes, bool(drawings)),
+            ))
+    return layouts
+
+def render_pages_jpeg(source: Source, page_indices: List[int], max_width: int, max_height: int, quality: int, max_zoom: float = 2.0) -> List[Optional[bytes]]:
+    """
+    Renders pages straight to JPEG at the zoom that fits max_width x max_height (never
+    above max_zoom). PIL wraps the pixmap's sample buffer without copying and encodes
+    it once. Pages that fail to render come back as None.
+    """
+    images = []
+    with open_pdf(source) as doc:
+        for page_idx in page_indices:
+            try:
+                page = doc[page_idx]
+                zoom = min(max_zoom, max_width / page.rect.width, max_height / page.rect.height)
+                pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=fitz.csRGB, alpha=False)
+                img = Image.frombuffer("RGB", (pix.width, pix.height), pix.samples_mv, "raw", "RGB", pix.stride, 1)
+                output = io.BytesIO()
+                img.save(output, format='JPEG', quality=quality, optimize=True)
+                images.append(output.getvalue())
+            except Exception:
+                images.append(None)
+    return images
+
+def slice_pdf(source: Source, start_page: int, end_page: int) -> bytes:
+    """A standalone PDF of pages start_page..end_page; only objects those pages reference are written."""
+    with open_pdf(source) as doc, fitz.open() as part:
+        part.insert_pdf(doc, from_page=start_page, to_page=end_page)
+        return part.tobytes(garbage=1)
+
+def pdf_page_count(source: Source) -> int:
+    """Page count of a PDF; raises if it cannot be parsed."""
+    with open_pdf(source) as doc:
+        return doc.page_count
+
+def docx_text(source: Source) -> str:
+    document = docx.Document(source if isinstance(source, str) else io.BytesIO(source))
+    return "\n".join([para.text for para in document.paragraphs])
+
+# RMS windows read (and frames copied) per WAV read when splitting audio.
+AUDIO_READ_WINDOWS = 1000
+
+def split_audio_on_silence(wav_path: str, out_dir: str, max_seconds: float, window_ms: int = 30, smoothing_ms: int = 500) -> List[Tuple[int, int, str]]:
+    """
+    Splits a mono 16-bit WAV into segments of at most `max_seconds`, cutting each at the
+    quietest point (smoothed RMS) in the second half of its allowed span so words are not
+    split. Returns (start_ms, end_ms, path); a short file comes back as one segment.
+
+    The file is streamed twice, so memory stays flat however long the recording is: once
+    for the per-window RMS, then again to copy each segment out.
+    """
+    with wave.open(wav_path, "rb") as source:
+        rate, params, total = source.getframerate(), source.getparams(), source.getnframes()
+        max_len = int(max_seconds * rate)
+        if total <= max_len:
+            return [(0, int(total * 1000 / rate), wav_path)]
+
+        window = max(1, rate * window_ms // 1000)
+        rms = np.empty(total // window, dtype=np.float32)
+        for first in range(0, len(rms), AUDIO_READ_WINDOWS):
+            count = min(AUDIO_READ_WINDOWS, len(rms) - first)
+            block = np.frombuffer(source.readframes(count * window), dtype=np.int16).astype(np.float32)
+            rms[first:first + count] = np.sqrt(np.mean(block.reshape(count, window) ** 2, axis=1))
+        kernel = max(1, smoothing_ms // window_ms)
+        smoothed = np.convolve(rms, np.ones(kernel) / kernel, mode="same")
+
+        cuts, start = [], 0
+        while total - start > max_len:
+            lo, hi = (start + max_len // 2) // window, (start + max_len) // window
+            cut = (lo + int(np.argmin(smoothed[lo:hi]))) * window if hi > lo else start + max_len
+            cuts.append(cut)
+            start = cut
+
+        source.rewind()
+        segments = []
+        for index, (seg_start, seg_end) in enumerate(zip([0] + cuts, cuts + [total])):
+            path = os.path.join(out_dir, f"segment_{index:04d}.wav")
+            with wave.open(path, "wb") as target:
+                target.setparams(params)
+                for offset in range(seg_start, seg_end, AUDIO_READ_WINDOWS * window):
+                    target.writeframes(source.readframes(min(AUDIO_READ_WINDOWS * window, seg_end - offset)))
+            segments.append((int(seg_start * 1000 / rate), int(seg_end * 1000 / rate), path))
+    return segments
+
+def _pack_bits(bits: np.ndarray) -> int:
+    return int.from_bytes(np.packbits(bits.flatten()).tobytes(), "big")
+
+def image_hashes(image_data: bytes) -> Tuple[int, int]:
+    """(pHash, dHash) of an encoded image as unsigned 64-bit ints."""
+    gray = cv2.imdecode(np.frombuffer(image_data, np.uint8), cv2.IMREAD_GRAYSCALE)
+    low = cv2.dct(cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32))[:8, :8]
+    phash = low > np.median(low.flatten()[1:])
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    dhash = small[:, 1:] > small[:, :-1]
+    return _pack_bits(phash), _pack_bits(dhash)
+
+def compress_frame(frame: np.ndarray, max_width: int = 512, max_height: int = 512, quality: int = 60) -> bytes:
+    """Compress frame to reduce token usage for GPT-4o vision."""
+    height, width = frame.shape[:2]
+
+    if width > max_width or height > max_height:
+        scale = min(max_width / width, max_height / height)
+        new_width = int(width * scale)
+        new_height = int(height * scale)
+        frame = cv2.resize(frame, (new_width, new_height), interpolation=cv2.INTER_AREA)
+
+    encode_params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+    _, buffer = cv2.imencode('.jpg', frame, encode_params)
+
+    return buffer.tobytes()
+
+# Frames are compared at this width (height follows the aspect ratio).
+ANALYSIS_WIDTH = 320
+# Gray-level difference above which a pixel counts as changed; below it is codec noise.
+PIXEL_DELTA = 32
+
+def _change(a: Tuple[np.ndarray, np.ndarray], b: Tuple[np.ndarray, np.ndarray], hist_threshold: float, pixel_threshold: float) -> float:
+    """
+    Scene change between two (small gray frame, histogram) samples, scaled so 1.0 is the
+    threshold. The histogram catches layout/colour changes; the changed-pixel ratio
+    catches text changes between slides that share a template.
+    """
+    hist_distance = cv2.compareHist(a[1], b[1], cv2.HISTCMP_BHATTACHARYYA)
+    changed = float(np.count_nonzero(cv2.absdiff(a[0], b[0]) > PIXEL_DELTA)) / a[0].size
+    return max(hist_distance / hist_threshold, changed / pixel_threshold)
+
+def extract_key_frames(
+    video_path: str,
+    analysis_fps: float = 2.0,
+    hist_threshold: float = 0.2,
+    pixel_threshold: float = 0.003,
+    max_frames: int = 60,
+    min_gap_seconds: float = 2.0,
+) -> List[Tuple[int, bytes]]:
+    """
+    Detects slide/scene changes in one sequential pass and returns (timestamp_ms, jpeg) keyframes.
+
+    Frames are grabbed in order (no seeking); only every n-th frame, for roughly
+    `analysis_fps`, is decoded and compared to the last keyframe on a downscaled grayscale
+    copy using histogram distance and the share of changed pixels. A detected change is kept once the picture
+    settles, so fades and slide animations yield their final frame. If more than
+    `max_frames` changes are found, the strongest ones are kept.
+    """
+    cap = cv2.VideoCapture(video_path)
+    try:
+        fps = cap.get(cv2.CAP_PROP_FPS) or 25.0
+        step = max(1, round(fps / analysis_fps))
+        min_gap_frames = int(min_gap_seconds * fps)
+
+        # (frame_index, change score, jpeg); the first frame always stays.
+        key_frames: List[Tuple[int, float, bytes]] = []
+        last_key = previous = None
+        pending = None  # (frame_index, score, full frame, sample) of a change that is still settling
+        frame_index = -1
+
+        while cap.grab():
+            frame_index += 1
+            if frame_index % step:
+                continue
+            ok, frame = cap.retrieve()
+            if not ok:
+                continue
+
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            height = max(1, round(gray.shape[0] * ANALYSIS_WIDTH / gray.shape[1]))
+            small = cv2.resize(gray, (ANALYSIS_WIDTH, height), interpolation=cv2.INTER_AREA)
+            hist = cv2.calcHist([small], [0], None, [32], [0, 256])
+            cv2.normalize(hist, hist)
+            sample = (small, hist)
+
+            if last_key is None:
+                key_frames.append((frame_index, float("inf"), compress_frame(frame)))
+                last_key = previous = sample
+                continue
+
+            if pending is not None:
+                settled = _change(previous, sample, hist_threshold, pixel_threshold) < 0.5
+                if settled:
+                    key_frames.append((pending[0], pending[1], compress_frame(frame)))
+                    last_key, pending = sample, None
+                else:
+                    pending = (pending[0], pending[1], frame, sample)
+            else:
+                score = _change(last_key, sample, hist_threshold, pixel_threshold)
+                if score >= 1.0 and frame_index - key_frames[-1][0] >= min_gap_frames:
+                    pending = (frame_index, score, frame, sample)
+            previous = sample
+    finally:
+        cap.release()
+
+    if pending is not None:
+        key_frames.append((pending[0], pending[1], compress_frame(pending[2])))
+
+    if len(key_frames) > max_frames:
+        strongest = sorted(key_frames, key=lambda k: k[1], reverse=True)[:max_frames]
+        key_frames = sorted(strongest, key=lambda k: k[0])
+    return [(int(index * 1000 / fps), image) for index, _, image in key_frames]
@@ -0,0 +1,193 @@
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional
+
+from azure.core.exceptions import ResourceNotFoundError
+
+from app.core.clients import client_manager
+from app.core.config import get_settings
+from app.services.call_governor import call_governor
+from app.utils.sqlite import SQLiteStore
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+def content_hash(*parts) -> str:
+    """SHA-256 over the given parts (bytes or str), used to build content-addressed keys."""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else str(part).encode("utf-8"))
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+def file_content_hash(path: str) -> str:
+    """content_hash of a file's bytes, read in blocks rather than loaded whole."""
+    with open(path, "rb") as f:
+        digest = hashlib.file_digest(f, "sha256")
+    digest.update(b"\x00")
+    return digest.hexdigest()
+
+class CacheBackend(ABC):
+    """Interface for a key/value store of JSON strings."""
+    @abstractmethod
+    async def get_many(self, keys: List[str]) -> Dict[str, str]:
+        ...
+
+    @abstractmethod
+    async def set_many(self, items: Dict[str, str]):
+        ...
+
+class SQLiteCacheBackend(SQLiteStore, CacheBackend):
+    """Local-disk backend with least-recently-used eviction once `max_bytes` is exceeded."""
+    schema = """
+    CREATE TABLE IF NOT EXISTS cache_entries (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        last_access REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_cache_entries_last_access ON cache_entries (last_access);
+    """
+    _MAX_PARAMS = 900
+    _EVICT_EVERY = 50
+
+    def __init__(self, path: str, max_bytes: int):
+        super().__init__(path)
+        self.max_bytes = max_bytes
+        self._writes = 0
+
+    def _get_many(self, keys: List[str]) -> Dict[str, str]:
+        found = {}
+        now = time.time()
+        with self._connection() as conn:
+            for start in range(0, len(keys), self._MAX_PARAMS):
+                batch = keys[start:start + self._MAX_PARAMS]
+                placeholders = ",".join("?" * len(batch))
+                rows = conn.execute(f"SELECT key, value FROM cache_entries WHERE key IN ({placeholders})", batch).fetchall()
+                found.update({row["key"]: row["value"] for row in rows})
+                if rows:
+                    conn.execute(
+                        f"UPDATE cache_entries SET last_access = ? WHERE key IN ({','.join('?' * len(rows))})",
+                        [now, *[row["key"] for row in rows]]
+                    )
+        return found
+
+    def _set_many(self, items: Dict[str, str]):
+        now = time.time()
+        with self._connection() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO cache_entries (key, value, size, last_access) VALUES (?, ?, ?, ?)",
+                [(key, value, len(value), now) for key, value in items.items()]
+            )
+            self._writes += 1
+            if self._writes % self._EVICT_EVERY == 0:
+                self._evict(conn)
+
+    def _evict(self, conn):
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM cache_entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Drop least recently used entries until we are back under 90% of the budget.
+        to_free = total - int(self.max_bytes * 0.9)
+        freed, doomed = 0, []
+        for row in conn.execute("SELECT key, size FROM cache_entries ORDER BY last_access"):
+            if freed >= to_free:
+                break
+            doomed.append((row["key"],))
+            freed += row["size"]
+        conn.executemany("DELETE FROM cache_entries WHERE key = ?", doomed)
+        logger.info(f"Content cache evicted {len(doomed)} entries ({freed} bytes).")
+
+    async def get_many(self, keys: List[str]) -> Dict[str, str]:
+        return await asyncio.to_thread(self._get_many, keys)
+
+    async def set_many(self, items: Dict[str, str]):
+        await asyncio.to_thread(self._set_many, items)
+
+class BlobCacheBackend(CacheBackend):
+    """
+    Azure Blob Storage backend for multi-node deployments. Requests share the call
+    governor's 'blob' limits; eviction is left to a lifecycle rule on the container.
+    """
+    def __init__(self, container_name: str):
+        self.container_name = container_name
+
+    async def _get(self, key: str) -> Optional[str]:
+        blob_client = client_manager.blob_service_client.get_blob_client(container=self.container_name, blob=key)
+
+        async def _download() -> Optional[str]:
+            try:
+                downloader = await blob_client.download_blob()
+                return (await downloader.readall()).decode("utf-8")
+            except ResourceNotFoundError:
+                return None
+
+        return await call_governor.call('blob', _download)
+
+    async def _set(self, key: str, value: str):
+        blob_client = client_manager.blob_service_client.get_blob_client(container=self.container_name, blob=key)
+        await call_governor.call('blob', blob_client.upload_blob, value.encode("utf-8"), overwrite=True)
+
+    async def get_many(self, keys: List[str]) -> Dict[str, str]:
+        values = await asyncio.gather(*[self._get(key) for key in keys])
+        return {key: value for key, value in zip(keys, values) if value is not None}
+
+    async def set_many(self, items: Dict[str, str]):
+        await asyncio.gather(*[self._set(key, value) for key, value in items.items()])
+
+class ContentCache:
+    """
+    Content-addressed cache for OCR text, summaries and embeddings.
+
+    Keys are `<namespace>/<sha256>`; values are JSON. Backend errors are logged and
+    treated as misses so the cache can never fail document processing.
+    """
+    def __init__(self, backend: Optional[CacheBackend]):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+
+    async def get_many(self, namespace: str, hashes: List[str]) -> Dict[str, Any]:
+        """Returns {hash: value} for the hashes found in the cache."""
+        if not self.backend or not hashes:
+            return {}
+        keys = [f"{namespace}/{h}" for h in hashes]
+        try:
+            found = await self.backend.get_many(keys)
+        except Exception as e:
+            logger.warning(f"Content cache read failed for '{namespace}': {e}")
+            found = {}
+        values = {key.split("/", 1)[1]: json.loads(value) for key, value in found.items()}
+        self.hits += len(values)
+        self.misses += len(set(hashes)) - len(values)
+        return values
+
+    async def set_many(self, namespace: str, values: Dict[str, Any]):
+        if not self.backend or not values:
+            return
+        try:
+            await self.backend.set_many({f"{namespace}/{h}": json.dumps(value) for h, value in values.items()})
+        except Exception as e:
+            logger.warning(f"Content cache write failed for '{namespace}': {e}")
+
+    async def get(self, namespace: str, key_hash: str) -> Optional[Any]:
+        return (await self.get_many(namespace, [key_hash])).get(key_hash)
+
+    async def set(self, namespace: str, key_hash: str, value: Any):
+        await self.set_many(namespace, {key_hash: value})
+
+def _create_backend() -> Optional[CacheBackend]:
+    backend = settings.CONTENT_CACHE_BACKEND.lower()
+    if backend == "sqlite":
+        return SQLiteCacheBackend(settings.CONTENT_CACHE_PATH, settings.CONTENT_CACHE_MAX_BYTES)
+    if backend == "blob":
+        return BlobCacheBackend(settings.CONTENT_CACHE_CONTAINER_NAME)
+    if backend != "none":
+        logger.warning(f"Unknown CONTENT_CACHE_BACKEND '{settings.CONTENT_CACHE_BACKEND}'; content cache disabled.")
+    return None
+
+content_cache = ContentCache(_create_backend())
@@ -0,0 +1,131 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from app.core.config import get_settings
+from app.utils.sqlite import SQLiteStore
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+# (pHash, dHash), each a 64-bit perceptual hash as returned by compute_tasks.image_hashes.
+ImageHash = Tuple[int, int]
+
+@dataclass
+class DiagramMatch:
+    document_id: str
+    page_idx: int
+    description: str
+    image_url: str
+    distance: int
+
+def _signed(value: int) -> int:
+    # SQLite integers are signed 64-bit.
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+def hamming(a: np.ndarray, b: int) -> np.ndarray:
+    """Bit distance between each uint64 in `a` and `b`."""
+    xor = np.bitwise_xor(a, np.uint64(b))
+    return np.unpackbits(xor.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+
+def is_near_duplicate(a: ImageHash, b: ImageHash) -> bool:
+    return (
+        bin(a[0] ^ b[0]).count("1") <= settings.DIAGRAM_DEDUP_PHASH_DISTANCE
+        and bin(a[1] ^ b[1]).count("1") <= settings.DIAGRAM_DEDUP_DHASH_DISTANCE
+    )
+
+class DiagramIndex(SQLiteStore):
+    """
+    Perceptual-hash index of described diagram images, per classroom.
+
+    A new diagram close to an indexed one (both pHash and dHash within the configured
+    Hamming distance) reuses its description and blob URL instead of another vision call.
+    """
+    schema = """
+    CREATE TABLE IF NOT EXISTS diagram_hashes (
+        classroom_id TEXT NOT NULL,
+        document_id TEXT NOT NULL,
+        page_idx INTEGER NOT NULL,
+        phash INTEGER NOT NULL,
+        dhash INTEGER NOT NULL,
+        description TEXT NOT NULL,
+        image_url TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        PRIMARY KEY (document_id, page_idx)
+    );
+    CREATE INDEX IF NOT EXISTS idx_diagram_hashes_classroom ON diagram_hashes (classroom_id);
+    """
+
+    def __init__(self, path: str):
+        super().__init__(path)
+        self.hits = 0
+        self.lookups = 0
+
+    def _find_many(self, classroom_id: Optional[int], document_id: str, hashes: List[ImageHash]) -> List[Optional[DiagramMatch]]:
+        with self._connection() as conn:
+            rows = conn.execute(
+                "SELECT document_id, page_idx, phash, dhash, description, image_url FROM diagram_hashes WHERE classroom_id = ? OR document_id = ?",
+                (str(classroom_id), document_id)
+            ).fetchall()
+        if not rows:
+            return [None] * len(hashes)
+
+        phashes = np.array([row["phash"] for row in rows], dtype=np.int64).view(np.uint64)
+        dhashes = np.array([row["dhash"] for row in rows], dtype=np.int64).view(np.uint64)
+        matches = []
+        for phash, dhash in hashes:
+            p_dist, d_dist = hamming(phashes, phash), hamming(dhashes, dhash)
+            candidates = np.flatnonzero(
+                (p_dist <= settings.DIAGRAM_DEDUP_PHASH_DISTANCE) & (d_dist <= settings.DIAGRAM_DEDUP_DHASH_DISTANCE)
+            )
+            if not len(candidates):
+                matches.append(None)
+                continue
+            best = candidates[np.argmin(p_dist[candidates] + d_dist[candidates])]
+            row = rows[best]
+            matches.append(DiagramMatch(
+                row["document_id"], row["page_idx"], row["description"], row["image_url"], int(p_dist[best] + d_dist[best])
+            ))
+        return matches
+
+    def _add_many(self, classroom_id: Optional[int], document_id: str, entries: List[Tuple[int, ImageHash, str, str]]):
+        now = time.time()
+        with self._connection() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO diagram_hashes VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (str(classroom_id), document_id, page_idx, _signed(phash), _signed(dhash), description, image_url, now)
+                    for page_idx, (phash, dhash), description, image_url in entries
+                ]
+            )
+
+    async def find_many(self, classroom_id: Optional[int], document_id: str, hashes: List[ImageHash]) -> List[Optional[DiagramMatch]]:
+        """Closest indexed diagram from the same classroom or document for each hash, or None."""
+        if not hashes:
+            return []
+        try:
+            matches = await asyncio.to_thread(self._find_many, classroom_id, document_id, hashes)
+        except Exception as e:
+            logger.warning(f"Diagram index lookup failed: {e}")
+            matches = [None] * len(hashes)
+        self.lookups += len(hashes)
+        self.hits += sum(match is not None for match in matches)
+        return matches
+
+    async def add_many(self, classroom_id: Optional[int], document_id: str, entries: List[Tuple[int, ImageHash, str, str]]):
+        """Indexes (page_idx, hash, description, image_url) entries."""
+        if not entries:
+            return
+        try:
+            await asyncio.to_thread(self._add_many, classroom_id, document_id, entries)
+        except Exception as e:
+            logger.warning(f"Diagram index update failed: {e}")
+
+    def stats(self):
+        return {"lookups": self.lookups, "reused": self.hits}
+
+diagram_index = DiagramIndex(settings.DIAGRAM_INDEX_PATH)
@@ -1,37 +1,275 @@
 import asyncio
 import logging
-from typing import Dict, Any
+import random
+import time
+import uuid
+from collections import OrderedDict, deque
+from typing import Dict, Any, Deque, List, Optional
 
-from app.services.rag_processing import process_document_background
+from fastapi import HTTPException, status
+
+from app.core.config import get_settings
+from app.services.job_store import PermanentJobError, job_store
+from app.services.rag_processing import process_document_background, mark_processing_failed
 
 logger = logging.getLogger(__name__)
+settings = get_settings()
+
+# Lanes in priority order; ties between equally loaded lanes go to the earlier one.
+LANES = ("document", "youtube", "video")
 
 class DocumentProcessingQueue:
-    def __init__(self):
-        self.queue = asyncio.Queue()
-        self.worker_task = None
+    """
+    A bounded, multi-worker processing queue.
+
+    Tasks are split into one lane per task_type so a long video never blocks PDFs,
+    and each lane has its own concurrency cap. Inside a lane, tasks are served
+    round-robin across classrooms so one bulk upload cannot starve other classes.
+
+    Every task is journaled in the job store before it is queued, and is leased
+    while it runs, so pending work survives a restart and failures are retried
+    with exponential backoff.
+    """
+    def __init__(self, num_workers: int, max_size: int, lane_limits: Dict[str, int]):
+        self.num_workers = max(1, num_workers)
+        self.max_size = max(1, max_size)
+        self.lane_limits = {lane: max(1, lane_limits.get(lane, self.num_workers)) for lane in LANES}
+        # lane -> classroom_id -> FIFO of (enqueued_at, task_data)
+        self._lanes: Dict[str, "OrderedDict[Any, Deque]"] = {lane: OrderedDict() for lane in LANES}
+        self._active: Dict[str, int] = {lane: 0 for lane in LANES}
+        self._size = 0
+        self._changed = asyncio.Condition()
+        self.worker_tasks: List[asyncio.Task] = []
+        self.owner_id = f"worker-{uuid.uuid4()}"
+        self._delayed: set = set()
+
+    @staticmethod
+    def _lane_for(task_data: Dict[str, Any]) -> str:
+        task_type = task_data.get("task_type", "document")
+        return task_type if task_type in LANES else "document"
+
+    def _pending_in(self, lane: str) -> bool:
+        return bool(self._lanes[lane])
+
+    def _next_task(self) -> Optional[tuple]:
+        """Picks the least loaded eligible lane, then the next classroom in it (round-robin)."""
+        eligible = [
+            lane for lane in LANES
+            if self._pending_in(lane) and self._active[lane] < self.lane_limits[lane]
+        ]
+        if not eligible:
+            return None
+        lane = min(eligible, key=lambda l: self._active[l] / self.lane_limits[l])
+
+        classrooms = self._lanes[lane]
+        classroom_id, tasks = next(iter(classrooms.items()))
+        enqueued_at, task_data = tasks.popleft()
+        if tasks:
+            classrooms.move_to_end(classroom_id)
+        else:
+            del classrooms[classroom_id]
 
-    async def _worker(self):
-        """Continuously pulls tasks from the queue and processes them."""
+        self._size -= 1
+        self._active[lane] += 1
+        return lane, enqueued_at, task_data
+
+    async def _worker(self, worker_id: int):
+        """Continuously pulls tasks from the lanes and processes them."""
         while True:
+            async with self._changed:
+                picked = self._next_task()
+                while picked is None:
+                    await self._changed.wait()
+                    picked = self._next_task()
+                # Freed capacity may unblock producers waiting in add_to_queue.
+                self._changed.notify_all()
+
+            lane, enqueued_at, task_data = picked
             try:
-                task_data = await self.queue.get()
-                logger.info(f"Starting processing for doc '{task_data['doc_id']}' from the queue.")
-                await process_document_background(**task_data)
-                self.queue.task_done()
+                wait_seconds = time.monotonic() - enqueued_at
+                logger.info(f"Worker {worker_id}: starting {lane} task for doc '{task_data['doc_id']}' after {wait_seconds:.1f}s in queue.")
+                await self._run_job(task_data)
             except Exception as e:
-                logger.error(f"Error in document processing worker: {e}", exc_info=True)
+                logger.error(f"Error in document processing worker {worker_id}: {e}", exc_info=True)
+            finally:
+                async with self._changed:
+                    self._active[lane] -= 1
+                    self._changed.notify_all()
+
+    async def _run_job(self, task_data: Dict[str, Any]):
+        """Leases the job, processes it and acks it, or schedules a retry on failure."""
+        job_id = task_data['doc_id']
+        try:
+            job = await job_store.lease(job_id, self.owner_id, settings.JOB_LEASE_SECONDS)
+        except Exception as e:
+            logger.warning(f"Failed to lease job '{job_id}'; retrying in {settings.JOB_RETRY_BASE_DELAY:.0f}s: {e}")
+            self._push_later(task_data, settings.JOB_RETRY_BASE_DELAY)
+            return
+        if job is None:
+            await self._requeue_unclaimed(task_data)
+            return
+
+        heartbeat = asyncio.create_task(self._keep_lease(job_id))
+        try:
+            try:
+                await process_document_background(**job['payload'])
+            finally:
+                heartbeat.cancel()
+        except Exception as e:
+            await self._handle_failure(job, e)
+        else:
+            await job_store.ack(job_id)
+
+    async def _requeue_unclaimed(self, task_data: Dict[str, Any]):
+        """Re-queues a job that could not be leased for when it becomes claimable; finished or buried jobs are dropped."""
+        job_id = task_data['doc_id']
+        try:
+            job = await job_store.get(job_id)
+        except Exception as e:
+            logger.warning(f"Failed to read job '{job_id}'; retrying in {settings.JOB_RETRY_BASE_DELAY:.0f}s: {e}")
+            self._push_later(task_data, settings.JOB_RETRY_BASE_DELAY)
+            return
+        if job is None or job['status'] not in ('pending', 'leased'):
+            logger.info(f"Job '{job_id}' is already done or buried; dropping it.")
+            return
+        # At least a second, so a lease that expires while we look is not retried in a tight loop.
+        delay = max(1.0, self._claimable_in(job))
+        logger.info(f"Job '{job_id}' is not claimable yet (not due or leased elsewhere); retrying in {delay:.0f}s.")
+        self._push_later(task_data, delay)
+
+    @staticmethod
+    def _claimable_in(job: Dict[str, Any]) -> float:
+        """Seconds until a pending or leased job can be leased (<= 0 if it already can)."""
+        return max(job['available_at'], job['lease_expires_at'] or 0.0) - time.time()
+
+    async def _keep_lease(self, job_id: str):
+        """Renews the lease while the job runs so other processes don't reclaim it."""
+        interval = max(1.0, settings.JOB_LEASE_SECONDS / 3)
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await job_store.renew(job_id, self.owner_id, settings.JOB_LEASE_SECONDS)
+            except Exception as e:
+                logger.warning(f"Failed to renew lease for job '{job_id}': {e}")
+
+    @staticmethod
+    def is_permanent(error: Exception) -> bool:
+        """Only rejected input fails a job outright; everything else may be transient and is retried."""
+        return isinstance(error, PermanentJobError) or (isinstance(error, HTTPException) and error.status_code < 500)
+
+    async def _handle_failure(self, job: Dict[str, Any], error: Exception):
+        job_id, attempts = job['job_id'], job['attempts']
+        permanent = self.is_permanent(error)
+        if permanent or attempts >= settings.JOB_MAX_ATTEMPTS:
+            logger.error(f"Job '{job_id}' failed permanently after {attempts} attempt(s): {error}")
+            await job_store.bury(job_id, repr(error))
+            await mark_processing_failed(job_id, job['task_type'])
+            return
+
+        delay = min(settings.JOB_RETRY_BASE_DELAY * 2 ** (attempts - 1), settings.JOB_RETRY_MAX_DELAY)
+        delay *= random.uniform(0.8, 1.2)
+        logger.warning(f"Job '{job_id}' failed on attempt {attempts}; retrying in {delay:.0f}s: {error}")
+        await job_store.retry(job_id, repr(error), delay)
+        self._push_later(job['payload'], delay)
+
+    async def _push(self, task_data: Dict[str, Any]):
+        """Puts an already-journaled task into its lane, bypassing the size bound."""
+        async with self._changed:
+            self._lanes[self._lane_for(task_data)].setdefault(task_data.get("classroom_id"), deque()).append((time.monotonic(), task_data))
+            self._size += 1
+            self._changed.notify_all()
+
+    def _push_later(self, task_data: Dict[str, Any], delay: float):
+        async def _delayed_push():
+            await asyncio.sleep(delay)
+            await self._push(task_data)
+
+        task = asyncio.create_task(_delayed_push())
+        self._delayed.add(task)
+        task.add_done_callback(self._delayed.discard)
+
+    async def resume_pending_jobs(self):
+        """Re-queues jobs left pending or leased by a previous process."""
+        jobs = await job_store.recoverable()
+        for job in jobs:
+            delay = self._claimable_in(job)
+            if delay > 0:
+                self._push_later(job['payload'], delay)
+            else:
+                await self._push(job['payload'])
+        if jobs:
+            logger.info(f"Resumed {len(jobs)} ingestion job(s) from the job store.")
 
     def start_worker(self):
-        """Starts the background worker task."""
-        if self.worker_task is None:
-            self.worker_task = asyncio.create_task(self._worker())
-            logger.info("Document processing queue worker started.")
+        """Starts the pool of background worker tasks."""
+        if not self.worker_tasks:
+            self.worker_tasks = [asyncio.create_task(self._worker(i)) for i in range(self.num_workers)]
+            logger.info(f"Document processing queue started with {self.num_workers} workers (lane limits: {self.lane_limits}).")
+
+    def ensure_capacity(self, count: int = 1):
+        """Rejects a request up front when the queue cannot take `count` more tasks."""
+        if self._size + count > self.max_size:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="The processing queue is full. Please try again in a few minutes."
+            )
 
     async def add_to_queue(self, task_data: Dict[str, Any]):
-        """Adds a new document processing task to the queue."""
-        await self.queue.put(task_data)
-        logger.info(f"Doc '{task_data['doc_id']}' has been added to the processing queue.")
+        """
+        Journals a new task and adds it to its lane, waiting for space when the queue is full.
+        `task_data` must be JSON-serializable: pass blob references, not file bytes.
+        """
+        lane = self._lane_for(task_data)
+        async with self._changed:
+            try:
+                await asyncio.wait_for(
+                    self._changed.wait_for(lambda: self._size < self.max_size),
+                    timeout=settings.QUEUE_PUT_TIMEOUT
+                )
+            except asyncio.TimeoutError:
+                raise HTTPException(
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    detail="The processing queue is full. Please try again in a few minutes."
+                )
+            # Reserve the slot while the job is written to the store.
+            self._size += 1
+
+        try:
+            await job_store.enqueue(task_data['doc_id'], task_data.get("task_type", "document"), task_data.get("classroom_id"), task_data)
+        except Exception:
+            async with self._changed:
+                self._size -= 1
+                self._changed.notify_all()
+            raise
+
+        async with self._changed:
+            self._lanes[lane].setdefault(task_data.get("classroom_id"), deque()).append((time.monotonic(), task_data))
+            self._changed.notify_all()
+        logger.info(f"Doc '{task_data['doc_id']}' has been added to the {lane} lane ({self._size} queued).")
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns queue depth and active task counts per lane."""
+        return {
+            "queued": self._size,
+            "max_size": self.max_size,
+            "lanes": {
+                lane: {
+                    "queued": sum(len(tasks) for tasks in self._lanes[lane].values()),
+                    "classrooms": len(self._lanes[lane]),
+                    "active": self._active[lane],
+                    "limit": self.lane_limits[lane],
+                }
+                for lane in LANES
+            },
+        }
 
 # Create a single, global instance of the queue
-document_queue = DocumentProcessingQueue()
\ No newline at end of file
+document_queue = DocumentProcessingQueue(
+    num_workers=settings.QUEUE_WORKERS,
+    max_size=settings.QUEUE_MAX_SIZE,
+    lane_limits={
+        "document": settings.QUEUE_DOCUMENT_CONCURRENCY,
+        "video": settings.QUEUE_VIDEO_CONCURRENCY,
+        "youtube": settings.QUEUE_YOUTUBE_CONCURRENCY,
+    }
+)
@@ -0,0 +1,152 @@
+import asyncio
+import logging
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+import yt_dlp
+from fastapi import UploadFile
+
+from app.core.clients import client_manager
+from app.core.config import get_settings
+from app.services.document_queue import document_queue
+from app.services.rag_processing import upload_stream_to_blob, validate_and_upload_document
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+@dataclass
+class IngestionResult:
+    documents: List[Dict[str, Any]] = field(default_factory=list)
+    videos: List[Dict[str, Any]] = field(default_factory=list)
+    job_ids: List[str] = field(default_factory=list)
+
+@dataclass
+class _Attachment:
+    table: str
+    record: Dict[str, Any]
+    task_data: Dict[str, Any]
+
+class AttachmentIngestion:
+    """
+    Ingests the files and YouTube link attached to a blog post or assignment.
+
+    Blob uploads and metadata lookups for all attachments run concurrently; the
+    resulting rows are written with one bulk insert per table, and a processing job
+    is queued for each. Returns as soon as the jobs are queued.
+    """
+    def __init__(self):
+        # youtube_url -> (expires_at, title)
+        self._youtube_titles: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+
+    @staticmethod
+    def _extract_youtube_title(youtube_url: str) -> str:
+        with yt_dlp.YoutubeDL({'quiet': True, 'no_warnings': True}) as ydl:
+            info = ydl.extract_info(youtube_url, download=False)
+            return info.get('title', 'YouTube Video')
+
+    async def youtube_title(self, youtube_url: str) -> str:
+        """
+        Video title from yt_dlp, looked up in a thread with a timeout and cached for
+        YOUTUBE_METADATA_CACHE_TTL. Falls back to a generic title if the lookup times out.
+        """
+        cached = self._youtube_titles.get(youtube_url)
+        if cached and cached[0] > time.monotonic():
+            self._youtube_titles.move_to_end(youtube_url)
+            return cached[1]
+        try:
+            title = await asyncio.wait_for(
+                asyncio.to_thread(self._extract_youtube_title, youtube_url), timeout=settings.YOUTUBE_METADATA_TIMEOUT
+            )
+        except asyncio.TimeoutError:
+            logger.warning(f"YouTube metadata lookup timed out for {youtube_url}")
+            return 'YouTube Video'
+        self._youtube_titles[youtube_url] = (time.monotonic() + settings.YOUTUBE_METADATA_CACHE_TTL, title)
+        self._youtube_titles.move_to_end(youtube_url)
+        while len(self._youtube_titles) > settings.YOUTUBE_METADATA_CACHE_SIZE:
+            self._youtube_titles.popitem(last=False)
+        return title
+
+    async def _prepare_file(self, file: UploadFile, user_id: str, classroom_id: int, origins: Dict[str, Optional[str]]) -> _Attachment:
+        """Validates and uploads one file, returning the row to insert and the job to queue."""
+        file_id = str(uuid.uuid4())
+        content_type = file.content_type
+        blob_name = f"{file_id}_{file.filename}"
+        task_data = {
+            "doc_id": file_id, "user_id": user_id, "classroom_id": classroom_id,
+            "blob_name": blob_name, "filename": file.filename, "content_type": content_type
+        }
+
+        if content_type.startswith("video/"):
+            video_url = await upload_stream_to_blob(file.file, settings.AZURE_VIDEOS_CONTAINER_NAME, blob_name)
+            record = {
+                'video_id': file_id, 'video_name': file.filename, 'video_url': video_url,
+                'uploaded_by': user_id, 'classroom_id': classroom_id, **origins, 'status': 'processing'
+            }
+            task_data.update(blob_container=settings.AZURE_VIDEOS_CONTAINER_NAME, task_type="video")
+            return _Attachment('videos_uploaded', record, task_data)
+
+        doc_url = await validate_and_upload_document(file, settings.AZURE_DOCS_CONTAINER_NAME, blob_name)
+        record = {
+            'document_id': file_id, 'uploaded_by': user_id, 'document_name': file.filename,
+            'document_url': doc_url, 'classroom_id': classroom_id, **origins,
+            'is_class_context': True, 'status': 'processing'
+        }
+        task_data.update(blob_container=settings.AZURE_DOCS_CONTAINER_NAME, task_type="document")
+        return _Attachment('documents_uploaded', record, task_data)
+
+    async def _prepare_youtube(self, youtube_url: str, user_id: str, classroom_id: int, origins: Dict[str, Optional[str]]) -> _Attachment:
+        video_id = str(uuid.uuid4())
+        record = {
+            'video_id': video_id, 'video_name': await self.youtube_title(youtube_url), 'video_url': youtube_url,
+            'uploaded_by': user_id, 'classroom_id': classroom_id, **origins, 'status': 'processing'
+        }
+        task_data = {
+            "doc_id": video_id, "user_id": user_id, "classroom_id": classroom_id,
+            "youtube_url": youtube_url, "task_type": "youtube"
+        }
+        return _Attachment('videos_uploaded', record, task_data)
+
+    @staticmethod
+    async def _insert(table: str, records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        if not records:
+            return []
+        supabase = client_manager.get_supabase_client()
+        response = await asyncio.to_thread(supabase.table(table).insert(records).execute)
+        return response.data or []
+
+    async def ingest(
+        self,
+        files: List[UploadFile],
+        youtube_url: Optional[str],
+        user_id: str,
+        classroom_id: int,
+        origin_blog: Optional[str] = None,
+        origin_work: Optional[str] = None,
+    ) -> IngestionResult:
+        """
+        Uploads and records the attachments and queues their processing jobs.
+        If any attachment fails validation or upload, nothing is recorded and the
+        first error is raised.
+        """
+        origins = {'origin_blog': origin_blog, 'origin_work': origin_work}
+        preparing = [self._prepare_file(file, user_id, classroom_id, origins) for file in files if file.filename]
+        if youtube_url:
+            preparing.append(self._prepare_youtube(youtube_url, user_id, classroom_id, origins))
+        prepared = await asyncio.gather(*preparing, return_exceptions=True)
+        for item in prepared:
+            if isinstance(item, BaseException):
+                raise item
+
+        documents, videos = await asyncio.gather(
+            self._insert('documents_uploaded', [a.record for a in prepared if a.table == 'documents_uploaded']),
+            self._insert('videos_uploaded', [a.record for a in prepared if a.table == 'videos_uploaded']),
+        )
+        inserted_ids = {row.get('document_id') or row.get('video_id') for row in documents + videos}
+        jobs = [a.task_data for a in prepared if a.task_data["doc_id"] in inserted_ids]
+        await asyncio.gather(*[document_queue.add_to_queue(task_data) for task_data in jobs])
+        return IngestionResult(documents=documents, videos=videos, job_ids=[task_data["doc_id"] for task_data in jobs])
+
+attachment_ingestion = AttachmentIngestion()
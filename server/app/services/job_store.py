@@ -0,0 +1,151 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+from typing import Any, Dict, List, Optional
+
+from app.core.config import get_settings
+from app.utils.sqlite import SQLiteStore
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS ingestion_jobs (
+    job_id TEXT PRIMARY KEY,
+    task_type TEXT NOT NULL,
+    classroom_id INTEGER,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    available_at REAL NOT NULL,
+    lease_owner TEXT,
+    lease_expires_at REAL,
+    last_error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_ingestion_jobs_status ON ingestion_jobs (status, available_at);
+"""
+
+class PermanentJobError(Exception):
+    """Raised from job processing when the input itself is unusable, so retrying cannot help."""
+
+class JobStore(SQLiteStore):
+    """
+    A restart-safe journal of ingestion jobs backed by SQLite.
+
+    Jobs only hold a JSON payload (blob references, ids, filenames), never file bytes.
+    Status moves pending -> leased -> (deleted on ack | pending again on retry | dead).
+    A lease that is not renewed expires, which makes the job claimable again.
+    """
+    schema = _SCHEMA
+
+    @staticmethod
+    def _row_to_job(row: sqlite3.Row) -> Dict[str, Any]:
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        return job
+
+    def _enqueue(self, job_id: str, task_type: str, classroom_id: Optional[int], payload: Dict[str, Any]):
+        now = time.time()
+        with self._connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO ingestion_jobs "
+                "(job_id, task_type, classroom_id, payload, status, attempts, available_at, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, 'pending', 0, ?, ?, ?)",
+                (job_id, task_type, classroom_id, json.dumps(payload), now, now, now)
+            )
+
+    def _lease(self, job_id: str, owner: str, lease_seconds: float) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        with self._connection() as conn:
+            cursor = conn.execute(
+                "UPDATE ingestion_jobs SET status = 'leased', lease_owner = ?, lease_expires_at = ?, "
+                "attempts = attempts + 1, updated_at = ? "
+                "WHERE job_id = ? AND available_at <= ? "
+                "AND (status = 'pending' OR (status = 'leased' AND lease_expires_at < ?))",
+                (owner, now + lease_seconds, now, job_id, now, now)
+            )
+            if cursor.rowcount == 0:
+                return None
+            row = conn.execute("SELECT * FROM ingestion_jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return self._row_to_job(row)
+
+    def _renew(self, job_id: str, owner: str, lease_seconds: float) -> bool:
+        now = time.time()
+        with self._connection() as conn:
+            cursor = conn.execute(
+                "UPDATE ingestion_jobs SET lease_expires_at = ?, updated_at = ? "
+                "WHERE job_id = ? AND status = 'leased' AND lease_owner = ?",
+                (now + lease_seconds, now, job_id, owner)
+            )
+        return cursor.rowcount > 0
+
+    def _ack(self, job_id: str):
+        with self._connection() as conn:
+            conn.execute("DELETE FROM ingestion_jobs WHERE job_id = ?", (job_id,))
+
+    def _retry(self, job_id: str, error: str, delay: float):
+        now = time.time()
+        with self._connection() as conn:
+            conn.execute(
+                "UPDATE ingestion_jobs SET status = 'pending', lease_owner = NULL, lease_expires_at = NULL, "
+                "available_at = ?, last_error = ?, updated_at = ? WHERE job_id = ?",
+                (now + delay, error[:2000], now, job_id)
+            )
+
+    def _bury(self, job_id: str, error: str):
+        now = time.time()
+        with self._connection() as conn:
+            conn.execute(
+                "UPDATE ingestion_jobs SET status = 'dead', lease_owner = NULL, lease_expires_at = NULL, "
+                "last_error = ?, updated_at = ? WHERE job_id = ?",
+                (error[:2000], now, job_id)
+            )
+
+    def _get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._connection() as conn:
+            row = conn.execute("SELECT * FROM ingestion_jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return self._row_to_job(row) if row else None
+
+    def _recoverable(self) -> List[Dict[str, Any]]:
+        with self._connection() as conn:
+            rows = conn.execute(
+                "SELECT * FROM ingestion_jobs WHERE status IN ('pending', 'leased') ORDER BY created_at"
+            ).fetchall()
+        return [self._row_to_job(row) for row in rows]
+
+    async def enqueue(self, job_id: str, task_type: str, classroom_id: Optional[int], payload: Dict[str, Any]):
+        """Persists a new pending job. Re-enqueueing an existing id resets it."""
+        await asyncio.to_thread(self._enqueue, job_id, task_type, classroom_id, payload)
+
+    async def lease(self, job_id: str, owner: str, lease_seconds: float) -> Optional[Dict[str, Any]]:
+        """Claims a job for processing. Returns None if it is gone, not yet due, or leased elsewhere."""
+        return await asyncio.to_thread(self._lease, job_id, owner, lease_seconds)
+
+    async def renew(self, job_id: str, owner: str, lease_seconds: float) -> bool:
+        return await asyncio.to_thread(self._renew, job_id, owner, lease_seconds)
+
+    async def ack(self, job_id: str):
+        """Marks a job as done by removing it from the journal."""
+        await asyncio.to_thread(self._ack, job_id)
+
+    async def retry(self, job_id: str, error: str, delay: float):
+        """Releases a failed job so it becomes claimable again after `delay` seconds."""
+        await asyncio.to_thread(self._retry, job_id, error, delay)
+
+    async def bury(self, job_id: str, error: str):
+        """Parks a job that has exhausted its attempts."""
+        await asyncio.to_thread(self._bury, job_id, error)
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Returns the job, or None once it has been acked."""
+        return await asyncio.to_thread(self._get, job_id)
+
+    async def recoverable(self) -> List[Dict[str, Any]]:
+        """Returns every pending or leased job, e.g. those left behind by a previous process."""
+        return await asyncio.to_thread(self._recoverable)
+
+job_store = JobStore(settings.JOB_STORE_PATH)
@@ -0,0 +1,79 @@
+import json
+import logging
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from app.core.config import get_settings
+from app.services.pdf_text import PageLayout
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+FEATURES = ("image_coverage", "text_coverage", "drawing_coverage", "drawing_density")
+
+# Hand-tuned so that a page at least 40% covered by images with no text sits at 0.5, text
+# pushes strongly towards "not a diagram", and dense vector artwork (charts, flowcharts
+# drawn as paths) counts as a diagram even without any raster image.
+DEFAULT_WEIGHTS = {"image_coverage": 8.75, "text_coverage": -10.0, "drawing_coverage": 7.0, "drawing_density": 4.0}
+DEFAULT_BIAS = -3.5
+
+def page_features(layouts: List[PageLayout]) -> np.ndarray:
+    """Feature matrix of shape (pages, len(FEATURES)) for the classifier."""
+    if not layouts:
+        return np.zeros((0, len(FEATURES)), dtype=np.float32)
+    raw = np.array([
+        (l.text_layer.image_coverage, l.text_layer.text_coverage, l.drawing_coverage, l.drawing_items, l.area)
+        for l in layouts
+    ], dtype=np.float32)
+    # Path items per 1000 pt², log-scaled so a few thousand strokes don't swamp everything else.
+    raw[:, 3] = np.log1p(raw[:, 3] / np.maximum(raw[:, 4] / 1000, 1.0))
+    return raw[:, :4]
+
+class DiagramClassifier:
+    """
+    Logistic model over page layout features, scoring how likely a page is a diagram.
+
+    Weights default to hand-tuned values; weights learned from labelled pages with
+    `fit` can be saved as JSON and loaded through DIAGRAM_CLASSIFIER_PATH.
+    """
+    def __init__(self, weights: Dict[str, float], bias: float, threshold: float):
+        self.weights = np.array([weights.get(name, 0.0) for name in FEATURES], dtype=np.float32)
+        self.bias = float(bias)
+        self.threshold = threshold
+
+    @classmethod
+    def from_settings(cls) -> "DiagramClassifier":
+        if settings.DIAGRAM_CLASSIFIER_PATH:
+            try:
+                with open(settings.DIAGRAM_CLASSIFIER_PATH) as f:
+                    model = json.load(f)
+                return cls(model["weights"], model["bias"], model.get("threshold", settings.DIAGRAM_THRESHOLD))
+            except Exception as e:
+                logger.error(f"Could not load diagram classifier from '{settings.DIAGRAM_CLASSIFIER_PATH}', using defaults: {e}")
+        return cls(DEFAULT_WEIGHTS, DEFAULT_BIAS, settings.DIAGRAM_THRESHOLD)
+
+    def scores(self, features: np.ndarray) -> np.ndarray:
+        return 1.0 / (1.0 + np.exp(-(features @ self.weights + self.bias)))
+
+    def classify(self, layouts: List[PageLayout]) -> List[Tuple[int, float]]:
+        """(page_idx, confidence) for every page scoring at or above the threshold."""
+        scores = self.scores(page_features(layouts))
+        return [(layout.page_idx, round(float(score), 3)) for layout, score in zip(layouts, scores) if score >= self.threshold]
+
+    @classmethod
+    def fit(cls, features: np.ndarray, labels: np.ndarray, threshold: float = 0.5, epochs: int = 2000, lr: float = 0.5, l2: float = 1e-3) -> "DiagramClassifier":
+        """Learns weights from labelled pages (labels: 1 = diagram) by batch gradient descent."""
+        x, y = features.astype(np.float64), labels.astype(np.float64)
+        w, b = np.zeros(x.shape[1]), 0.0
+        for _ in range(epochs):
+            p = 1.0 / (1.0 + np.exp(-(x @ w + b)))
+            w -= lr * (x.T @ (p - y) / len(y) + l2 * w)
+            b -= lr * float(np.mean(p - y))
+        return cls(dict(zip(FEATURES, w.tolist())), b, threshold)
+
+    def save(self, path: str):
+        with open(path, "w") as f:
+            json.dump({"weights": dict(zip(FEATURES, self.weights.tolist())), "bias": self.bias, "threshold": self.threshold}, f, indent=2)
+
+diagram_classifier = DiagramClassifier.from_settings()
@@ -0,0 +1,206 @@
+import math
+import re
+import threading
+from array import array
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+# Identifiers, numbers and course codes stay whole ("read_csv", "cs101", "o(n)" -> "o", "n"),
+# and dotted/hyphenated compounds are indexed both whole and by part ("pd.read_csv").
+_TOKEN = re.compile(r"[a-z0-9_]+(?:[.\-+#][a-z0-9_]+)*[+#]*")
+_PART = re.compile(r"[a-z0-9_]+")
+STOPWORDS = frozenset(
+    "a an and are as at be but by for from has have how i if in into is it its of on or "
+    "that the their then there these this to was what when where which who why will with".split()
+)
+
+def tokenize(text: str) -> List[str]:
+    tokens = []
+    for token in _TOKEN.findall(text.lower()):
+        if token not in STOPWORDS:
+            tokens.append(token)
+        parts = _PART.findall(token)
+        if len(parts) > 1:
+            tokens.extend(part for part in parts if part not in STOPWORDS)
+    return tokens
+
+def _encode_varint(value: int, out: bytearray):
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+def decode_varints(data: bytes) -> np.ndarray:
+    """Decodes a run of LEB128 varints in one vectorized pass."""
+    raw = np.frombuffer(data, dtype=np.uint8)
+    if not len(raw):
+        return np.zeros(0, dtype=np.int64)
+    ends = np.flatnonzero(raw < 0x80)
+    lengths = np.diff(ends, prepend=-1)
+    group = np.repeat(np.arange(len(ends)), lengths)
+    shift = 7 * (np.arange(len(raw)) - np.repeat(ends - lengths + 1, lengths))
+    return np.bincount(group, weights=(raw & 0x7F).astype(np.float64) * np.exp2(shift)).astype(np.int64)
+
+class _Postings:
+    """Doc ids of one term as varint-encoded gaps, with term frequencies alongside."""
+    __slots__ = ("gaps", "freqs", "last")
+
+    def __init__(self):
+        self.gaps = bytearray()
+        self.freqs = array("H")
+        self.last = -1
+
+    def append(self, doc: int, freq: int):
+        _encode_varint(doc - self.last - 1, self.gaps)
+        self.freqs.append(min(freq, 0xFFFF))
+        self.last = doc
+
+    def decode(self) -> Tuple[np.ndarray, np.ndarray]:
+        return np.cumsum(decode_varints(bytes(self.gaps)) + 1) - 1, np.frombuffer(self.freqs, dtype=np.uint16)
+
+    @classmethod
+    def from_arrays(cls, docs: np.ndarray, freqs: np.ndarray) -> "_Postings":
+        postings = cls()
+        for doc, freq in zip(docs.tolist(), freqs.tolist()):
+            postings.append(doc, freq)
+        return postings
+
+class BM25Index:
+    """
+    Incremental BM25 over one classroom's chunk texts.
+
+    Each added chunk gets the next internal doc id, so postings only ever grow at
+    the end: doc ids are stored as varint-encoded gaps (one or two bytes for most)
+    and frequencies in a uint16 array. Dropped chunks are masked out at query time
+    and removed from the postings once a third of the index is dead.
+    """
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1, self.b = k1, b
+        self._lock = threading.Lock()
+        self._postings: Dict[str, _Postings] = {}
+        self._lengths = array("I")
+        self._keys: List[Tuple[str, int]] = []
+        self._doc_of: Dict[Tuple[str, int], int] = {}
+        self._doc_keys: Dict[str, Set[Tuple[str, int]]] = {}
+        self._alive = array("B")
+        self._total_length = 0
+        self._norm = None  # per-doc BM25 length normalization, rebuilt after changes
+
+    def __len__(self) -> int:
+        return len(self._doc_of)
+
+    def _drop(self, key: Tuple[str, int]):
+        doc = self._doc_of.pop(key, None)
+        if doc is not None:
+            self._alive[doc] = 0
+            self._total_length -= self._lengths[doc]
+            self._doc_keys[key[0]].discard(key)
+            self._norm = None
+
+    def _add(self, key: Tuple[str, int], text: str):
+        doc = len(self._keys)
+        tokens = tokenize(text)
+        counts: Dict[str, int] = {}
+        for token in tokens:
+            counts[token] = counts.get(token, 0) + 1
+        for term, freq in counts.items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = _Postings()
+            postings.append(doc, freq)
+        self._keys.append(key)
+        self._doc_of[key] = doc
+        self._doc_keys.setdefault(key[0], set()).add(key)
+        self._lengths.append(len(tokens))
+        self._alive.append(1)
+        self._total_length += len(tokens)
+        self._norm = None
+
+    def add(self, items: List[Tuple[Tuple[str, int], str]]):
+        """Indexes (chunk key, content) pairs; an existing key is replaced."""
+        with self._lock:
+            for key, text in items:
+                self._drop(key)
+                self._add(key, text)
+            self._maybe_compact()
+
+    def discard(self, document_id: str, min_chunk_index: int = 0):
+        with self._lock:
+            for key in [key for key in self._doc_keys.get(document_id, ()) if key[1] >= min_chunk_index]:
+                self._drop(key)
+            self._maybe_compact()
+
+    def _maybe_compact(self):
+        dead = len(self._keys) - len(self._doc_of)
+        if dead < 1000 or dead < len(self._keys) / 3:
+            return
+        alive = np.frombuffer(self._alive, dtype=np.uint8).astype(bool)
+        new_ids = np.cumsum(alive) - 1
+        for term in list(self._postings):
+            docs, freqs = self._postings[term].decode()
+            keep = alive[docs]
+            if keep.any():
+                self._postings[term] = _Postings.from_arrays(new_ids[docs[keep]], freqs[keep])
+            else:
+                del self._postings[term]
+        kept = np.flatnonzero(alive).tolist()
+        self._keys = [self._keys[doc] for doc in kept]
+        self._doc_of = {key: doc for doc, key in enumerate(self._keys)}
+        self._lengths = array("I", (self._lengths[doc] for doc in kept))
+        self._alive = array("B", [1]) * len(kept)
+        self._norm = None
+
+    def search(self, query: str, k: int) -> List[Tuple[Tuple[str, int], float]]:
+        """Top-k (chunk key, BM25 score) for the query's terms."""
+        terms = set(tokenize(query))
+        with self._lock:
+            live = len(self._doc_of)
+            if not live or not terms:
+                return []
+            if self._norm is None:
+                lengths = np.frombuffer(self._lengths, dtype=np.uint32).astype(np.float32)
+                self._norm = self.k1 * (1 - self.b + self.b * lengths / max(self._total_length / live, 1.0))
+            norm = self._norm
+            doc_parts, score_parts = [], []
+            for term in terms:
+                postings = self._postings.get(term)
+                if postings is None:
+                    continue
+                docs, freqs = postings.decode()
+                idf = math.log(1 + (live - len(docs) + 0.5) / (len(docs) + 0.5))
+                freqs = freqs.astype(np.float32)
+                doc_parts.append(docs)
+                score_parts.append(idf * freqs * (self.k1 + 1) / (freqs + norm[docs]))
+            if not doc_parts:
+                return []
+            docs = np.concatenate(doc_parts)
+            scores = np.bincount(docs, weights=np.concatenate(score_parts), minlength=len(self._keys))
+            scores[np.frombuffer(self._alive, dtype=np.uint8) == 0] = 0
+            candidates = np.flatnonzero(scores)
+            if len(candidates) > k:
+                candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+            candidates = candidates[np.argsort(-scores[candidates])]
+            return [(self._keys[doc], float(scores[doc])) for doc in candidates]
+
+    def min_document_frequency(self, query: str) -> Optional[int]:
+        """Chunks containing the query's rarest indexed term, or None if no term is indexed."""
+        with self._lock:
+            counts = [len(self._postings[term].freqs) for term in set(tokenize(query)) if term in self._postings]
+        return min(counts) if counts else None
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "chunks": len(self._doc_of),
+            "terms": len(self._postings),
+            "postings": sum(len(p.freqs) for p in self._postings.values()),
+            "postings_bytes": sum(len(p.gaps) + 2 * len(p.freqs) for p in self._postings.values()),
+        }
+
+def reciprocal_rank_fusion(rankings: List[List[Tuple[str, int]]], k: int = 60) -> List[Tuple[Tuple[str, int], float]]:
+    """Fuses ranked key lists: each key scores the sum of 1 / (k + rank) over the lists it appears in."""
+    scores: Dict[Tuple[str, int], float] = {}
+    for ranking in rankings:
+        for rank, key in enumerate(ranking, start=1):
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
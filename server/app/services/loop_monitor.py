@@ -0,0 +1,59 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Dict, Optional
+
+from app.core.config import get_settings
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+class LoopLagMonitor:
+    """
+    Measures event-loop responsiveness: a task sleeps for `interval` seconds and records
+    how much later than requested it woke up. Sustained lag means something is blocking the loop.
+    """
+    def __init__(self, interval: float, window: int = 600, warn_threshold: float = 0.25):
+        self.interval = interval
+        self.warn_threshold = warn_threshold
+        self._samples: deque = deque(maxlen=window)
+        self._max_lag = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self):
+        while True:
+            started_at = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.perf_counter() - started_at - self.interval)
+            self._samples.append(lag)
+            self._max_lag = max(self._max_lag, lag)
+            if lag >= self.warn_threshold:
+                logger.warning(f"Event loop lagged {lag * 1000:.0f}ms.")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        samples = sorted(self._samples)
+        if not samples:
+            return {"samples": 0}
+        return {
+            "samples": len(samples),
+            "last_ms": round(self._samples[-1] * 1000, 1),
+            "mean_ms": round(1000 * sum(samples) / len(samples), 1),
+            "p99_ms": round(1000 * samples[min(len(samples) - 1, int(len(samples) * 0.99))], 1),
+            "max_ms": round(self._max_lag * 1000, 1),
+        }
+
+loop_monitor = LoopLagMonitor(settings.LOOP_LAG_INTERVAL)
@@ -0,0 +1,49 @@
+import asyncio
+import logging
+import time
+from typing import Dict, Tuple
+
+from app.core.clients import client_manager
+from app.core.config import get_settings
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+class ClassroomMembership:
+    """
+    Answers whether a user belongs to a classroom (owner, admin or student).
+    Answers are cached for MEMBERSHIP_CACHE_TTL seconds so read-heavy endpoints such
+    as search don't query three tables per request.
+    """
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        # (classroom_id, user_id) -> (expires_at, is_member)
+        self._cache: Dict[Tuple[int, str], Tuple[float, bool]] = {}
+
+    async def _lookup(self, classroom_id: int, user_id: str) -> bool:
+        supabase = client_manager.get_supabase_client()
+        owner_res, admin_res, student_res = await asyncio.gather(
+            asyncio.to_thread(supabase.table("classrooms").select("owner_id").eq("id", classroom_id).execute),
+            asyncio.to_thread(supabase.table("admins_of_classrooms").select("id").eq("classroom_id", classroom_id).eq("profile_id", user_id).execute),
+            asyncio.to_thread(supabase.table("students_of_classrooms").select("id").eq("classroom_id", classroom_id).eq("profile_id", user_id).execute),
+        )
+        is_owner = bool(owner_res.data) and owner_res.data[0].get('owner_id') == user_id
+        return is_owner or bool(admin_res.data) or bool(student_res.data)
+
+    async def is_member(self, classroom_id: int, user_id: str) -> bool:
+        key = (classroom_id, user_id)
+        cached = self._cache.get(key)
+        now = time.monotonic()
+        if cached and cached[0] > now:
+            return cached[1]
+        try:
+            member = await self._lookup(classroom_id, user_id)
+        except Exception as e:
+            logger.error(f"Error verifying membership of classroom {classroom_id}: {e}")
+            return False
+        if len(self._cache) > 10_000:
+            self._cache = {k: v for k, v in self._cache.items() if v[0] > now}
+        self._cache[key] = (now + self.ttl, member)
+        return member
+
+classroom_membership = ClassroomMembership(settings.MEMBERSHIP_CACHE_TTL)
@@ -0,0 +1,90 @@
+import asyncio
+import logging
+import os
+from typing import Dict, List, Optional, Union
+
+from app.core.config import get_settings
+from app.services.compute_pool import compute_pool
+from app.services.compute_tasks import pdf_page_count, read_pdf_layouts, render_pages_jpeg, slice_pdf
+from app.services.content_cache import content_hash, file_content_hash
+from app.services.pdf_text import PageLayout
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+class PdfSession:
+    """
+    One PDF shared by every stage that processes it.
+
+    Per-page layout is cached. Layout analysis, rendering and slicing are CPU-heavy,
+    so they run in the compute pool, with large requests split across workers. Given
+    a path, workers open the file themselves instead of receiving its bytes.
+
+        async with PdfSession(file_path) as pdf:
+            layouts = await pdf.layouts(0, pdf.page_count - 1)
+    """
+    def __init__(self, source: Union[str, bytes]):
+        self.source = source
+        self.file_hash: str = ""
+        self.size = 0
+        self.page_count = 0
+        self._layouts: Dict[int, PageLayout] = {}
+
+    async def __aenter__(self) -> "PdfSession":
+        self.page_count, self.file_hash = await asyncio.gather(
+            compute_pool.run(pdf_page_count, self.source),
+            asyncio.to_thread(file_content_hash if isinstance(self.source, str) else content_hash, self.source),
+        )
+        self.size = os.path.getsize(self.source) if isinstance(self.source, str) else len(self.source)
+        return self
+
+    async def __aexit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._layouts.clear()
+
+    async def read_bytes(self) -> bytes:
+        """The whole file; only meant for small documents."""
+        if isinstance(self.source, bytes):
+            return self.source
+        return await asyncio.to_thread(self._read, self.source)
+
+    @staticmethod
+    def _read(path: str) -> bytes:
+        with open(path, "rb") as f:
+            return f.read()
+
+    async def _map_pages(self, func, page_indices: List[int], min_pages_per_task: int, *args) -> list:
+        """
+        Runs `func(source, pages, *args)` in the compute pool, splitting the pages across
+        workers when there are enough of them, and concatenates the per-page results.
+        """
+        parts = max(1, min(compute_pool.max_workers, len(page_indices) // max(1, min_pages_per_task)))
+        step = -(-len(page_indices) // parts)
+        results = await asyncio.gather(*[
+            compute_pool.run(func, self.source, page_indices[i:i + step], *args) for i in range(0, len(page_indices), step)
+        ])
+        return [item for part in results for item in part]
+
+    async def layouts(self, first_page: int = 0, last_page: Optional[int] = None) -> List[PageLayout]:
+        """Layout of pages first_page..last_page (inclusive), computed once per page."""
+        last_page = self.page_count - 1 if last_page is None else min(last_page, self.page_count - 1)
+        missing = [p for p in range(first_page, last_page + 1) if p not in self._layouts]
+        if missing:
+            for layout in await self._map_pages(read_pdf_layouts, missing, settings.LAYOUT_MIN_PAGES_PER_TASK):
+                self._layouts[layout.page_idx] = layout
+        return [self._layouts[p] for p in range(first_page, last_page + 1)]
+
+    async def slice(self, start_page: int, end_page: int) -> bytes:
+        """A standalone PDF of pages start_page..end_page; only objects those pages reference are written."""
+        return await compute_pool.run(slice_pdf, self.source, start_page, end_page)
+
+    async def render_jpegs(self, page_indices: List[int]) -> List[Optional[bytes]]:
+        """JPEGs of the given pages sized to DIAGRAM_MAX_WIDTH x DIAGRAM_MAX_HEIGHT (None where rendering failed)."""
+        if not page_indices:
+            return []
+        return await self._map_pages(
+            render_pages_jpeg, list(page_indices), 2,
+            settings.DIAGRAM_MAX_WIDTH, settings.DIAGRAM_MAX_HEIGHT, settings.DIAGRAM_JPEG_QUALITY
+        )
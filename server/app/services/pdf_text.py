@@ -0,0 +1,113 @@
+import logging
+import unicodedata
+from dataclasses import dataclass
+from typing import Any, Dict, List
+
+import fitz  # PyMuPDF
+import numpy as np
+
+from app.core.config import get_settings
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+@dataclass
+class PageTextLayer:
+    """Embedded text of one PDF page plus the signals used to decide whether to trust it."""
+    page_idx: int
+    text: str
+    chars: int
+    density: float  # non-whitespace characters per 1000 pt² of page area
+    garbage_ratio: float
+    text_coverage: float
+    image_coverage: float
+    has_graphics: bool
+    quality: float
+
+    @property
+    def needs_ocr(self) -> bool:
+        if not self.chars:
+            # Scans, or text drawn as outlines; a page with no content at all is just blank.
+            return self.has_graphics
+        return self.quality < settings.TEXT_LAYER_MIN_QUALITY
+
+def _is_garbage(ch: str) -> bool:
+    # Replacement chars, private-use glyphs and unassigned/control code points come from broken font maps.
+    return ch == "\ufffd" or unicodedata.category(ch) in ("Co", "Cn", "Cc")
+
+def area_ratio(rects, page_rect: fitz.Rect) -> float:
+    """Summed area of `rects` (x0, y0, x1, y1) clipped to the page, as a fraction of the page (capped at 1)."""
+    page_area = abs(page_rect) or 1.0
+    if not len(rects):
+        return 0.0
+    boxes = np.asarray(rects, dtype=np.float64)[:, :4]
+    widths = np.clip(np.minimum(boxes[:, 2], page_rect.x1) - np.maximum(boxes[:, 0], page_rect.x0), 0, None)
+    heights = np.clip(np.minimum(boxes[:, 3], page_rect.y1) - np.maximum(boxes[:, 1], page_rect.y0), 0, None)
+    return min(1.0, float(np.sum(widths * heights)) / page_area)
+
+def grid_occupancy(rects, page_rect: fitz.Rect, cells: int = 8) -> float:
+    """
+    Fraction of a cells x cells grid over the page touched by any of `rects`. Unlike summed
+    area, this sees a diagram of thin lines and small boxes as covering the region it spans.
+    """
+    if not len(rects) or page_rect.is_empty:
+        return 0.0
+    boxes = np.asarray(rects, dtype=np.float64)[:, :4]
+    cols = (boxes[:, [0, 2]] - page_rect.x0) / page_rect.width * cells
+    rows = (boxes[:, [1, 3]] - page_rect.y0) / page_rect.height * cells
+    index = np.arange(cells)
+    # Cell k spans [k, k+1); a box touches it if it starts before k+1 and ends at or after k.
+    col_hit = (cols[:, :1] < index + 1) & (cols[:, 1:] >= index)
+    row_hit = (rows[:, :1] < index + 1) & (rows[:, 1:] >= index)
+    occupied = np.einsum("ni,nj->ij", row_hit.astype(np.int32), col_hit.astype(np.int32)) > 0
+    return float(occupied.mean())
+
+def score_page(page: fitz.Page, blocks: List[tuple], image_bboxes: List[tuple], has_drawings: bool) -> PageTextLayer:
+    """Scores a page's text layer from its text blocks (get_text("blocks"), type 0) and image bboxes."""
+    text = " ".join(" ".join(b[4].split()) for b in blocks).strip()
+    visible = [ch for ch in text if not ch.isspace()]
+    chars = len(visible)
+    garbage_ratio = sum(_is_garbage(ch) for ch in visible) / chars if chars else 0.0
+
+    page_rect = page.rect
+    density = chars / max(abs(page_rect) / 1000, 1.0)
+    text_coverage = area_ratio([b[:4] for b in blocks], page_rect)
+    image_coverage = area_ratio(image_bboxes, page_rect)
+    has_graphics = image_coverage > 0 or has_drawings
+
+    quality = 1.0 - garbage_ratio
+    if image_coverage >= settings.TEXT_LAYER_IMAGE_COVERAGE and image_coverage > text_coverage:
+        # Image-dominated pages with sparse text are likely scans or slides with text baked into pictures.
+        quality *= min(1.0, density / settings.TEXT_LAYER_MIN_DENSITY)
+
+    return PageTextLayer(
+        page_idx=page.number, text=text, chars=chars, density=round(density, 3),
+        garbage_ratio=round(garbage_ratio, 3), text_coverage=round(text_coverage, 3),
+        image_coverage=round(image_coverage, 3), has_graphics=has_graphics, quality=round(quality, 3)
+    )
+
+@dataclass
+class PageLayout:
+    """Layout facts about one page, collected in a single pass over it."""
+    page_idx: int
+    area: float
+    text_blocks: List[tuple]   # get_text("blocks") entries of type 0
+    image_bboxes: List[tuple]  # placement of each displayed image
+    drawing_items: int         # line/curve/rect items across all vector paths
+    drawing_coverage: float    # grid occupancy of vector paths, excluding page-sized frames and backgrounds
+    text_layer: PageTextLayer
+
+class ExtractionStats:
+    """Counts which path PDF pages took to get their text ("text_layer", "ocr", "ocr_cache", "blank")."""
+    def __init__(self):
+        self.pages: Dict[str, int] = {"text_layer": 0, "ocr": 0, "ocr_cache": 0, "blank": 0}
+
+    def record(self, paths: Dict[int, str]):
+        for path in paths.values():
+            self.pages[path] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        total = sum(self.pages.values())
+        return {**self.pages, "text_layer_ratio": round(self.pages["text_layer"] / total, 3) if total else 0.0}
+
+extraction_stats = ExtractionStats()
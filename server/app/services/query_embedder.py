@@ -0,0 +1,113 @@
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Set
+
+from app.core.clients import client_manager
+from app.core.config import get_settings
+from app.services.call_governor import call_governor
+from app.services.rate_limiter import count_tokens
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+def normalize_query(text: str) -> str:
+    return " ".join(text.lower().split())
+
+class QueryEmbedder:
+    """
+    Embeds search and ask queries with as few embedding requests as possible.
+
+    Normalized queries (lowercased, whitespace collapsed) are kept in an LRU cache of
+    QUERY_EMBEDDING_CACHE_SIZE. Misses wait up to QUERY_EMBEDDING_BATCH_WINDOW_MS for
+    other queries and go out together as one `aembed_documents` request (flushed early
+    at EMBEDDING_BATCH_SIZE), and concurrent requests for the same query share one
+    result, so peak traffic costs a fraction of EMBEDDING_RPM.
+    """
+    def __init__(self, cache_size: int, window: float, max_batch: int):
+        self.cache_size = cache_size
+        self.window = window
+        self.max_batch = max_batch
+        self._cache: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._waiting: Dict[str, asyncio.Future] = {}
+        self._batch: List[str] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._background: Set[asyncio.Task] = set()
+        self.requests = 0
+        self.cache_hits = 0
+        self.coalesced = 0
+        self.batches = 0
+        self.embedded = 0
+
+    async def embed(self, text: str) -> List[float]:
+        query = normalize_query(text)
+        self.requests += 1
+        vector = self._cache.get(query)
+        if vector is not None:
+            self._cache.move_to_end(query)
+            self.cache_hits += 1
+            return vector
+
+        future = self._waiting.get(query)
+        if future is not None:
+            self.coalesced += 1
+        else:
+            future = self._waiting[query] = asyncio.get_running_loop().create_future()
+            self._batch.append(query)
+            if len(self._batch) >= self.max_batch:
+                self._flush()
+            elif self._timer is None:
+                self._timer = asyncio.get_running_loop().call_later(self.window, self._flush)
+        # Shielded so one cancelled request doesn't fail the others waiting on this query.
+        return await asyncio.shield(future)
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._batch = self._batch, []
+        if batch:
+            task = asyncio.create_task(self._embed_batch(batch))
+            self._background.add(task)
+            task.add_done_callback(self._background.discard)
+
+    async def _embed_batch(self, batch: List[str]):
+        self.batches += 1
+        try:
+            vectors = await call_governor.call(
+                'embedding', client_manager.embeddings.aembed_documents, batch,
+                tokens=sum(count_tokens(query) for query in batch)
+            )
+        except Exception as e:
+            logger.error(f"Query embedding batch of {len(batch)} failed: {e}")
+            for query in batch:
+                future = self._waiting.pop(query)
+                if not future.done():
+                    future.set_exception(e)
+                # Mark retrieved; the waiting requests raise it themselves.
+                future.exception()
+            return
+
+        self.embedded += len(batch)
+        for query, vector in zip(batch, vectors):
+            self._cache[query] = vector
+            self._cache.move_to_end(query)
+            future = self._waiting.pop(query)
+            if not future.done():
+                future.set_result(vector)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "cache_hits": self.cache_hits,
+            "coalesced": self.coalesced,
+            "batches": self.batches,
+            "avg_batch_size": round(self.embedded / self.batches, 2) if self.batches else None,
+            "cached": len(self._cache),
+        }
+
+query_embedder = QueryEmbedder(
+    settings.QUERY_EMBEDDING_CACHE_SIZE, settings.QUERY_EMBEDDING_BATCH_WINDOW_MS / 1000, settings.EMBEDDING_BATCH_SIZE
+)
@@ -3,25 +3,36 @@ import fitz  # PyMuPDF
 import asyncio
 import base64
 import io
+import json
+import math
 import time
 import os
+import shutil
 import tempfile
-import docx
-import cv2
-import numpy as np
 import openai
 import yt_dlp
-from PIL import Image
-from typing import List, Tuple, Dict, Optional
+from collections import deque
+from typing import BinaryIO, List, Tuple, Dict, Optional
 from fastapi import HTTPException, UploadFile
-from moviepy.editor import VideoFileClip
+from moviepy.config import get_setting as get_moviepy_setting
 
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_core.messages import SystemMessage, HumanMessage
 
 from app.core.config import get_settings
 from app.core.clients import client_manager
-from app.services.rate_limiter import rate_limiter
+from app.services.rate_limiter import count_tokens, rate_limiter
+from app.services.call_governor import call_governor
+from app.services import compute_tasks
+from app.services.compute_pool import compute_pool
+from app.services.checkpoints import DocumentCheckpoints, checkpoint_store
+from app.services.content_cache import content_cache, content_hash
+from app.services.diagram_index import diagram_index, is_near_duplicate
+from app.services.job_store import PermanentJobError
+from app.services.layout_classifier import diagram_classifier
+from app.services.pdf_session import PdfSession
+from app.services.pdf_text import extraction_stats
+from app.services.retrieval import retrieval_index
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -33,20 +44,79 @@ logger = logging.getLogger(__name__)
 
 # --- Constants ---
 DEEPSEEK_SUMMARY_PROMPT = "Compress the following text into key points only. Remove redundant information, filler words, and repetitive content. Focus on essential technical information and main concepts. Maximum 50% of original length:"
+DEEPSEEK_BATCH_SUMMARY_PROMPT = "You will receive {count} numbered text chunks. Compress EACH chunk independently into key points only. Remove redundant information, filler words, and repetitive content. Focus on essential technical information and main concepts. Maximum 50% of the chunk's original length. Respond with ONLY a JSON array of exactly {count} strings, where element i is the compressed version of chunk i, in order."
+# Rough GPT-4o vision cost of one compressed image plus the described answer, for TPM limiting.
+IMAGE_TOKEN_ESTIMATE = 800
+DIAGRAM_RESPONSE_TOKEN_ESTIMATE = 600
+DIAGRAM_DESCRIPTION_PROMPT = "Provide a detailed description of this diagram."
 DIAGRAM_DESCRIPTION_SYSTEM_PROMPT = "You are a specialist in technical and systems analysis. Analyze the provided image, which is a technical diagram. Your description should be detailed and structured. Use markdown lists to break down the components. Identify all visible elements, including shapes, icons, labels, and text. Describe the connections, arrows, and flows between components to explain their relationships and interactions. Infer the overall purpose or function of the system depicted in the diagram based on its structure."
 
 # --- Helper Functions ---
-async def upload_file_to_blob(file_data: bytes, container_name: str, blob_name: str) -> str:
-    """Uploads a file to the specified Azure Blob Storage container."""
+async def upload_stream_to_blob(stream: BinaryIO, container_name: str, blob_name: str) -> str:
+    """
+    Uploads a file object to blob storage block by block: BLOB_BLOCK_SIZE blocks are staged
+    (up to BLOB_BLOCKS_IN_FLIGHT at once) and committed at the end, so memory use stays
+    bounded however large the file is.
+    """
+    blob_client = client_manager.blob_service_client.get_blob_client(container=container_name, blob=blob_name)
+    block_ids, in_flight = [], set()
     try:
-        blob_client = client_manager.blob_service_client.get_blob_client(container=container_name, blob=blob_name)
-        await blob_client.upload_blob(file_data, overwrite=True)
-        logger.info(f"Successfully uploaded {blob_name} to {container_name}")
+        await asyncio.to_thread(stream.seek, 0)
+        while True:
+            block = await asyncio.to_thread(stream.read, settings.BLOB_BLOCK_SIZE)
+            if not block:
+                break
+            block_id = base64.b64encode(f"{len(block_ids):08d}".encode()).decode()
+            block_ids.append(block_id)
+            in_flight.add(asyncio.create_task(call_governor.call('blob', blob_client.stage_block, block_id, block)))
+            if len(in_flight) >= settings.BLOB_BLOCKS_IN_FLIGHT:
+                done, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    task.result()
+        if in_flight:
+            await asyncio.gather(*in_flight)
+        await call_governor.call('blob', blob_client.commit_block_list, block_ids)
+        logger.info(f"Successfully uploaded {blob_name} to {container_name} ({len(block_ids)} blocks)")
         return blob_client.url
     except Exception as e:
+        for task in in_flight:
+            task.cancel()
         logger.error(f"Failed to upload {blob_name} to {container_name}: {e}")
         raise HTTPException(status_code=500, detail="Failed to upload file to cloud storage.")
 
+async def download_blob_to_file(container_name: str, blob_name: str) -> str:
+    """Streams a blob into a temporary file and returns its path; the caller removes it."""
+    blob_client = client_manager.blob_service_client.get_blob_client(container=container_name, blob=blob_name)
+    fd, path = tempfile.mkstemp(suffix=os.path.splitext(blob_name)[1], dir=settings.UPLOAD_TEMP_DIR)
+    os.close(fd)
+
+    async def _download():
+        downloader = await blob_client.download_blob()
+        # Reopened per attempt so a retried download starts from an empty file.
+        with open(path, "wb") as f:
+            async for chunk in downloader.chunks():
+                await asyncio.to_thread(f.write, chunk)
+
+    try:
+        await call_governor.call('blob', _download)
+        return path
+    except Exception:
+        os.remove(path)
+        raise
+
+async def spool_upload(file: UploadFile) -> str:
+    """Copies an upload into a temporary file block by block and returns its path; the caller removes it."""
+    fd, path = tempfile.mkstemp(suffix=os.path.splitext(file.filename or "")[1], dir=settings.UPLOAD_TEMP_DIR)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            await file.seek(0)
+            while block := await file.read(settings.BLOB_BLOCK_SIZE):
+                await asyncio.to_thread(f.write, block)
+        return path
+    except Exception:
+        os.remove(path)
+        raise
+
 def clean_text(text: str) -> str:
     return ' '.join(text.replace('\x00', '').strip().split()) if text else ""
 
@@ -62,128 +132,248 @@ def chunk_text(text: str) -> List[str]:
 async def _invoke_deepseek_summarizer(text: str) -> str:
     if not client_manager.deepseek_llm:
         return text
+    cache_key = content_hash(settings.DEEPSEEK_DEPLOYMENT_NAME, DEEPSEEK_SUMMARY_PROMPT, text)
+    cached = await content_cache.get("summary", cache_key)
+    if cached is not None:
+        return cached
+
     messages = [SystemMessage(content=DEEPSEEK_SUMMARY_PROMPT), HumanMessage(content=text)]
-    response = await client_manager.deepseek_llm.ainvoke(messages)
+    prompt_tokens = count_tokens(DEEPSEEK_SUMMARY_PROMPT) + count_tokens(text)
+    # The prompt asks for at most 50% of the input back.
+    response = await call_governor.call(
+        'deepseek', client_manager.deepseek_llm.ainvoke, messages, tokens=prompt_tokens + prompt_tokens // 2
+    )
     summary = response.content.split('</think>')[-1].strip()
-    return summary if summary else text
+    summary = summary if summary else text
+    await content_cache.set("summary", cache_key, summary)
+    return summary
+
+def _parse_batch_summaries(content: str, expected: int) -> Optional[List[str]]:
+    """Extracts the JSON array of summaries from a batched response, or None if it doesn't match."""
+    answer = content.split('</think>')[-1]
+    start, end = answer.find('['), answer.rfind(']')
+    if start == -1 or end <= start:
+        return None
+    try:
+        summaries = json.loads(answer[start:end + 1])
+    except json.JSONDecodeError:
+        return None
+    if not isinstance(summaries, list) or len(summaries) != expected or not all(isinstance(s, str) for s in summaries):
+        return None
+    return [s.strip() for s in summaries]
+
+async def _invoke_deepseek_batch_summarizer(texts: List[str]) -> List[str]:
+    """Summarizes several chunks in one request, falling back to one request per chunk if the reply can't be split."""
+    if len(texts) == 1:
+        return [await _invoke_deepseek_summarizer(texts[0])]
+
+    system_prompt = DEEPSEEK_BATCH_SUMMARY_PROMPT.format(count=len(texts))
+    body = "\n\n".join(f"### CHUNK {i + 1}\n{text}" for i, text in enumerate(texts))
+    prompt_tokens = count_tokens(system_prompt) + count_tokens(body)
+    try:
+        response = await call_governor.call(
+            'deepseek', client_manager.deepseek_llm.ainvoke,
+            [SystemMessage(content=system_prompt), HumanMessage(content=body)],
+            tokens=prompt_tokens + prompt_tokens // 2
+        )
+        summaries = _parse_batch_summaries(response.content, len(texts))
+    except Exception as e:
+        logger.warning(f"Batched summarization of {len(texts)} chunks failed: {e}")
+        summaries = None
+
+    if summaries is None:
+        logger.warning(f"Could not split batched summary of {len(texts)} chunks; summarizing them one by one.")
+        return list(await asyncio.gather(*[_invoke_deepseek_summarizer(text) for text in texts]))
+    return [summary if summary else text for summary, text in zip(summaries, texts)]
+
+async def summarize_chunks(texts: List[str]) -> List[str]:
+    """
+    Summarizes chunks with DeepSeek. With SUMMARY_BATCHING enabled, uncached chunks are
+    packed into as few requests as SUMMARY_BATCH_TOKEN_BUDGET allows.
+    """
+    if not client_manager.deepseek_llm or not texts:
+        return list(texts)
+    if not settings.SUMMARY_BATCHING:
+        return list(await asyncio.gather(*[_invoke_deepseek_summarizer(text) for text in texts]))
+
+    keys = [content_hash(settings.DEEPSEEK_DEPLOYMENT_NAME, DEEPSEEK_SUMMARY_PROMPT, text) for text in texts]
+    summaries = await content_cache.get_many("summary", keys)
+    missing = {key: text for key, text in zip(keys, texts) if key not in summaries}
+
+    batches, batch, batch_tokens = [], [], 0
+    for key, text in missing.items():
+        tokens = count_tokens(text)
+        if batch and (batch_tokens + tokens > settings.SUMMARY_BATCH_TOKEN_BUDGET or len(batch) >= settings.SUMMARY_BATCH_MAX_CHUNKS):
+            batches.append(batch)
+            batch, batch_tokens = [], 0
+        batch.append(key)
+        batch_tokens += tokens
+    if batch:
+        batches.append(batch)
+
+    results = await asyncio.gather(*[_invoke_deepseek_batch_summarizer([missing[key] for key in batch]) for batch in batches])
+    fresh = {key: summary for batch, batch_summaries in zip(batches, results) for key, summary in zip(batch, batch_summaries)}
+    await content_cache.set_many("summary", fresh)
+    summaries.update(fresh)
+    if batches:
+        logger.info(f"Summarized {len(missing)} chunks in {len(batches)} batched requests ({len(texts) - len(missing)} cached).")
+    return [summaries[key] for key in keys]
 
 async def generate_embeddings_safely(chunks: List[str]) -> List[List[float]]:
+    """Embeds chunks, only sending texts that are not already in the content cache."""
     if not chunks: return []
-    return await client_manager.embeddings.aembed_documents(chunks)
+    keys = [content_hash(settings.EMBEDDING_MODEL_DEPLOYMENT, chunk) for chunk in chunks]
+    vectors = await content_cache.get_many("embedding", keys)
+
+    missing = {key: chunk for key, chunk in zip(keys, chunks) if key not in vectors}
+    if missing:
+        # One governed request per EMBEDDING_BATCH_SIZE texts, matching how the client batches them.
+        missing_keys, missing_texts = list(missing.keys()), list(missing.values())
+        batch_size = settings.EMBEDDING_BATCH_SIZE
+        batches = [missing_texts[i:i + batch_size] for i in range(0, len(missing_texts), batch_size)]
+        results = await asyncio.gather(*[
+            call_governor.call(
+                'embedding', client_manager.embeddings.aembed_documents, batch,
+                tokens=sum(count_tokens(text) for text in batch)
+            )
+            for batch in batches
+        ])
+        new_vectors = [vector for batch_vectors in results for vector in batch_vectors]
+        fresh = dict(zip(missing_keys, new_vectors))
+        await content_cache.set_many("embedding", fresh)
+        vectors.update(fresh)
+    return [vectors[key] for key in keys]
 
 # --- Video Processing ---
 
-def compress_frame(frame: np.ndarray, max_width: int = 512, max_height: int = 512, quality: int = 60) -> bytes:
-    """Compress frame to reduce token usage for GPT-4o vision."""
-    height, width = frame.shape[:2]
-    
-    if width > max_width or height > max_height:
-        scale = min(max_width / width, max_height / height)
-        new_width = int(width * scale)
-        new_height = int(height * scale)
-        frame = cv2.resize(frame, (new_width, new_height), interpolation=cv2.INTER_AREA)
-    
-    encode_params = [cv2.IMWRITE_JPEG_QUALITY, quality]
-    _, buffer = cv2.imencode('.jpg', frame, encode_params)
-    
-    return buffer.tobytes()
+async def _extract_audio_wav(video_path: str, wav_path: str) -> bool:
+    """Decodes the audio track to 16 kHz mono PCM with ffmpeg. Returns False if there is none."""
+    process = await asyncio.create_subprocess_exec(
+        get_moviepy_setting("FFMPEG_BINARY"), "-v", "error", "-y", "-i", video_path,
+        "-vn", "-ac", "1", "-ar", "16000", "-c:a", "pcm_s16le", wav_path,
+        stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE
+    )
+    _, stderr = await process.communicate()
+    if process.returncode != 0:
+        logger.error(f"ffmpeg could not extract audio: {stderr.decode(errors='ignore').strip()[:500]}")
+        return False
+    return True
+
+def _field(obj, name: str):
+    return obj.get(name) if isinstance(obj, dict) else getattr(obj, name, None)
+
+async def _transcribe_segment(azure_client, path: str, offset_ms: int, end_ms: int) -> List[Tuple[int, int, str]]:
+    """Transcribes one audio segment and returns (start_ms, end_ms, text) per Whisper segment, on the video's timeline."""
+    def _transcribe():
+        with open(path, "rb") as audio_file:
+            return azure_client.audio.transcriptions.create(
+                model=settings.AZURE_WHISPER_DEPLOYMENT_NAME,
+                file=audio_file,
+                response_format="verbose_json"
+            )
+
+    transcript = await call_governor.call('whisper', asyncio.to_thread, _transcribe)
+    segments = _field(transcript, "segments") or []
+    if not segments:
+        text = clean_text(_field(transcript, "text") or "")
+        return [(offset_ms, end_ms, text)] if text else []
+    return [
+        (offset_ms + int(_field(seg, "start") * 1000), offset_ms + int(_field(seg, "end") * 1000), clean_text(_field(seg, "text")))
+        for seg in segments if clean_text(_field(seg, "text"))
+    ]
+
+def _group_transcript(pieces: List[Tuple[int, int, str]], max_chars: int) -> List[Tuple[int, int, str]]:
+    """Merges consecutive Whisper segments into chunks of up to `max_chars`, keeping their time span."""
+    groups = []
+    for start_ms, end_ms, text in pieces:
+        if groups and len(groups[-1][2]) + len(text) + 1 <= max_chars:
+            groups[-1] = (groups[-1][0], end_ms, f"{groups[-1][2]} {text}")
+        else:
+            groups.append((start_ms, end_ms, text))
+    return groups
 
 async def transcribe_audio(video_path: str) -> List[Dict]:
+    """
+    Transcribes a video's audio. The track is split on silence into segments of at most
+    WHISPER_SEGMENT_MAX_SECONDS, which are transcribed concurrently (under the Whisper
+    limits) with segment-level timestamps, then grouped into timestamped chunks. Failed
+    segments are skipped; if every segment fails, the error is raised.
+    """
     logger.info("Extracting audio and transcribing...")
     start_time = time.time()
-    
+
+    if not all([settings.AZURE_WHISPER_ENDPOINT, settings.AZURE_WHISPER_API_KEY, settings.AZURE_WHISPER_API_VERSION, settings.AZURE_WHISPER_DEPLOYMENT_NAME]):
+        logger.error("Azure Whisper credentials not found or incomplete in .env file.")
+        return []
+
+    work_dir = tempfile.mkdtemp(prefix="audio_")
     try:
-        if not all([settings.AZURE_WHISPER_ENDPOINT, settings.AZURE_WHISPER_API_KEY, settings.AZURE_WHISPER_API_VERSION, settings.AZURE_WHISPER_DEPLOYMENT_NAME]):
-            logger.error("Azure Whisper credentials not found or incomplete in .env file.")
+        wav_path = os.path.join(work_dir, "audio.wav")
+        if not await _extract_audio_wav(video_path, wav_path):
             return []
-        
-        audio = VideoFileClip(video_path).audio
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".mp3") as temp_audio_file:
-            audio.write_audiofile(
-                temp_audio_file.name, 
-                codec="mp3", 
-                bitrate="64k",
-                verbose=False, 
-                logger=None
-            )
-            temp_audio_path = temp_audio_file.name
-        
+        segments = await compute_pool.run(
+            compute_tasks.split_audio_on_silence, wav_path, work_dir, settings.WHISPER_SEGMENT_MAX_SECONDS,
+            timeout=settings.COMPUTE_VIDEO_TASK_TIMEOUT
+        )
+
         azure_client = openai.AzureOpenAI(
             azure_endpoint=settings.AZURE_WHISPER_ENDPOINT,
             api_key=settings.AZURE_WHISPER_API_KEY,
             api_version=settings.AZURE_WHISPER_API_VERSION
         )
+        results = await asyncio.gather(
+            *[_transcribe_segment(azure_client, path, seg_start, seg_end) for seg_start, seg_end, path in segments],
+            return_exceptions=True
+        )
+        pieces, errors = [], []
+        for (seg_start, seg_end, _), result in zip(segments, results):
+            if isinstance(result, Exception):
+                logger.error(f"Transcription failed for audio {seg_start/1000:.0f}s-{seg_end/1000:.0f}s: {result}")
+                errors.append(result)
+            else:
+                pieces.extend(result)
+        # A failure of every segment is the service, not the audio: let the job be retried.
+        if segments and len(errors) == len(segments):
+            raise RuntimeError(f"Transcription failed for all {len(segments)} audio segments.") from errors[0]
+        if not pieces:
+            return []
 
-        with open(temp_audio_path, "rb") as audio_file:
-            transcript = await asyncio.to_thread(
-                azure_client.audio.transcriptions.create,
-                model=settings.AZURE_WHISPER_DEPLOYMENT_NAME,
-                file=audio_file
-            )
-        os.remove(temp_audio_path)
-        
-        full_text = clean_text(transcript.text)
-        summarized_text = await _invoke_deepseek_summarizer(full_text)
-        chunks = chunk_text(summarized_text)
-        
-        duration = audio.duration
-        result = [{"type": "transcript", "timestamp": int((i / len(chunks)) * duration * 1000), "content": chunk} for i, chunk in enumerate(chunks)]
-        
-        return result
-    except Exception as e:
-        logger.error(f"Error during audio transcription: {e}")
-        return []
+        groups = _group_transcript(sorted(pieces), settings.MAX_CHUNK_SIZE)
+        summaries = await summarize_chunks([text for _, _, text in groups])
+        logger.info(f"Transcribed {len(segments)} audio segments into {len(groups)} chunks in {time.time() - start_time:.1f}s.")
+        return [
+            {"type": "transcript", "timestamp": start_ms, "end_timestamp": end_ms, "content": summary}
+            for (start_ms, end_ms, _), summary in zip(groups, summaries)
+        ]
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
 
 async def extract_key_frames(video_path: str) -> List[Tuple[int, bytes]]:
     logger.info("Extracting key-frames...")
-    key_frames = []
-    cap = cv2.VideoCapture(video_path)
-    
-    fps = cap.get(cv2.CAP_PROP_FPS)
-    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-    
-    interval_seconds = 20
-    frame_interval = int(fps * interval_seconds) if fps > 0 else 300
-    
-    frame_positions = list(range(0, total_frames, frame_interval))
-    if 0 not in frame_positions:
-        frame_positions.insert(0, 0)
-    if total_frames - 1 not in frame_positions:
-        frame_positions.append(total_frames - 1)
-    
-    prev_gray = None
-    difference_threshold = 30.0
-    
-    for frame_pos in frame_positions:
-        cap.set(cv2.CAP_PROP_POS_FRAMES, frame_pos)
-        ret, frame = cap.read()
-        
-        if ret:
-            timestamp = cap.get(cv2.CAP_PROP_POS_MSEC)
-            gray_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-            
-            if prev_gray is None:
-                compressed_frame = compress_frame(frame)
-                key_frames.append((int(timestamp), compressed_frame))
-                prev_gray = gray_frame
-                continue
-            
-            diff = cv2.absdiff(gray_frame, prev_gray)
-            diff_percentage = (np.mean(diff) / 255.0) * 100
-            
-            if diff_percentage >= difference_threshold:
-                compressed_frame = compress_frame(frame)
-                key_frames.append((int(timestamp), compressed_frame))
-            
-            prev_gray = gray_frame
-
-    cap.release()
+    key_frames = await compute_pool.run(
+        compute_tasks.extract_key_frames, video_path,
+        settings.KEYFRAME_ANALYSIS_FPS, settings.KEYFRAME_HIST_THRESHOLD, settings.KEYFRAME_PIXEL_THRESHOLD,
+        settings.KEYFRAME_MAX_FRAMES, settings.KEYFRAME_MIN_GAP_SECONDS,
+        timeout=settings.COMPUTE_VIDEO_TASK_TIMEOUT
+    )
+    logger.info(f"Extracted {len(key_frames)} key-frames.")
     return key_frames
 
+async def _analyze_read(document: bytes, pages: Optional[str] = None):
+    """
+    Runs Azure's prebuilt-read model on a PDF or image through the call governor.
+    `pages` (e.g. "3-5") restricts analysis to those pages of a PDF.
+    """
+    async def _analyze():
+        options = {"pages": pages} if pages else {}
+        poller = await client_manager.ocr.begin_analyze_document("prebuilt-read", document, **options)
+        return await poller.result()
+
+    return await call_governor.call('ocr', _analyze)
+
 async def ocr_key_frame(image_data: bytes) -> str:
     try:
-        poller = await client_manager.ocr.begin_analyze_document("prebuilt-read", image_data)
-        result = await poller.result()
+        result = await _analyze_read(image_data)
         return "\n".join([line.content for page in result.pages for line in page.lines])
     except Exception as e:
         logger.error(f"Error during OCR: {e}")
@@ -200,7 +390,10 @@ async def _invoke_gpt4o_diagram(image_data: bytes, prompt: str) -> str:
             {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{image_base64}"}}
         ]
     )
-    response = await client_manager.gpt4o_chat_llm.ainvoke([message])
+    response = await call_governor.call(
+        'gpt4o', client_manager.gpt4o_chat_llm.ainvoke, [message],
+        tokens=count_tokens(prompt) + IMAGE_TOKEN_ESTIMATE + DIAGRAM_RESPONSE_TOKEN_ESTIMATE
+    )
     return response.content.strip() if response.content else ""
 
 async def describe_diagram(image_data: bytes) -> str:
@@ -221,7 +414,7 @@ async def embed_and_store_video_chunks(chunks: List[Dict], video_id: str, user_i
         'document_url': f"video://{video_id}", 'classroom_id': classroom_id,
         'is_class_context': True, 'status': 'completed', 'total_chunks_in_doc': len(chunks)
     }
-    await asyncio.to_thread(supabase.table('documents_uploaded').insert(doc_record).execute)
+    await asyncio.to_thread(supabase.table('documents_uploaded').upsert(doc_record).execute)
 
     rows = []
     for i, chunk in enumerate(chunks):
@@ -230,6 +423,8 @@ async def embed_and_store_video_chunks(chunks: List[Dict], video_id: str, user_i
             "start_time_ms": chunk['timestamp'],
             "source": filename
         }
+        if chunk.get('end_timestamp') is not None:
+            metadata["end_time_ms"] = chunk['end_timestamp']
         rows.append({
             'document_id': video_id,
             'user_id': user_id,
@@ -241,18 +436,17 @@ async def embed_and_store_video_chunks(chunks: List[Dict], video_id: str, user_i
         })
         
     try:
-        supabase.table('document_chunks').insert(rows).execute()
+        await asyncio.to_thread(supabase.table('document_chunks').insert(rows).execute)
     except Exception as e:
         logger.error(f"Failed to store video chunks: {e}")
+        raise
+    await retrieval_index.add_chunks(classroom_id, rows)
 
-async def process_video(video_id: str, user_id: str, classroom_id: int, file_data: bytes, filename: str):
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".mp4") as temp_video_file:
-        temp_video_file.write(file_data)
-        temp_video_path = temp_video_file.name
-
+async def process_video(video_id: str, user_id: str, classroom_id: int, video_path: str, filename: str):
+    """Transcribes and analyses the video at `video_path`; the caller owns the file."""
     try:
-        transcript_task = asyncio.create_task(transcribe_audio(temp_video_path))
-        frames_task = asyncio.create_task(extract_key_frames(temp_video_path))
+        transcript_task = asyncio.create_task(transcribe_audio(video_path))
+        frames_task = asyncio.create_task(extract_key_frames(video_path))
         
         transcript_chunks, key_frames = await asyncio.gather(transcript_task, frames_task)
         
@@ -283,18 +477,12 @@ async def process_video(video_id: str, user_id: str, classroom_id: int, file_dat
         logger.info(f"Successfully processed and stored video {video_id}")
 
     except Exception as e:
-        supabase = client_manager.get_supabase_client()
-        await asyncio.to_thread(
-            supabase.table('videos_uploaded').update({'status': 'failed'}).eq('video_id', video_id).execute
-        )
         logger.error(f"Failed to process video {video_id}: {e}")
-    finally:
-        os.remove(temp_video_path)
-        
+        raise
+
 async def process_youtube_video(youtube_url: str, video_id: str, user_id: str, classroom_id: int):
-    temp_video_path = None
+    temp_dir = tempfile.mkdtemp(dir=settings.UPLOAD_TEMP_DIR)
     try:
-        temp_dir = tempfile.mkdtemp()
         ydl_opts = {
             'format': 'best[ext=mp4][height<=720]/best[ext=mp4]/mp4/best',
             'outtmpl': os.path.join(temp_dir, '%(title)s.%(ext)s'),
@@ -302,26 +490,20 @@ async def process_youtube_video(youtube_url: str, video_id: str, user_id: str, c
             'no_warnings': True,
         }
 
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(youtube_url, download=True)
-            video_title = info.get('title', 'Unknown Video')
+        def _download() -> dict:
+            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                return ydl.extract_info(youtube_url, download=True)
+
+        info = await asyncio.to_thread(_download)
+        video_title = info.get('title', 'Unknown Video')
 
         downloaded_files = [f for f in os.listdir(temp_dir) if f.endswith(('.mp4', '.webm', '.mkv'))]
         if not downloaded_files:
             return
             
-        temp_video_path = os.path.join(temp_dir, downloaded_files[0])
-        with open(temp_video_path, "rb") as f:
-            file_data = f.read()
-        
-        await process_video(video_id, user_id, classroom_id, file_data, video_title)
-    
+        await process_video(video_id, user_id, classroom_id, os.path.join(temp_dir, downloaded_files[0]), video_title)
     finally:
-        if temp_video_path and os.path.exists(temp_video_path):
-            os.remove(temp_video_path)
-        if 'temp_dir' in locals() and os.path.exists(temp_dir):
-            import shutil
-            shutil.rmtree(temp_dir)
+        shutil.rmtree(temp_dir, ignore_errors=True)
 
 
 # --- Core RAG Processing Functions ---
@@ -329,44 +511,55 @@ async def process_document_background(
     doc_id: str,
     user_id: str,
     classroom_id: int,
-    file_data: bytes = None,
     filename: str = None,
     content_type: str = None,
     youtube_url: str = None,
     task_type: str = "document",
+    blob_container: str = None,
+    blob_name: str = None,
     **kwargs
 ):
-    """This function runs in the background to process the document."""
+    """
+    This function runs in the background to process the document.
+    The uploaded file is streamed from blob storage to a temporary file that every stage
+    reads from. Failures are re-raised so the queue can retry the job; see mark_processing_failed.
+    """
     supabase = client_manager.get_supabase_client()
+    file_path = None
     try:
+        if blob_name:
+            file_path = await download_blob_to_file(blob_container, blob_name)
+
+        checkpoints = DocumentCheckpoints.disabled()
+        if task_type == "document":
+            checkpoints = await DocumentCheckpoints.open(doc_id, file_path)
+
         if task_type == "video":
-             await process_video(doc_id, user_id, classroom_id, file_data, filename)
+             await process_video(doc_id, user_id, classroom_id, file_path, filename)
         
         elif task_type == "youtube":
             await process_youtube_video(youtube_url, doc_id, user_id, classroom_id)
 
         elif content_type == "application/pdf":
-            pages_content, total_pages = await extract_text_from_pdf(file_data)
-            diagram_page_indices = await identify_diagram_pages(file_data)
-            diagram_data = await process_diagrams(file_data, diagram_page_indices, doc_id)
-        elif content_type == "application/vnd.openxmlformats-officedocument.wordprocessingml.document":
-            pages_content, total_pages = await extract_text_from_docx(file_data)
-            diagram_data = {}
-        elif content_type.startswith("image/"):
-            description = await _invoke_gpt4o_diagram(file_data, "Describe this image in detail.")
-            pages_content = [description]
-            total_pages = 1
-            diagram_data = {}
-        else:
-            raise ValueError(f"Unsupported content type for processing: {content_type}")
+            chunks_added, total_pages = await process_pdf_streaming(file_path, filename, doc_id, user_id, classroom_id, checkpoints)
 
-        if task_type == "document":
-            if not any(pages_content) and not diagram_data:
-                raise ValueError("No text or diagrams could be extracted from the document.")
-            
+        elif content_type == "application/vnd.openxmlformats-officedocument.wordprocessingml.document" or content_type.startswith("image/"):
+            if content_type.startswith("image/"):
+                image_data = await asyncio.to_thread(_read_file, file_path)
+                description = await checkpoints.run("extract", lambda: _invoke_gpt4o_diagram(image_data, "Describe this image in detail."))
+                pages_content, total_pages = [description], 1
+            else:
+                pages_content, total_pages = await checkpoints.run("extract", lambda: extract_text_from_docx(file_path))
+
+            if not any(pages_content):
+                raise PermanentJobError("No text or diagrams could be extracted from the document.")
             _, chunks_added = await process_and_store_chunks(
-                pages_content, diagram_data, filename, total_pages, doc_id, user_id, classroom_id
+                pages_content, {}, filename, total_pages, doc_id, user_id, classroom_id, checkpoints
             )
+        else:
+            raise PermanentJobError(f"Unsupported content type for processing: {content_type}")
+
+        if task_type == "document":
             update_record = {
                 'total_chunks_in_doc': chunks_added,
                 'total_pages': total_pages,
@@ -375,126 +568,478 @@ async def process_document_background(
             await asyncio.to_thread(
                 supabase.table('documents_uploaded').update(update_record).eq('document_id', doc_id).execute
             )
+            await checkpoints.clear()
         logger.info(f"Doc '{doc_id}': Successfully completed background processing.")
     except Exception as e:
         logger.error(f"Doc '{doc_id}': Background processing failed: {e}", exc_info=True)
-        if task_type == "document":
-            await asyncio.to_thread(
-                supabase.table('documents_uploaded').update({'status': 'failed'}).eq('document_id', doc_id).execute
-            )
-        elif task_type in ["video", "youtube"]:
-            await asyncio.to_thread(
-                supabase.table('videos_uploaded').update({'status': 'failed'}).eq('video_id', doc_id).execute
-            )
+        raise
+    finally:
+        if file_path and os.path.exists(file_path):
+            os.remove(file_path)
+
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+async def mark_processing_failed(doc_id: str, task_type: str):
+    """Flags the upload record as failed once its job will not be retried any more."""
+    supabase = client_manager.get_supabase_client()
+    if task_type == "document":
+        await asyncio.to_thread(
+            supabase.table('documents_uploaded').update({'status': 'failed'}).eq('document_id', doc_id).execute
+        )
+        await checkpoint_store.clear(doc_id)
+    elif task_type in ["video", "youtube"]:
+        await asyncio.to_thread(
+            supabase.table('videos_uploaded').update({'status': 'failed'}).eq('video_id', doc_id).execute
+        )
 
-async def extract_text_from_docx(file_data: bytes) -> Tuple[List[str], int]:
+async def extract_text_from_docx(file_path: str) -> Tuple[List[str], int]:
     """Extracts text from a .docx file."""
-    document = docx.Document(io.BytesIO(file_data))
-    text = "\n".join([para.text for para in document.paragraphs])
+    text = await compute_pool.run(compute_tasks.docx_text, file_path)
     return [text], 1
 
 
-async def extract_text_from_pdf(file_data: bytes) -> Tuple[List[str], int]:
-    with fitz.open(stream=file_data, filetype='pdf') as doc:
-        total_pages = doc.page_count
-        batch_size = 2
-        page_batches = [(i, min(i + batch_size - 1, total_pages - 1)) for i in range(0, total_pages, batch_size)]
-        
-        all_page_texts = [""] * total_pages
-        
-        async def process_batch(start_page, end_page):
-            await rate_limiter.check_and_wait('ocr')
-            try:
-                with fitz.open() as temp_doc:
-                    temp_doc.insert_pdf(doc, from_page=start_page, to_page=end_page)
-                    poller = await client_manager.ocr.begin_analyze_document("prebuilt-read", temp_doc.tobytes())
-                    result = await poller.result()
-                
-                for page in result.pages:
-                    page_idx = start_page + page.page_number - 1
-                    if page_idx < total_pages:
-                        extracted_text = clean_text("\n".join(line.content for line in page.lines))
-                        all_page_texts[page_idx] = extracted_text
-
-            except Exception as e:
-                logger.error(f"OCR: Failed to process pages {start_page+1}-{end_page+1}: {e}")
-
-        tasks = [process_batch(start, end) for start, end in page_batches]
-        await asyncio.gather(*tasks, return_exceptions=True)
-
-    return all_page_texts, total_pages
-
-async def process_diagrams(file_data: bytes, diagram_pages: List[int], document_id: str) -> Dict[int, Tuple[str, str]]:
+def _plan_ocr_batches(pages: List[int], avg_page_bytes: float, headroom: float) -> List[Tuple[int, int]]:
+    """
+    Groups sorted page indices into contiguous (start, end) OCR batches.
+
+    When the OCR limiter has headroom, pages are spread over up to OCR_CONCURRENCY
+    parallel requests; when it has little, fewer and larger requests are made. Batch
+    size stays within BATCH_SIZE..OCR_MAX_BATCH_PAGES and under OCR_MAX_BATCH_BYTES.
+    """
+    if not pages:
+        return []
+    parallel = max(1, int(min(headroom, settings.OCR_CONCURRENCY)))
+    batch_size = max(settings.BATCH_SIZE, min(math.ceil(len(pages) / parallel), settings.OCR_MAX_BATCH_PAGES))
+    batch_size = max(1, min(batch_size, int(settings.OCR_MAX_BATCH_BYTES // max(avg_page_bytes, 1.0))))
+
+    batches, run_start = [], pages[0]
+    for prev, page in zip(pages, pages[1:] + [None]):
+        if page == prev + 1 and prev - run_start + 1 < batch_size:
+            continue
+        batches.append((run_start, prev))
+        run_start = page
+    return batches
+
+async def _ocr_page_range(pdf: PdfSession, start_page: int, end_page: int) -> Dict[int, str]:
+    """OCRs one contiguous page range and returns {page_idx: text}."""
+    if pdf.size <= settings.OCR_PAGE_SELECT_MAX_BYTES:
+        # Small files are sent whole with a page selection; returned page numbers are absolute.
+        result = await _analyze_read(await pdf.read_bytes(), pages=f"{start_page+1}-{end_page+1}")
+        offset = 0
+    else:
+        result = await _analyze_read(await pdf.slice(start_page, end_page))
+        offset = start_page
+
+    texts = {}
+    for page in result.pages:
+        page_idx = offset + page.page_number - 1
+        if start_page <= page_idx <= end_page:
+            texts[page_idx] = clean_text("\n".join(line.content for line in page.lines))
+    return texts
+
+async def _ocr_batch(pdf: PdfSession, start_page: int, end_page: int, page_keys: Dict[int, str], retry_single: bool = True) -> Dict[int, str]:
+    """OCRs one planned batch, caching results under `page_keys`. Returns {page_idx: text} for the pages that succeeded."""
+    try:
+        texts = await _ocr_page_range(pdf, start_page, end_page)
+    except Exception as e:
+        if start_page == end_page:
+            if retry_single:
+                logger.warning(f"OCR: page {start_page+1} failed ({e}); retrying.")
+                return await _ocr_batch(pdf, start_page, end_page, page_keys, retry_single=False)
+            logger.error(f"OCR: page {start_page+1} failed: {e}")
+            return {}
+        # Bisect so one bad page (or an oversized payload) doesn't sink the whole batch.
+        mid = (start_page + end_page) // 2
+        logger.warning(f"OCR: pages {start_page+1}-{end_page+1} failed ({e}); retrying as {start_page+1}-{mid+1} and {mid+2}-{end_page+1}.")
+        first, second = await asyncio.gather(
+            _ocr_batch(pdf, start_page, mid, page_keys, False), _ocr_batch(pdf, mid + 1, end_page, page_keys, False)
+        )
+        return {**first, **second}
+
+    await content_cache.set_many("ocr", {page_keys[page_idx]: text for page_idx, text in texts.items()})
+    return texts
+
+class PdfTextPlan:
+    """
+    Where the text of each page comes from, decided once for a whole page set.
+
+    Pages whose embedded text layer scores well are read directly, pages OCR'd before
+    for an identical file come from the content cache, and the rest are OCR'd in
+    batches planned over the whole set, so a batch can span several pipeline groups and
+    reach OCR_MAX_BATCH_PAGES. A batch is sent when the first group needing it asks.
+    """
+    def __init__(self, pdf: PdfSession):
+        self.pdf = pdf
+        self.texts: Dict[int, str] = {}
+        self.paths: Dict[int, str] = {}
+        self._page_keys: Dict[int, str] = {}
+        self._batch_of: Dict[int, Tuple[int, int]] = {}
+        self._batches: Dict[Tuple[int, int], asyncio.Task] = {}
+
+    @classmethod
+    async def create(cls, pdf: PdfSession, pages: List[int]) -> "PdfTextPlan":
+        plan = cls(pdf)
+        plan.texts = {page_idx: "" for page_idx in pages}
+        ocr_pages = list(pages)
+        if settings.PDF_TEXT_LAYER and pages:
+            ocr_pages = []
+            for layout in await pdf.layouts(min(pages), max(pages)):
+                layer = layout.text_layer
+                if layer.page_idx not in plan.texts:
+                    continue
+                if layer.needs_ocr:
+                    ocr_pages.append(layer.page_idx)
+                else:
+                    plan.texts[layer.page_idx] = clean_text(layer.text)
+                    plan.paths[layer.page_idx] = "text_layer" if layer.chars else "blank"
+                logger.debug(
+                    f"PDF page {layer.page_idx+1}: quality={layer.quality} chars={layer.chars} density={layer.density} "
+                    f"garbage={layer.garbage_ratio} text_cov={layer.text_coverage} image_cov={layer.image_coverage} "
+                    f"-> {'ocr' if layer.needs_ocr else plan.paths[layer.page_idx]}"
+                )
+
+        # Pages already OCR'd for an identical file are served from the content cache.
+        page_keys = {page_idx: content_hash(pdf.file_hash, page_idx) for page_idx in ocr_pages}
+        cached_pages = await content_cache.get_many("ocr", list(page_keys.values()))
+        missing = []
+        for page_idx, key in page_keys.items():
+            if key in cached_pages:
+                plan.texts[page_idx] = cached_pages[key]
+                plan.paths[page_idx] = "ocr_cache"
+            else:
+                missing.append(page_idx)
+                plan.paths[page_idx] = "ocr"
+                plan._page_keys[page_idx] = key
+
+        if missing:
+            headroom = await rate_limiter.headroom('ocr')
+            batches = _plan_ocr_batches(sorted(missing), pdf.size / max(pdf.page_count, 1), headroom)
+            plan._batch_of = {page_idx: batch for batch in batches for page_idx in range(batch[0], batch[1] + 1)}
+            logger.info(f"OCR: {len(missing)} pages in {len(batches)} requests (headroom {headroom:.0f}).")
+        return plan
+
+    async def page_texts(self, first_page: int, last_page: int) -> List[str]:
+        """Texts of pages first_page..last_page, waiting for (and if needed sending) the OCR batches covering them."""
+        pages = range(first_page, last_page + 1)
+        missing = [page_idx for page_idx in pages if page_idx in self._batch_of]
+        batches = sorted({self._batch_of[page_idx] for page_idx in missing})
+        for batch in batches:
+            if batch not in self._batches:
+                self._batches[batch] = asyncio.create_task(_ocr_batch(self.pdf, *batch, self._page_keys))
+        # Shielded: a batch can serve several groups, so one group's cancellation must not cancel it.
+        ocr_texts: Dict[int, str] = {}
+        for texts in await asyncio.gather(*(asyncio.shield(self._batches[batch]) for batch in batches)):
+            ocr_texts.update(texts)
+        self.texts.update((page_idx, ocr_texts[page_idx]) for page_idx in missing if page_idx in ocr_texts)
+
+        failed_pages = [page_idx for page_idx in missing if page_idx not in ocr_texts]
+        if failed_pages:
+            if len(failed_pages) == len(missing):
+                raise RuntimeError(f"OCR failed for all {len(missing)} requested pages.")
+            logger.error(f"OCR: {len(failed_pages)} pages left empty after retries: {[p + 1 for p in failed_pages]}")
+
+        paths = {page_idx: self.paths[page_idx] for page_idx in pages}
+        extraction_stats.record(paths)
+        counts = {path: list(paths.values()).count(path) for path in sorted(set(paths.values()))}
+        logger.info(f"PDF pages {first_page+1}-{last_page+1}: {counts}")
+        return [self.texts[page_idx] for page_idx in pages]
+
+    def close(self):
+        for task in self._batches.values():
+            task.cancel()
+
+async def extract_text_from_pdf(pdf: PdfSession, first_page: int = 0, last_page: Optional[int] = None, plan: Optional[PdfTextPlan] = None) -> Tuple[List[str], int]:
+    """
+    Extracts text for pages first_page..last_page (inclusive, default: all) and returns it
+    in order, together with the document's total page count. `plan` may cover more pages
+    than requested; without one, a plan is made for just these pages.
+    """
+    last_page = pdf.page_count - 1 if last_page is None else min(last_page, pdf.page_count - 1)
+    own_plan = plan is None
+    if own_plan:
+        plan = await PdfTextPlan.create(pdf, list(range(first_page, last_page + 1)))
+    try:
+        return await plan.page_texts(first_page, last_page), pdf.page_count
+    finally:
+        if own_plan:
+            plan.close()
+
+async def _describe_diagram(image_data: bytes, page_idx: int, document_id: str) -> Tuple[str, str]:
+    """
+    Description and blob URL of a diagram image. An identical image seen before, on any
+    page, reuses both from the content cache, so only new images are described and
+    uploaded. The page is added to the chunk text by build_page_chunks.
+    """
+    cache_key = content_hash(settings.GPT4O_DEPLOYMENT_NAME, image_data)
+    cached = await content_cache.get("diagram", cache_key)
+    if cached:
+        return cached["description"], cached["image_url"]
+
+    description = await _invoke_gpt4o_diagram(image_data, DIAGRAM_DESCRIPTION_PROMPT)
+    image_url = await upload_image_to_blob(image_data, document_id, page_idx + 1)
+    if description:
+        await content_cache.set("diagram", cache_key, {"description": description, "image_url": image_url})
+    return description, image_url
+
+async def process_diagrams(pdf: PdfSession, diagram_pages: List[int], document_id: str, classroom_id: Optional[int] = None) -> Dict[int, Tuple[str, str]]:
+    """
+    Renders, uploads and describes diagram pages. Near-duplicate images (perceptual hash)
+    within this batch, or already indexed for the document or classroom, reuse the
+    existing description and blob URL instead of another GPT-4o call.
+    """
     if not diagram_pages:
         return {}
-    
+
+    images = await extract_and_compress_page_images(pdf, diagram_pages)
+    rendered = {page_idx: image for page_idx, image in zip(diagram_pages, images) if image}
+    results: Dict[int, Tuple[str, str]] = {}
+    hashes: Dict[int, Tuple[int, int]] = {}
+    # page -> page whose result it reuses, for near-duplicates inside this batch
+    duplicate_of: Dict[int, int] = {}
+
+    if settings.DIAGRAM_DEDUP and rendered:
+        try:
+            hashes = dict(zip(rendered, await asyncio.gather(*[
+                compute_pool.run(compute_tasks.image_hashes, image) for image in rendered.values()
+            ])))
+        except Exception as e:
+            logger.warning(f"Diagram hashing failed, describing every page: {e}")
+        matches = await diagram_index.find_many(classroom_id, document_id, list(hashes.values()))
+        for page_idx, match in zip(hashes, matches):
+            if match:
+                results[page_idx] = (match.description, match.image_url)
+                continue
+            original = next((p for p in hashes if p < page_idx and p not in results and p not in duplicate_of
+                             and is_near_duplicate(hashes[p], hashes[page_idx])), None)
+            if original is not None:
+                duplicate_of[page_idx] = original
+
     async def _process_single_diagram(page_idx: int):
         try:
-            compressed_image_data = await extract_and_compress_page_image(file_data, page_idx)
-            if not compressed_image_data:
-                return page_idx, None
-
-            image_url = await upload_image_to_blob(compressed_image_data, settings.AZURE_STORAGE_CONTAINER_NAME, f"{document_id}/diagram_page_{page_idx+1}.jpeg")
-            prompt = f"This diagram is from page {page_idx+1}. Provide a detailed description."
-            description = await _invoke_gpt4o_diagram(compressed_image_data, prompt)
-            return page_idx, (description, image_url)
+            return page_idx, await _describe_diagram(rendered[page_idx], page_idx, document_id)
         except Exception as e:
             logger.error(f"Failed to process diagram on page {page_idx+1}: {e}")
             return page_idx, None
 
-    tasks = [_process_single_diagram(page_idx) for page_idx in diagram_pages]
-    results = await asyncio.gather(*tasks)
-    
-    return {page_idx: result_tuple for page_idx, result_tuple in results if result_tuple is not None}
+    to_describe = [p for p in rendered if p not in results and p not in duplicate_of]
+    described = dict(await asyncio.gather(*[_process_single_diagram(page_idx) for page_idx in to_describe]))
+    reused = len(results)
+    results.update({page_idx: result for page_idx, result in described.items() if result is not None})
+    for page_idx, original in duplicate_of.items():
+        if original in results:
+            results[page_idx] = results[original]
+
+    await diagram_index.add_many(classroom_id, document_id, [
+        (page_idx, hashes[page_idx], description, image_url)
+        for page_idx, (description, image_url) in described.items()
+        if page_idx in hashes and description
+    ])
+    if reused or duplicate_of:
+        logger.info(f"Diagrams for doc '{document_id}': {len(to_describe)} described, {reused} reused from the index, {len(duplicate_of)} duplicates in batch.")
+
+    return results
 
-async def process_and_store_chunks(pages_content, diagram_data, filename, total_pages, doc_id, user_id, classroom_id):
-    all_chunks_to_process = []
+def _encode_diagram_data(diagram_data: Dict[int, Tuple[str, str]]) -> List[list]:
+    return [[page_idx, desc, url] for page_idx, (desc, url) in diagram_data.items()]
+
+def _decode_diagram_data(rows: List[list]) -> Dict[int, Tuple[str, str]]:
+    return {page_idx: (desc, url) for page_idx, desc, url in rows}
+
+def build_page_chunks(pages_content, diagram_data, filename, total_pages, doc_id, first_page: int = 0, diagram_scores: Optional[Dict[int, float]] = None) -> List[Dict]:
+    """Chunks page texts (pages_content[i] is page first_page + i) and attaches diagram descriptions."""
+    chunks = []
     base_meta = {'filename': filename, 'total_pages': total_pages, 'document_id': doc_id}
-    for i, page_text in enumerate(pages_content):
+    for offset, page_text in enumerate(pages_content):
+        i = first_page + offset
         meta = {'page_number': i + 1, **base_meta}
         content = page_text
         if i in diagram_data:
             desc, url = diagram_data[i]
-            content += f"\n\n--- DIAGRAM DESCRIPTION ---\n{desc}"
+            content += f"\n\n--- DIAGRAM DESCRIPTION (page {i + 1}) ---\n{desc}"
             meta.update({'content_type': 'text_and_diagram', 'image_url': url})
+            if diagram_scores and i in diagram_scores:
+                meta['diagram_confidence'] = diagram_scores[i]
         else:
             meta['content_type'] = 'text'
 
         if clean_text(content):
             for chunk in chunk_text(content):
-                all_chunks_to_process.append({'content': chunk, 'metadata': meta})
+                chunks.append({'content': chunk, 'metadata': meta})
+    return chunks
+
+async def process_pdf_streaming(file_path: str, filename: str, doc_id: str, user_id: str, classroom_id: int, checkpoints: DocumentCheckpoints) -> Tuple[int, int]:
+    """
+    Processes a PDF as a pipeline over groups of PIPELINE_PAGE_GROUP_SIZE pages:
+    extract (OCR + diagrams) -> summarize -> embed -> insert, with bounded queues
+    between stages and up to PIPELINE_EXTRACT_LOOKAHEAD groups extracted at once.
+    Stages overlap, peak memory holds only a few groups, and each group is
+    searchable as soon as it is inserted. Every group/stage is checkpointed,
+    so a retry skips groups that were already stored.
+    Returns (chunks_added, total_pages).
+    """
+    async with PdfSession(file_path) as pdf:
+        return await _run_pdf_pipeline(pdf, filename, doc_id, user_id, classroom_id, checkpoints)
+
+async def _run_pdf_pipeline(pdf: PdfSession, filename: str, doc_id: str, user_id: str, classroom_id: int, checkpoints: DocumentCheckpoints) -> Tuple[int, int]:
+    total_pages = pdf.page_count
+    diagram_scores = dict(await checkpoints.run("diagram_scores", lambda: identify_diagram_pages(pdf)))
+
+    group_size = max(1, settings.PIPELINE_PAGE_GROUP_SIZE)
+    groups = [(start, min(start + group_size, total_pages) - 1) for start in range(0, total_pages, group_size)]
+    extracted, summarized, embedded = (asyncio.Queue(maxsize=settings.PIPELINE_QUEUE_SIZE) for _ in range(3))
+    started_at = time.time()
+
+    # OCR batches are planned over every page still to extract, not group by group.
+    pending_pages = [
+        page_idx for k, (start, end) in enumerate(groups)
+        if f"stored:{k}" not in checkpoints.completed and f"extract:{k}" not in checkpoints.completed
+        for page_idx in range(start, end + 1)
+    ]
+    text_plan = await PdfTextPlan.create(pdf, pending_pages)
+
+    # Items are (group index, chunks); chunks is None for groups stored by an earlier attempt.
+    async def extract_group(k: int, start: int, end: int):
+        if f"stored:{k}" in checkpoints.completed:
+            return k, None
+        group_diagram_pages = [p for p in range(start, end + 1) if p in diagram_scores]
+        (pages_content, _), diagram_data = await asyncio.gather(
+            checkpoints.run(f"extract:{k}", lambda: extract_text_from_pdf(pdf, start, end, text_plan)),
+            checkpoints.run(
+                f"diagrams:{k}", lambda: process_diagrams(pdf, group_diagram_pages, doc_id, classroom_id),
+                encode=_encode_diagram_data, decode=_decode_diagram_data
+            )
+        )
+        return k, build_page_chunks(
+            pages_content, diagram_data, filename, total_pages, doc_id, first_page=start, diagram_scores=diagram_scores
+        )
+
+    async def extract_stage():
+        # Up to PIPELINE_EXTRACT_LOOKAHEAD groups are extracted at once; results are queued in group order.
+        lookahead = max(1, settings.PIPELINE_EXTRACT_LOOKAHEAD)
+        in_flight = deque()
+        try:
+            for k, (start, end) in enumerate(groups):
+                in_flight.append(asyncio.create_task(extract_group(k, start, end)))
+                if len(in_flight) >= lookahead:
+                    await extracted.put(await in_flight.popleft())
+            while in_flight:
+                await extracted.put(await in_flight.popleft())
+        finally:
+            for task in in_flight:
+                task.cancel()
+            await asyncio.gather(*in_flight, return_exceptions=True)
+        await extracted.put(None)
+
+    async def summarize_stage():
+        while (item := await extracted.get()) is not None:
+            k, chunks = item
+            if chunks:
+                summaries = await checkpoints.run(f"summaries:{k}", lambda: summarize_chunks([c['content'] for c in chunks]))
+                for chunk, summary in zip(chunks, summaries):
+                    chunk['content'] = summary
+            await summarized.put(item)
+        await summarized.put(None)
+
+    async def embed_stage():
+        while (item := await summarized.get()) is not None:
+            k, chunks = item
+            if chunks:
+                vectors = await checkpoints.run(f"embeddings:{k}", lambda: generate_embeddings_safely([c['content'] for c in chunks]))
+                for chunk, vector in zip(chunks, vectors):
+                    chunk['embedding'] = vector
+            await embedded.put(item)
+        await embedded.put(None)
+
+    async def store_stage() -> int:
+        next_index = 0
+        # A resumed run may follow an attempt whose insert landed before its checkpoint did.
+        needs_cleanup = checkpoints.resumed
+        while (item := await embedded.get()) is not None:
+            k, chunks = item
+            if chunks is None:
+                next_index += checkpoints.completed[f"stored:{k}"]
+                continue
+            count = await checkpoints.run(f"stored:{k}", lambda: store_chunks_in_supabase(
+                chunks, doc_id, user_id, classroom_id, start_index=next_index, replace_existing=needs_cleanup
+            ))
+            if chunks:
+                needs_cleanup = False
+                if next_index == 0:
+                    logger.info(f"Doc '{doc_id}': first {count} chunks searchable after {time.time() - started_at:.1f}s.")
+            next_index += count
+        return next_index
+
+    stages = [asyncio.create_task(stage()) for stage in (extract_stage, summarize_stage, embed_stage)]
+    writer = asyncio.create_task(store_stage())
+    try:
+        await asyncio.gather(*stages, writer)
+    except Exception:
+        for task in (*stages, writer):
+            task.cancel()
+        raise
+    finally:
+        text_plan.close()
+
+    chunks_added = writer.result()
+    if not chunks_added:
+        raise PermanentJobError("No text or diagrams could be extracted from the document.")
+    return chunks_added, total_pages
+
+async def process_and_store_chunks(pages_content, diagram_data, filename, total_pages, doc_id, user_id, classroom_id, checkpoints: Optional[DocumentCheckpoints] = None):
+    checkpoints = checkpoints or DocumentCheckpoints.disabled()
+    all_chunks_to_process = build_page_chunks(pages_content, diagram_data, filename, total_pages, doc_id)
     
     if not all_chunks_to_process:
         raise HTTPException(status_code=400, detail="Document content is too sparse to be processed.")
     
-    summarized_contents = await asyncio.gather(*[_invoke_deepseek_summarizer(item['content']) for item in all_chunks_to_process])
+    summarized_contents = await checkpoints.run(
+        "summaries", lambda: summarize_chunks([item['content'] for item in all_chunks_to_process])
+    )
     for i, item in enumerate(all_chunks_to_process):
         item['content'] = summarized_contents[i]
 
-    embeddings = await generate_embeddings_safely([item['content'] for item in all_chunks_to_process])
+    embeddings = await checkpoints.run(
+        "embeddings", lambda: generate_embeddings_safely([item['content'] for item in all_chunks_to_process])
+    )
     for i, item in enumerate(all_chunks_to_process):
         item['embedding'] = embeddings[i]
 
-    chunks_added = await store_chunks_in_supabase(all_chunks_to_process, doc_id, user_id, classroom_id)
+    # A resumed run may follow an attempt whose insert landed before its checkpoint did.
+    chunks_added = await checkpoints.run(
+        "stored", lambda: store_chunks_in_supabase(all_chunks_to_process, doc_id, user_id, classroom_id, replace_existing=checkpoints.resumed)
+    )
 
     return all_chunks_to_process, chunks_added
 
-async def store_chunks_in_supabase(chunk_data: List[Dict], doc_id: str, user_id: str, classroom_id: int) -> int:
+async def store_chunks_in_supabase(chunk_data: List[Dict], doc_id: str, user_id: str, classroom_id: int, start_index: int = 0, replace_existing: bool = False) -> int:
+    """
+    Inserts chunks with chunk_index starting at `start_index`. With `replace_existing`,
+    rows of this doc at or after `start_index` are deleted first, making the insert idempotent.
+    """
     if not chunk_data: return 0
     rows = [{
-        'document_id': doc_id, 'user_id': user_id, 'chunk_index': i,
+        'document_id': doc_id, 'user_id': user_id, 'chunk_index': start_index + i,
         'content': d['content'], 'embedding': d['embedding'], 'metadata': d['metadata'],
         'classroom_id': classroom_id
     } for i, d in enumerate(chunk_data)]
     try:
         supabase = client_manager.get_supabase_client()
+        if replace_existing:
+            await asyncio.to_thread(
+                supabase.table('document_chunks').delete().eq('document_id', doc_id).gte('chunk_index', start_index).execute
+            )
         res = await asyncio.to_thread(supabase.table('document_chunks').insert(rows).execute)
-        return len(res.data)
     except Exception as e:
         logger.error(f"Supabase chunk insert failed: {e}")
         raise HTTPException(status_code=500, detail="Failed to store document chunks in the database.")
+    if replace_existing:
+        await retrieval_index.discard_document(classroom_id, doc_id, start_index)
+    await retrieval_index.add_chunks(classroom_id, rows)
+    return len(res.data)
 
-def validate_file(file: UploadFile, data: bytes):
+async def validate_file(file: UploadFile, file_path: str):
     allowed_types = [
         "application/pdf",
         "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
@@ -504,69 +1049,57 @@ def validate_file(file: UploadFile, data: bytes):
     ]
     if file.content_type not in allowed_types:
         raise HTTPException(status_code=400, detail=f"Unsupported file type. Allowed types are: {', '.join(allowed_types)}")
-    if len(data) > settings.MAX_FILE_SIZE:
+    size = os.path.getsize(file_path)
+    if size > settings.MAX_FILE_SIZE:
         raise HTTPException(status_code=400, detail=f"File size exceeds limit of {settings.MAX_FILE_SIZE / 1_000_000} MB.")
-    if not data:
+    if not size:
         raise HTTPException(status_code=400, detail="Uploaded file is empty.")
     if file.content_type == "application/pdf":
         try:
-            with fitz.open(stream=data, filetype='pdf') as doc:
-                if doc.page_count == 0:
-                    raise HTTPException(status_code=400, detail="PDF has no pages.")
-                if doc.page_count > settings.MAX_PAGES:
-                    raise HTTPException(status_code=400, detail=f"PDF exceeds max pages ({settings.MAX_PAGES}).")
+            page_count = await compute_pool.run(compute_tasks.pdf_page_count, file_path)
         except Exception:
             raise HTTPException(status_code=400, detail="Invalid or corrupted PDF file.")
+        if page_count == 0:
+            raise HTTPException(status_code=400, detail="PDF has no pages.")
+        if page_count > settings.MAX_PAGES:
+            raise HTTPException(status_code=400, detail=f"PDF exceeds max pages ({settings.MAX_PAGES}).")
 
 
-def compress_image(image_data: bytes, max_width: int, max_height: int, quality: int) -> bytes:
-    with Image.open(io.BytesIO(image_data)) as img:
-        if img.mode in ('RGBA', 'LA', 'P'):
-            img = img.convert('RGB')
-        img.thumbnail((max_width, max_height), Image.Resampling.LANCZOS)
-        output = io.BytesIO()
-        img.save(output, format='JPEG', quality=quality, optimize=True)
-        return output.getvalue()
+async def validate_and_upload_document(file: UploadFile, container_name: str, blob_name: str) -> str:
+    """Spools a document upload to disk, validates it there and streams it to blob storage."""
+    file_path = await spool_upload(file)
+    try:
+        await validate_file(file, file_path)
+        with open(file_path, "rb") as f:
+            return await upload_stream_to_blob(f, container_name, blob_name)
+    finally:
+        os.remove(file_path)
 
 async def upload_image_to_blob(image_data: bytes, document_id: str, page_num: int) -> str:
     blob_name = f"{document_id}/diagram_page_{page_num}.jpeg"
     try:
         blob_client = client_manager.blob_service_client.get_blob_client(container=settings.AZURE_STORAGE_CONTAINER_NAME, blob=blob_name)
-        await blob_client.upload_blob(image_data, overwrite=True, content_type="image/jpeg")
+        await call_governor.call('blob', blob_client.upload_blob, image_data, overwrite=True, content_type="image/jpeg")
         return blob_client.url
     except Exception as e:
         logger.error(f"Failed to upload image for doc {document_id}, page {page_num}: {e}")
         raise HTTPException(status_code=500, detail="Failed to upload image")
 
-async def identify_diagram_pages(file_data: bytes) -> List[int]:
-    pages = []
-    with fitz.open(stream=file_data, filetype='pdf') as doc:
-        for num, page in enumerate(doc):
-            area, img_area, txt_area = float(abs(page.rect)), 0.0, 0.0
-            if area <= 0: continue
-            for b in page.get_text('blocks'):
-                if '<image:' in str(b[4]):
-                    img_area += abs(fitz.Rect(b[:4]))
-                else:
-                    txt_area += abs(fitz.Rect(b[:4]))
-            for i in page.get_images(full=True):
-                img_area += abs(page.get_image_bbox(i))
-            if (img_area / area > 0.4) and (txt_area / area < 0.2):
-                pages.append(num)
-    return pages
-
-async def extract_and_compress_page_image(file_data: bytes, page_num: int) -> Optional[bytes]:
+async def identify_diagram_pages(pdf: PdfSession) -> List[Tuple[int, float]]:
+    """(page_idx, confidence) for each page the layout classifier considers a diagram."""
+    diagram_pages = diagram_classifier.classify(await pdf.layouts())
+    if diagram_pages:
+        logger.info(f"Diagram pages (page, confidence): {[(page_idx + 1, score) for page_idx, score in diagram_pages]}")
+    return diagram_pages
+
+async def extract_and_compress_page_images(pdf: PdfSession, page_indices: List[int]) -> List[Optional[bytes]]:
+    """Renders the pages as diagram-sized JPEGs in one batch; None for pages that could not be rendered."""
     try:
-        with fitz.open(stream=file_data, filetype='pdf') as doc:
-            pix = await asyncio.to_thread(doc[page_num].get_pixmap, matrix=fitz.Matrix(2.0, 2.0))
-            raw_image_data = await asyncio.to_thread(pix.tobytes, output="png")
-            return await asyncio.to_thread(
-                compress_image,
-                raw_image_data,
-                settings.DIAGRAM_MAX_WIDTH,
-                settings.DIAGRAM_MAX_HEIGHT,
-                settings.DIAGRAM_JPEG_QUALITY
-            )
+        images = await pdf.render_jpegs(page_indices)
     except Exception as e:
-        logger.error(f"Could not extract/compress image from page {page_num}: {e}")
-        return None
\ No newline at end of file
+        logger.error(f"Could not render pages {[p + 1 for p in page_indices]}: {e}")
+        return [None] * len(page_indices)
+    for page_idx, image in zip(page_indices, images):
+        if image is None:
+            logger.error(f"Could not extract/compress image from page {page_idx+1}")
+    return images
@@ -1,63 +1,249 @@
 import asyncio
 import logging
-from typing import Dict
+import time
+from dataclasses import dataclass, replace
+from typing import Dict, Optional
 
+from app.core.clients import client_manager
 from app.core.config import get_settings
+from app.utils.sqlite import SQLiteStore
 
 logger = logging.getLogger(__name__)
 settings = get_settings()
 
-class ServiceRateLimiter:
-    """Manages a queue of requests for a single service to enforce a burst-then-sleep pattern."""
-    def __init__(self, service_name: str, burst_limit: int, sleep_interval: int):
-        self.service_name = service_name
-        self.burst_limit = burst_limit
-        self.sleep_interval = sleep_interval
-        self.queue = asyncio.Queue()
-        self.worker_task = asyncio.create_task(self._worker())
-
-    async def _worker(self):
-        """Processes requests from the queue, enforcing burst limits and sleep intervals."""
-        request_count = 0
-        while True:
-            future = await self.queue.get()
+# Floor for the adaptive rate after repeated 429s, as a fraction of the configured rate.
+MIN_RATE_SCALE = 0.1
+# Additive recovery of the rate scale per successful call.
+RATE_SCALE_RECOVERY = 0.01
+# Used when a 429 carries no Retry-After header.
+DEFAULT_RETRY_AFTER = 10.0
+
+def count_tokens(text: str) -> int:
+    """Counts tokens the way the OpenAI deployments bill them (cl100k_base)."""
+    return len(client_manager.encoding.encode(text)) if text else 0
+
+def retry_after_from_error(error: Exception) -> Optional[float]:
+    """
+    Returns the Retry-After delay (seconds) if `error` is a 429 from an OpenAI or Azure SDK,
+    DEFAULT_RETRY_AFTER if it is a 429 without the header, and None for any other error.
+    """
+    response = getattr(error, "response", None)
+    status_code = getattr(error, "status_code", None) or getattr(response, "status_code", None)
+    if status_code != 429:
+        return None
+    headers = getattr(response, "headers", None) or {}
+    for header in ("retry-after-ms", "Retry-After", "retry-after"):
+        value = headers.get(header)
+        if value is None:
+            continue
+        try:
+            return float(value) / 1000 if header == "retry-after-ms" else float(value)
+        except ValueError:
+            continue
+    return DEFAULT_RETRY_AFTER
+
+@dataclass
+class ServiceLimits:
+    """Requests-per-minute and tokens-per-minute budget of one service (0 TPM = unmetered)."""
+    rpm: int
+    tpm: int = 0
+    burst_seconds: float = 10.0
+
+    @property
+    def request_capacity(self) -> float:
+        return max(1.0, self.rpm * self.burst_seconds / 60)
+
+    @property
+    def token_capacity(self) -> float:
+        return max(1.0, self.tpm * self.burst_seconds / 60)
+
+@dataclass
+class BucketState:
+    """
+    Token-bucket state for one service: a request bucket and a token bucket.
+
+    Reservations may drive a bucket negative; the caller then sleeps until the
+    debt has been refilled, which keeps callers in FIFO order without a worker task.
+    """
+    request_tokens: float
+    token_tokens: float
+    updated_at: float
+    blocked_until: float = 0.0
+    scale: float = 1.0
+
+    @classmethod
+    def full(cls, limits: ServiceLimits, now: float) -> "BucketState":
+        return cls(limits.request_capacity, limits.token_capacity, now)
+
+    def _refill(self, limits: ServiceLimits, now: float):
+        elapsed = max(0.0, now - self.updated_at)
+        self.request_tokens = min(limits.request_capacity, self.request_tokens + elapsed * limits.rpm * self.scale / 60)
+        if limits.tpm:
+            self.token_tokens = min(limits.token_capacity, self.token_tokens + elapsed * limits.tpm * self.scale / 60)
+        self.updated_at = now
+
+    def reserve(self, limits: ServiceLimits, now: float, requests: int, tokens: int) -> float:
+        """Takes `requests` and `tokens` from the buckets and returns how long to wait before calling."""
+        self._refill(limits, now)
+        self.request_tokens -= requests
+        wait = max(0.0, -self.request_tokens * 60 / (limits.rpm * self.scale))
+        if limits.tpm and tokens:
+            self.token_tokens -= tokens
+            wait = max(wait, -self.token_tokens * 60 / (limits.tpm * self.scale))
+        return max(wait, self.blocked_until - now)
+
+    def available(self, limits: ServiceLimits, now: float) -> float:
+        """Requests that could be sent right now without waiting, without reserving any."""
+        if now < self.blocked_until:
+            return 0.0
+        state = replace(self)
+        state._refill(limits, now)
+        return max(0.0, state.request_tokens)
+
+    # Refill at the old rate before changing `scale`, so the change isn't applied retroactively.
+    def throttled(self, limits: ServiceLimits, now: float, retry_after: float):
+        self._refill(limits, now)
+        self.blocked_until = max(self.blocked_until, now + retry_after)
+        self.scale = max(MIN_RATE_SCALE, self.scale * 0.5)
+
+    def succeeded(self, limits: ServiceLimits, now: float):
+        self._refill(limits, now)
+        self.scale = min(1.0, self.scale + RATE_SCALE_RECOVERY)
+
+class MemoryBucketBackend:
+    """Keeps bucket state in this process only."""
+    def __init__(self):
+        self._states: Dict[str, BucketState] = {}
+
+    def _state(self, service: str, limits: ServiceLimits) -> BucketState:
+        if service not in self._states:
+            self._states[service] = BucketState.full(limits, time.time())
+        return self._states[service]
+
+    async def reserve(self, service: str, limits: ServiceLimits, requests: int, tokens: int) -> float:
+        return self._state(service, limits).reserve(limits, time.time(), requests, tokens)
+
+    async def throttled(self, service: str, limits: ServiceLimits, retry_after: float):
+        self._state(service, limits).throttled(limits, time.time(), retry_after)
+
+    async def available(self, service: str, limits: ServiceLimits) -> float:
+        return self._state(service, limits).available(limits, time.time())
+
+    async def succeeded(self, service: str, limits: ServiceLimits):
+        self._state(service, limits).succeeded(limits, time.time())
+
+class SQLiteBucketBackend(SQLiteStore):
+    """
+    Shares bucket state between worker processes on the same host through a SQLite file.
+    Each update runs in a `BEGIN IMMEDIATE` transaction, so reservations are serialized.
+    """
+    schema = """
+    CREATE TABLE IF NOT EXISTS rate_limit_buckets (
+        service TEXT PRIMARY KEY,
+        request_tokens REAL NOT NULL,
+        token_tokens REAL NOT NULL,
+        updated_at REAL NOT NULL,
+        blocked_until REAL NOT NULL,
+        scale REAL NOT NULL
+    );
+    """
+
+    def _update(self, service: str, limits: ServiceLimits, mutate) -> BucketState:
+        now = time.time()
+        with self._connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
             try:
-                if request_count >= self.burst_limit:
-                    logger.info(f"Burst limit of {self.burst_limit} hit for {self.service_name}. Waiting for {self.sleep_interval} seconds.")
-                    await asyncio.sleep(self.sleep_interval)
-                    request_count = 0  # Reset after sleeping
-
-                if not future.cancelled():
-                    future.set_result(None)
-                
-                request_count += 1
-
-            except Exception as e:
-                logger.error(f"Error in {self.service_name} rate limiter worker: {e}")
-                if not future.done():
-                    future.set_exception(e)
-            finally:
-                self.queue.task_done()
-
-    async def check_and_wait(self):
-        """Adds a request to the queue and waits for it to be processed."""
-        future = asyncio.Future()
-        await self.queue.put(future)
-        await future
+                row = conn.execute(
+                    "SELECT request_tokens, token_tokens, updated_at, blocked_until, scale FROM rate_limit_buckets WHERE service = ?",
+                    (service,)
+                ).fetchone()
+                state = BucketState(*row) if row else BucketState.full(limits, now)
+                result = mutate(state, now)
+                conn.execute(
+                    "INSERT OR REPLACE INTO rate_limit_buckets VALUES (?, ?, ?, ?, ?, ?)",
+                    (service, state.request_tokens, state.token_tokens, state.updated_at, state.blocked_until, state.scale)
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return result
+
+    def _available(self, service: str, limits: ServiceLimits) -> float:
+        now = time.time()
+        with self._connection() as conn:
+            row = conn.execute(
+                "SELECT request_tokens, token_tokens, updated_at, blocked_until, scale FROM rate_limit_buckets WHERE service = ?",
+                (service,)
+            ).fetchone()
+        state = BucketState(*row) if row else BucketState.full(limits, now)
+        return state.available(limits, now)
+
+    async def available(self, service: str, limits: ServiceLimits) -> float:
+        return await asyncio.to_thread(self._available, service, limits)
+
+    async def reserve(self, service: str, limits: ServiceLimits, requests: int, tokens: int) -> float:
+        return await asyncio.to_thread(
+            self._update, service, limits, lambda state, now: state.reserve(limits, now, requests, tokens)
+        )
+
+    async def throttled(self, service: str, limits: ServiceLimits, retry_after: float):
+        await asyncio.to_thread(self._update, service, limits, lambda state, now: state.throttled(limits, now, retry_after))
+
+    async def succeeded(self, service: str, limits: ServiceLimits):
+        await asyncio.to_thread(self._update, service, limits, lambda state, now: state.succeeded(limits, now))
 
 class RateLimiter:
-    """Manages all service rate limiters."""
+    """
+    Per-service token-bucket rate limiter enforcing both RPM and TPM from Settings.
+
+    Call `acquire(service, tokens)` before each request, and report 429s with
+    `report_throttled` so the limiter pauses for Retry-After and halves its rate,
+    which then recovers gradually through `report_success`.
+    """
     def __init__(self, settings):
-        self.limiters: Dict[str, ServiceRateLimiter] = {
-            'ocr': ServiceRateLimiter(service_name='ocr', burst_limit=60, sleep_interval=20),
-            'embedding': ServiceRateLimiter(service_name='embedding', burst_limit=150, sleep_interval=60),
-            'gpt4o': ServiceRateLimiter(service_name='gpt4o', burst_limit=20, sleep_interval=60),
-            'deepseek': ServiceRateLimiter(service_name='deepseek', burst_limit=120, sleep_interval=60)
+        burst = settings.RATE_LIMIT_BURST_SECONDS
+        self.limits: Dict[str, ServiceLimits] = {
+            'ocr': ServiceLimits(settings.OCR_RPM, burst_seconds=burst),
+            'embedding': ServiceLimits(settings.EMBEDDING_RPM, settings.EMBEDDING_TPM, burst),
+            'gpt4o': ServiceLimits(settings.GPT4O_RPM, settings.GPT4O_TPM, burst),
+            'deepseek': ServiceLimits(settings.DEEPSEEK_RPM, settings.DEEPSEEK_TPM, burst),
+            'whisper': ServiceLimits(settings.WHISPER_RPM, burst_seconds=burst),
         }
+        if settings.RATE_LIMIT_BACKEND.lower() == "sqlite":
+            self.backend = SQLiteBucketBackend(settings.RATE_LIMIT_STATE_PATH)
+        else:
+            self.backend = MemoryBucketBackend()
+
+    async def acquire(self, service: str, tokens: int = 0):
+        """Waits until one request carrying `tokens` tokens may be sent to `service`."""
+        limits = self.limits.get(service)
+        if not limits:
+            return
+        wait = await self.backend.reserve(service, limits, 1, tokens)
+        if wait > 0:
+            if wait >= 1:
+                logger.info(f"Rate limit for {service}: waiting {wait:.1f}s.")
+            await asyncio.sleep(wait)
+
+    async def headroom(self, service: str) -> float:
+        """How many requests `service` could take right now without waiting (inf if unlimited)."""
+        limits = self.limits.get(service)
+        if not limits:
+            return float("inf")
+        return await self.backend.available(service, limits)
+
+    async def report_throttled(self, service: str, retry_after: Optional[float] = None):
+        limits = self.limits.get(service)
+        if not limits:
+            return
+        retry_after = DEFAULT_RETRY_AFTER if retry_after is None else retry_after
+        logger.warning(f"{service} returned 429; pausing for {retry_after:.1f}s and reducing its rate.")
+        await self.backend.throttled(service, limits, retry_after)
 
-    async def check_and_wait(self, service: str):
-        limiter = self.limiters.get(service)
-        if limiter:
-            await limiter.check_and_wait()
+    async def report_success(self, service: str):
+        limits = self.limits.get(service)
+        if limits:
+            await self.backend.succeeded(service, limits)
 
-rate_limiter = RateLimiter(settings)
\ No newline at end of file
+rate_limiter = RateLimiter(settings)
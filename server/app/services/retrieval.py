@@ -0,0 +1,448 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+from app.core.clients import client_manager
+from app.core.config import get_settings
+from app.services.lexical import BM25Index, reciprocal_rank_fusion
+from app.services.query_embedder import query_embedder
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+# (document_id, chunk_index), unique per chunk in document_chunks.
+ChunkKey = Tuple[str, int]
+
+CHUNK_COLUMNS = "document_id, chunk_index, content, metadata, embedding"
+
+@dataclass
+class SearchHit:
+    document_id: str
+    chunk_index: int
+    content: str
+    metadata: Dict[str, Any]
+    score: float
+
+def as_vector(embedding) -> np.ndarray:
+    """float32 vector from a pgvector value (a '[...]' string over PostgREST) or a list of floats."""
+    if isinstance(embedding, str):
+        embedding = json.loads(embedding)
+    return np.asarray(embedding, dtype=np.float32)
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=-1, keepdims=True), 1e-12)
+
+def _nearest(vectors: np.ndarray, centroids: np.ndarray, batch: int = 8192) -> np.ndarray:
+    """Index of the most similar centroid for each (normalized) vector."""
+    labels = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), batch):
+        labels[start:start + batch] = np.argmax(vectors[start:start + batch] @ centroids.T, axis=1)
+    return labels
+
+def _group(labels: np.ndarray, count: int) -> List[np.ndarray]:
+    """Positions of each label 0..count-1, from one stable sort."""
+    order = np.argsort(labels, kind="stable")
+    bounds = np.searchsorted(labels[order], np.arange(count + 1))
+    return [order[bounds[i]:bounds[i + 1]] for i in range(count)]
+
+def _kmeans(sample: np.ndarray, clusters: int, iterations: int = 10, seed: int = 0) -> np.ndarray:
+    """Spherical k-means: centroids are kept unit length so a dot product ranks them."""
+    rng = np.random.default_rng(seed)
+    centroids = sample[rng.choice(len(sample), clusters, replace=False)].copy()
+    for _ in range(iterations):
+        members = _group(_nearest(sample, centroids), clusters)
+        for cluster, positions in enumerate(members):
+            if len(positions):
+                centroids[cluster] = sample[positions].sum(axis=0)
+            else:
+                centroids[cluster] = sample[rng.integers(len(sample))]
+        centroids = _normalize(centroids)
+    return centroids
+
+class _InvertedList:
+    """Vectors of one partition stored contiguously, with their row ids; grows by doubling."""
+    def __init__(self, dim: int, capacity: int = 64):
+        self.vectors = np.empty((capacity, dim), dtype=np.float32)
+        self.rows = np.empty(capacity, dtype=np.int64)
+        self.size = 0
+
+    def append(self, vectors: np.ndarray, rows: np.ndarray):
+        needed = self.size + len(rows)
+        if needed > len(self.rows):
+            capacity = max(needed, 2 * len(self.rows))
+            grown_vectors = np.empty((capacity, self.vectors.shape[1]), dtype=np.float32)
+            grown_rows = np.empty(capacity, dtype=np.int64)
+            grown_vectors[:self.size], grown_rows[:self.size] = self.vectors[:self.size], self.rows[:self.size]
+            # Swapped in whole so a reader holding the old arrays keeps a consistent view.
+            self.vectors, self.rows = grown_vectors, grown_rows
+        self.vectors[self.size:needed] = vectors
+        self.rows[self.size:needed] = rows
+        self.size = needed
+
+    def view(self) -> Tuple[np.ndarray, np.ndarray]:
+        return self.vectors[:self.size], self.rows[:self.size]
+
+class VectorIndex:
+    """
+    Cosine-similarity index over one classroom's chunks.
+
+    Below RETRIEVAL_IVF_MIN_VECTORS chunks every vector is scored with one matrix
+    product. Above it, vectors are partitioned around k-means centroids (IVF), each
+    partition stored contiguously, and a query scores only the RETRIEVAL_IVF_NPROBE
+    partitions nearest to it. Chunks can be added or dropped at any time; adding an
+    existing key replaces it. Partitions are retrained as the index grows, mostly
+    outside the lock so searches continue meanwhile.
+    """
+    def __init__(self):
+        self.dim: Optional[int] = None
+        self._lock = threading.Lock()
+        self._lists: List[_InvertedList] = []
+        self._centroids: Optional[np.ndarray] = None
+        self._keys: List[ChunkKey] = []
+        self._payloads: List[Optional[Tuple[str, Dict[str, Any]]]] = []
+        self._alive = np.zeros(1024, dtype=bool)
+        self._row_of: Dict[ChunkKey, int] = {}
+        self._doc_keys: Dict[str, Set[ChunkKey]] = {}
+        self._listed = 0
+        self._trained_size = 0
+        self._training = False
+
+    def __len__(self) -> int:
+        return len(self._row_of)
+
+    def _drop(self, key: ChunkKey):
+        row = self._row_of.pop(key, None)
+        if row is not None:
+            self._payloads[row] = None
+            self._alive[row] = False
+            self._doc_keys[key[0]].discard(key)
+
+    def _append(self, vectors: np.ndarray, rows: np.ndarray):
+        labels = np.zeros(len(rows), dtype=np.int64) if self._centroids is None else _nearest(vectors, self._centroids)
+        for label, positions in enumerate(_group(labels, len(self._lists))):
+            if len(positions):
+                self._lists[label].append(vectors[positions], rows[positions])
+        self._listed += len(rows)
+
+    def add_rows(self, rows: List[Dict[str, Any]]):
+        """Adds document_chunks rows (document_id, chunk_index, content, metadata, embedding)."""
+        rows = [row for row in rows if row.get('embedding') is not None]
+        if not rows:
+            return
+        vectors = _normalize(np.stack([as_vector(row['embedding']) for row in rows]))
+        with self._lock:
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+                self._lists = [_InvertedList(self.dim)]
+            if vectors.shape[1] != self.dim:
+                raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match index dimension {self.dim}.")
+
+            first_row = len(self._keys)
+            if first_row + len(rows) > len(self._alive):
+                self._alive = np.concatenate([self._alive, np.zeros(max(len(rows), len(self._alive)), dtype=bool)])
+            for offset, row in enumerate(rows):
+                key = (row['document_id'], int(row['chunk_index']))
+                self._drop(key)
+                self._row_of[key] = first_row + offset
+                self._doc_keys.setdefault(key[0], set()).add(key)
+                self._keys.append(key)
+                self._payloads.append((row.get('content') or "", row.get('metadata') or {}))
+                self._alive[first_row + offset] = True
+            self._append(vectors, np.arange(first_row, first_row + len(rows)))
+
+    def discard(self, document_id: str, min_chunk_index: int = 0) -> int:
+        """Drops a document's chunks with chunk_index >= min_chunk_index."""
+        with self._lock:
+            keys = [key for key in self._doc_keys.get(document_id, ()) if key[1] >= min_chunk_index]
+            for key in keys:
+                self._drop(key)
+            return len(keys)
+
+    def get(self, key: ChunkKey) -> Optional[SearchHit]:
+        """The chunk stored under `key` (score 0), or None."""
+        with self._lock:
+            row = self._row_of.get(key)
+            if row is None:
+                return None
+            content, metadata = self._payloads[row]
+            return SearchHit(key[0], key[1], content, metadata, 0.0)
+
+    def search(self, query: np.ndarray, k: int) -> List[SearchHit]:
+        query = _normalize(np.asarray(query, dtype=np.float32))
+        with self._lock:
+            if not self._row_of or query.shape[-1] != self.dim:
+                return []
+            if self._centroids is None:
+                probes = [0]
+            else:
+                nprobe = min(settings.RETRIEVAL_IVF_NPROBE, len(self._centroids))
+                probes = np.argpartition(-(self._centroids @ query), nprobe - 1)[:nprobe]
+
+            scores, rows = [], []
+            for probe in probes:
+                vectors, list_rows = self._lists[probe].view()
+                if len(list_rows):
+                    scores.append(vectors @ query)
+                    rows.append(list_rows)
+            if not rows:
+                return []
+            scores, rows = np.concatenate(scores), np.concatenate(rows)
+            scores[~self._alive[rows]] = -np.inf
+
+            k = min(k, len(scores))
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            hits = []
+            for position in top:
+                if scores[position] == -np.inf:
+                    break
+                row = rows[position]
+                document_id, chunk_index = self._keys[row]
+                content, metadata = self._payloads[row]
+                hits.append(SearchHit(document_id, chunk_index, content, metadata, round(float(scores[position]), 4)))
+            return hits
+
+    def needs_training(self) -> bool:
+        alive = len(self._row_of)
+        if self._training or alive < settings.RETRIEVAL_IVF_MIN_VECTORS:
+            return False
+        return self._centroids is None or alive >= 2 * self._trained_size or self._listed - alive > 0.3 * alive
+
+    def train(self):
+        """
+        Re-partitions the index: k-means on a sample, then every live vector is assigned
+        to its nearest centroid. Works from a snapshot of the current partitions (appends
+        never modify the part a snapshot covers) and swaps the result in under the lock,
+        carrying over rows added in the meantime. Dropped rows are left out.
+        """
+        with self._lock:
+            if self._training:
+                return
+            self._training = True
+            snapshot = [lst.view() for lst in self._lists]
+            cutoff = len(self._keys)
+            alive = self._alive[:cutoff].copy()
+        try:
+            started_at = time.perf_counter()
+            live = [(vectors[alive[rows]], rows[alive[rows]]) for vectors, rows in snapshot]
+            total = sum(len(rows) for _, rows in live)
+            clusters = int(np.clip(np.sqrt(total), 16, 4096))
+            rng = np.random.default_rng(0)
+            sample_size = min(total, max(settings.RETRIEVAL_IVF_TRAIN_SAMPLE, 4 * clusters))
+            picks = np.sort(rng.choice(total, sample_size, replace=False))
+            offsets = np.cumsum([0] + [len(rows) for _, rows in live])
+            sample = np.concatenate([
+                vectors[picks[(picks >= offsets[i]) & (picks < offsets[i + 1])] - offsets[i]]
+                for i, (vectors, _) in enumerate(live)
+            ])
+            centroids = _kmeans(sample, clusters)
+
+            lists = [_InvertedList(sample.shape[1], capacity=16) for _ in range(clusters)]
+            for vectors, rows in live:
+                for label, positions in enumerate(_group(_nearest(vectors, centroids), clusters)):
+                    if len(positions):
+                        lists[label].append(vectors[positions], rows[positions])
+
+            with self._lock:
+                late = [(vectors[rows >= cutoff], rows[rows >= cutoff]) for vectors, rows in (lst.view() for lst in self._lists)]
+                self._lists, self._centroids = lists, centroids
+                self._listed = total
+                for vectors, rows in late:
+                    if len(rows):
+                        self._append(vectors, rows)
+                self._trained_size = total
+            logger.info(f"Vector index retrained: {total} vectors in {clusters} partitions ({time.perf_counter() - started_at:.1f}s).")
+        finally:
+            self._training = False
+
+    def stats(self) -> Dict[str, Any]:
+        return {"chunks": len(self._row_of), "partitions": len(self._lists), "stale_rows": self._listed - len(self._row_of)}
+
+class ClassroomIndex:
+    """
+    Vector and BM25 indexes over the same chunks of one classroom.
+
+    Hybrid search takes RETRIEVAL_CANDIDATES from each and fuses the two rankings with
+    reciprocal rank fusion, so exact terms (identifiers, formula names, course codes)
+    that embeddings blur still surface. Fusion only happens when the query has such a
+    rare term; for ordinary wording BM25 mostly adds noise, so the vector ranking is
+    returned as is.
+    """
+    def __init__(self):
+        self.vectors = VectorIndex()
+        self.terms = BM25Index()
+
+    def __len__(self) -> int:
+        return len(self.vectors)
+
+    def add_rows(self, rows: List[Dict[str, Any]]):
+        rows = [row for row in rows if row.get('embedding') is not None]
+        self.vectors.add_rows(rows)
+        self.terms.add([((row['document_id'], int(row['chunk_index'])), row.get('content') or "") for row in rows])
+
+    def discard(self, document_id: str, min_chunk_index: int = 0):
+        self.vectors.discard(document_id, min_chunk_index)
+        self.terms.discard(document_id, min_chunk_index)
+
+    def has_rare_term(self, query_text: str) -> bool:
+        """Whether a query term is in at most RETRIEVAL_RARE_TERM_SHARE of chunks (or RETRIEVAL_RARE_TERM_MIN_DF)."""
+        frequency = self.terms.min_document_frequency(query_text)
+        limit = max(settings.RETRIEVAL_RARE_TERM_MIN_DF, settings.RETRIEVAL_RARE_TERM_SHARE * len(self.terms))
+        return frequency is not None and frequency <= limit
+
+    def search(self, query: np.ndarray, k: int, query_text: Optional[str] = None) -> List[SearchHit]:
+        """
+        Vector search, fused with BM25 over `query_text` when RETRIEVAL_HYBRID is on and
+        the text has a rare term. Fused hits are scored by RRF.
+        """
+        if not query_text or not settings.RETRIEVAL_HYBRID or not self.has_rare_term(query_text):
+            return self.vectors.search(query, k)
+        candidates = max(k, settings.RETRIEVAL_CANDIDATES)
+        vector_hits = self.vectors.search(query, candidates)
+        term_hits = self.terms.search(query_text, candidates)
+        fused = reciprocal_rank_fusion(
+            [[(hit.document_id, hit.chunk_index) for hit in vector_hits], [key for key, _ in term_hits]],
+            settings.RETRIEVAL_RRF_K
+        )
+        by_key = {(hit.document_id, hit.chunk_index): hit for hit in vector_hits}
+        hits = []
+        for key, score in fused:
+            hit = by_key.get(key) or self.vectors.get(key)
+            if hit is not None:
+                hits.append(SearchHit(hit.document_id, hit.chunk_index, hit.content, hit.metadata, round(score, 5)))
+                if len(hits) == k:
+                    break
+        return hits
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self.vectors.stats(), "lexical": self.terms.stats()}
+
+class RetrievalIndex:
+    """
+    Per-classroom search indexes over document_chunks, held in process memory.
+
+    A classroom's index is loaded from the database on its first search and then kept
+    current by the ingestion pipeline (add_chunks / discard_document) instead of being
+    re-read, so a query makes no database round trip. Updates that arrive while a
+    classroom is loading are replayed once it has loaded. At most
+    RETRIEVAL_MAX_CLASSROOMS indexes stay loaded, least recently searched first out.
+    Only updates made by this process are seen, so ingestion workers must run in the
+    serving process (as they do when started from the app lifespan).
+    """
+    def __init__(self, max_classrooms: int):
+        self.max_classrooms = max_classrooms
+        self._indexes: "OrderedDict[int, ClassroomIndex]" = OrderedDict()
+        self._loading: Dict[int, asyncio.Future] = {}
+        self._pending: Dict[int, List[Callable[[ClassroomIndex], Any]]] = {}
+        self._background: Set[asyncio.Task] = set()
+        self._versions: Dict[int, int] = {}
+        self._latencies: deque = deque(maxlen=1000)
+        self.searches = 0
+
+    async def _load(self, classroom_id: int) -> ClassroomIndex:
+        started_at = time.perf_counter()
+        try:
+            supabase = client_manager.get_supabase_client()
+            index, last, page_size = ClassroomIndex(), None, settings.RETRIEVAL_LOAD_PAGE_SIZE
+            while True:
+                # Keyset pages on (document_id, chunk_index): rows inserted or deleted meanwhile can't shift later pages.
+                query = supabase.table('document_chunks').select(CHUNK_COLUMNS).eq('classroom_id', classroom_id)
+                if last is not None:
+                    query = query.or_(f"document_id.gt.{last[0]},and(document_id.eq.{last[0]},chunk_index.gt.{last[1]})")
+                res = await asyncio.to_thread(query.order('document_id').order('chunk_index').limit(page_size).execute)
+                rows = res.data or []
+                await asyncio.to_thread(index.add_rows, rows)
+                if len(rows) < page_size:
+                    break
+                last = (rows[-1]['document_id'], rows[-1]['chunk_index'])
+
+            pending = self._pending[classroom_id]
+            while pending:
+                await asyncio.to_thread(pending.pop(0), index)
+            # No awaits from here on, so no update can slip between the replay and publishing.
+            self._indexes[classroom_id] = index
+            while len(self._indexes) > self.max_classrooms:
+                evicted, _ = self._indexes.popitem(last=False)
+                logger.info(f"Unloaded vector index for classroom {evicted}.")
+        finally:
+            self._loading.pop(classroom_id, None)
+            self._pending.pop(classroom_id, None)
+        logger.info(f"Loaded vector index for classroom {classroom_id}: {len(index)} chunks in {time.perf_counter() - started_at:.2f}s.")
+        self._maybe_train(index)
+        return index
+
+    async def get(self, classroom_id: int) -> ClassroomIndex:
+        """The classroom's index, loading it on first use (concurrent callers share one load)."""
+        index = self._indexes.get(classroom_id)
+        if index is not None:
+            self._indexes.move_to_end(classroom_id)
+            return index
+        if classroom_id not in self._loading:
+            self._pending[classroom_id] = []
+            self._loading[classroom_id] = asyncio.ensure_future(self._load(classroom_id))
+        # Shielded so a cancelled request doesn't abort a load other requests are waiting on.
+        return await asyncio.shield(self._loading[classroom_id])
+
+    def _maybe_train(self, index: ClassroomIndex):
+        if index.vectors.needs_training():
+            task = asyncio.create_task(asyncio.to_thread(index.vectors.train))
+            self._background.add(task)
+            task.add_done_callback(self._background.discard)
+
+    async def _apply(self, classroom_id: int, update: Callable[[ClassroomIndex], Any]):
+        """Applies an update to a loaded index, queues it behind an in-progress load, or skips it (the load will read it)."""
+        try:
+            index = self._indexes.get(classroom_id)
+            if index is not None:
+                await asyncio.to_thread(update, index)
+                self._maybe_train(index)
+            elif classroom_id in self._loading:
+                self._pending[classroom_id].append(update)
+        except Exception as e:
+            logger.error(f"Vector index update for classroom {classroom_id} failed; unloading it: {e}")
+            self._indexes.pop(classroom_id, None)
+
+    def corpus_version(self, classroom_id: int) -> int:
+        """Counter bumped whenever the classroom's chunks change, for caches derived from them."""
+        return self._versions.get(classroom_id, 0)
+
+    async def add_chunks(self, classroom_id: int, rows: List[Dict[str, Any]]):
+        """Makes newly inserted document_chunks rows searchable."""
+        if rows:
+            self._versions[classroom_id] = self.corpus_version(classroom_id) + 1
+            await self._apply(classroom_id, lambda index: index.add_rows(rows))
+
+    async def discard_document(self, classroom_id: int, document_id: str, min_chunk_index: int = 0):
+        """Drops a document's chunks from chunk_index `min_chunk_index` on."""
+        self._versions[classroom_id] = self.corpus_version(classroom_id) + 1
+        await self._apply(classroom_id, lambda index: index.discard(document_id, min_chunk_index))
+
+    async def search(self, classroom_id: int, query_vector: List[float], k: int, query_text: Optional[str] = None) -> List[SearchHit]:
+        index = await self.get(classroom_id)
+        started_at = time.perf_counter()
+        hits = await asyncio.to_thread(index.search, as_vector(query_vector), k, query_text)
+        self._latencies.append(time.perf_counter() - started_at)
+        self.searches += 1
+        return hits
+
+    def stats(self) -> Dict[str, Any]:
+        latencies = sorted(self._latencies)
+        return {
+            "searches": self.searches,
+            "p99_ms": round(1000 * latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))], 2) if latencies else None,
+            "classrooms": {classroom_id: index.stats() for classroom_id, index in self._indexes.items()},
+            "loading": len(self._loading),
+        }
+
+async def embed_query(text: str) -> List[float]:
+    """Embedding of a search query (cached and micro-batched)."""
+    return await query_embedder.embed(text)
+
+retrieval_index = RetrievalIndex(settings.RETRIEVAL_MAX_CLASSROOMS)
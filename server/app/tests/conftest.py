@@ -0,0 +1,16 @@
+import os
+
+# Settings require credentials; unit tests never reach the real services.
+for name, value in {
+    "AZURE_OPENAI_ENDPOINT": "https://test.openai.azure.com",
+    "AZURE_OPENAI_API_KEY": "test",
+    "AZURE_OPENAI_API_VERSION": "2024-02-01",
+    "EMBEDDING_MODEL_DEPLOYMENT": "test-embedding",
+    "OCR_ENDPOINT": "https://test.cognitiveservices.azure.com",
+    "OCR_KEY": "test",
+    "SUPABASE_URL": "https://test.supabase.co",
+    "SUPABASE_KEY": "eyJhbGciOiJIUzI1NiJ9.e30.test",
+    "SUPABASE_JWT_SECRET": "test",
+    "AZURE_STORAGE_CONNECTION_STRING": "DefaultEndpointsProtocol=https;AccountName=test;AccountKey=dGVzdA==;EndpointSuffix=core.windows.net",
+}.items():
+    os.environ.setdefault(name, value)
@@ -0,0 +1,54 @@
+import asyncio
+from types import SimpleNamespace
+
+from app.services import answering
+from app.services.answer_cache import AnswerCache
+from app.services.answering import ReasoningFilter
+from app.services.retrieval import SearchHit
+
+def _filtered(deltas):
+    reasoning = ReasoningFilter()
+    return "".join(reasoning.feed(delta) for delta in deltas) + reasoning.flush()
+
+def test_reasoning_filter_drops_think_block_split_across_deltas():
+    assert _filtered(["<thi", "nk>weigh sources", "</th", "ink>", "\n\n", "The answer", " [1]."]) == "The answer [1]."
+
+def test_reasoning_filter_releases_output_without_think_block_at_end():
+    assert _filtered(["Plain ", "answer."]) == "Plain answer."
+
+def test_reasoning_filter_drops_unfinished_think_block():
+    assert _filtered(["<think>still reasoning when the token limit hit"]) == ""
+
+def test_stream_answer_streams_and_caches_only_the_final_answer(monkeypatch):
+    cache = AnswerCache(max_classrooms=4, per_classroom=4, ttl=60, similarity=0.95)
+    calls = []
+
+    async def embed_query(question):
+        return [1.0, 0.0]
+
+    async def search(classroom_id, query_vector, k, query_text=None):
+        return [SearchHit("doc", 0, "Photosynthesis happens in chloroplasts.", {"page_number": 3}, 0.9)]
+
+    class FakeLLM:
+        async def astream(self, messages, **kwargs):
+            calls.append(messages)
+            for text in ["<think>the source says", " chloroplasts</think>", "\n", "In chloroplasts", " [1]."]:
+                yield SimpleNamespace(content=text)
+
+    monkeypatch.setattr(answering, "answer_cache", cache)
+    monkeypatch.setattr(answering, "embed_query", embed_query)
+    monkeypatch.setattr(answering.retrieval_index, "search", search)
+    monkeypatch.setattr(answering, "_answer_llm", lambda: (FakeLLM(), "deepseek"))
+
+    async def ask():
+        return [event async for event in answering.stream_answer(1, "Where does photosynthesis happen?", 8)]
+
+    events = asyncio.run(ask())
+    tokens = [event for event in events if event.startswith("event: token")]
+    assert all("think" not in event for event in tokens)
+    assert '"In chloroplasts"' in tokens[0]
+
+    replay = asyncio.run(ask())
+    assert len(calls) == 1
+    assert '"In chloroplasts [1]."' in replay[1]
+    assert '"cached": true' in replay[-1]
@@ -0,0 +1,57 @@
+import asyncio
+import time
+
+import pytest
+
+from app.services.compute_pool import ComputePool, ComputePoolRecycled
+
+def test_timeout_recycles_pool_and_fails_siblings_as_retryable():
+    async def scenario():
+        pool = ComputePool(max_workers=2, max_concurrency=4, timeout=30)
+        try:
+            # Warm the workers up so spawn time doesn't count against the timeout.
+            await asyncio.gather(pool.run(time.sleep, 0), pool.run(time.sleep, 0))
+            stuck = pool.run(time.sleep, 30, timeout=1)
+            sibling = pool.run(time.sleep, 10)
+            results = await asyncio.gather(stuck, sibling, return_exceptions=True)
+            after = await pool.run(abs, -3)
+            return pool, results, after
+        finally:
+            pool.shutdown()
+
+    pool, (stuck, sibling), after = asyncio.run(scenario())
+    assert isinstance(stuck, TimeoutError)
+    assert isinstance(sibling, ComputePoolRecycled)
+    assert "sleep timed out" in str(sibling)
+    assert after == 3
+    assert pool.stats()["timeouts"] == 1 and pool.stats()["interrupted"] == 1
+
+def test_late_recycle_leaves_newer_executor_alone():
+    async def scenario():
+        pool = ComputePool(max_workers=1, max_concurrency=1, timeout=30)
+        try:
+            old = pool._get_executor()
+            pool._recycle(old, "test")
+            new = pool._get_executor()
+            # A handler for a task on the old executor finishing late must not take down the new one.
+            pool._recycle(old, "late")
+            assert pool._executor is new
+            return await pool.run(abs, -1)
+        finally:
+            pool.shutdown()
+
+    assert asyncio.run(scenario()) == 1
+
+def test_caller_cancellation_is_not_reported_as_recycle():
+    async def scenario():
+        pool = ComputePool(max_workers=1, max_concurrency=1, timeout=30)
+        try:
+            task = asyncio.ensure_future(pool.run(time.sleep, 2))
+            await asyncio.sleep(0.2)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+        finally:
+            pool.shutdown()
+
+    asyncio.run(scenario())
@@ -0,0 +1,61 @@
+import wave
+
+import fitz
+import numpy as np
+
+from app.services.compute_tasks import pdf_page_count, slice_pdf, split_audio_on_silence
+
+RATE = 16000
+
+def _write_wav(path, samples):
+    with wave.open(str(path), "wb") as target:
+        target.setnchannels(1)
+        target.setsampwidth(2)
+        target.setframerate(RATE)
+        target.writeframes(samples.astype(np.int16).tobytes())
+
+def _read_wav(path):
+    with wave.open(str(path), "rb") as source:
+        return np.frombuffer(source.readframes(source.getnframes()), dtype=np.int16)
+
+def _speech_with_pauses(seconds, pauses):
+    """Loud noise with one-second silences starting at each of `pauses` (seconds)."""
+    rng = np.random.default_rng(0)
+    samples = rng.normal(scale=8000, size=seconds * RATE).clip(-32000, 32000)
+    for pause in pauses:
+        samples[pause * RATE:(pause + 1) * RATE] = 0
+    return samples
+
+def test_short_audio_is_one_segment(tmp_path):
+    wav = tmp_path / "audio.wav"
+    _write_wav(wav, _speech_with_pauses(5, []))
+    assert split_audio_on_silence(str(wav), str(tmp_path), max_seconds=10) == [(0, 5000, str(wav))]
+
+def test_cuts_land_in_silences_and_segments_reassemble(tmp_path):
+    wav = tmp_path / "audio.wav"
+    samples = _speech_with_pauses(100, [14, 33, 52, 71, 88])
+    _write_wav(wav, samples)
+
+    segments = split_audio_on_silence(str(wav), str(tmp_path), max_seconds=20)
+
+    assert len(segments) > 1
+    for (start_ms, end_ms, _), (next_start_ms, _, _) in zip(segments, segments[1:]):
+        assert end_ms == next_start_ms
+        assert (end_ms // 1000) in (14, 33, 52, 71, 88)
+    assert all(end_ms - start_ms <= 20_000 for start_ms, end_ms, _ in segments)
+    assert segments[0][0] == 0 and segments[-1][1] == 100_000
+    reassembled = np.concatenate([_read_wav(path) for _, _, path in segments])
+    assert np.array_equal(reassembled, samples.astype(np.int16))
+
+def test_slice_keeps_only_the_requested_pages(tmp_path):
+    path = tmp_path / "doc.pdf"
+    with fitz.open() as doc:
+        for page_idx in range(5):
+            doc.new_page().insert_text((72, 72), f"page {page_idx + 1}")
+        doc.save(str(path))
+
+    part = slice_pdf(str(path), 1, 3)
+
+    assert pdf_page_count(part) == 3
+    with fitz.open(stream=part, filetype="pdf") as doc:
+        assert [page.get_text().strip() for page in doc] == ["page 2", "page 3", "page 4"]
@@ -0,0 +1,49 @@
+import asyncio
+
+from app.services import rag_processing
+
+class _MemoryCache:
+    def __init__(self, values=None):
+        self.values = dict(values or {})
+
+    async def get(self, namespace, key):
+        return self.values.get((namespace, key))
+
+    async def set(self, namespace, key, value):
+        self.values[(namespace, key)] = value
+
+def _stub_services(monkeypatch, cache):
+    calls = {"describe": 0, "upload": 0}
+
+    async def invoke(image_data, prompt):
+        calls["describe"] += 1
+        return "a flow chart"
+
+    async def upload(image_data, document_id, page_num):
+        calls["upload"] += 1
+        return f"https://blob/{document_id}/{page_num}.jpeg"
+
+    monkeypatch.setattr(rag_processing, "content_cache", cache)
+    monkeypatch.setattr(rag_processing, "_invoke_gpt4o_diagram", invoke)
+    monkeypatch.setattr(rag_processing, "upload_image_to_blob", upload)
+    return calls
+
+def test_repeated_diagram_skips_upload_and_description(monkeypatch):
+    cache = _MemoryCache()
+    calls = _stub_services(monkeypatch, cache)
+
+    first = asyncio.run(rag_processing._describe_diagram(b"jpeg", 0, "doc-a"))
+    # The same image on another page of another document is a cache hit.
+    second = asyncio.run(rag_processing._describe_diagram(b"jpeg", 4, "doc-b"))
+
+    assert first == second == ("a flow chart", "https://blob/doc-a/1.jpeg")
+    assert calls == {"describe": 1, "upload": 1}
+    key = rag_processing.content_hash(rag_processing.settings.GPT4O_DEPLOYMENT_NAME, b"jpeg")
+    assert cache.values[("diagram", key)] == {"description": "a flow chart", "image_url": "https://blob/doc-a/1.jpeg"}
+
+def test_diagram_chunks_name_their_page():
+    chunks = rag_processing.build_page_chunks(
+        ["Some page text about the system."], {3: ("a flow chart", "https://blob/doc/4.jpeg")}, "notes.pdf", 10, "doc", first_page=3
+    )
+    assert "DIAGRAM DESCRIPTION (page 4) --- a flow chart" in chunks[0]["content"]
+    assert chunks[0]["metadata"]["image_url"] == "https://blob/doc/4.jpeg"
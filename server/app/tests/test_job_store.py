@@ -0,0 +1,104 @@
+import asyncio
+import json
+import time
+
+import pytest
+from fastapi import HTTPException
+
+from app.services import document_queue as queue_module
+from app.services.document_queue import DocumentProcessingQueue
+from app.services.job_store import JobStore, PermanentJobError
+
+@pytest.fixture
+def store(tmp_path):
+    return JobStore(str(tmp_path / "jobs.sqlite3"))
+
+def test_lease_is_exclusive_until_it_expires(store):
+    store._enqueue("job", "document", 1, {"doc_id": "job"})
+    job = store._lease("job", "a", lease_seconds=60)
+    assert job["attempts"] == 1 and job["payload"] == {"doc_id": "job"}
+    assert store._lease("job", "b", lease_seconds=60) is None
+    assert store._renew("job", "a", lease_seconds=60)
+    assert not store._renew("job", "b", lease_seconds=60)
+
+    store._lease("other", "a", 60)  # unknown ids are not claimable
+    store._enqueue("short", "document", 1, {})
+    store._lease("short", "a", lease_seconds=-1)
+    reclaimed = store._lease("short", "b", lease_seconds=60)
+    assert reclaimed["lease_owner"] == "b" and reclaimed["attempts"] == 2
+
+def test_retry_delays_the_job_and_bury_parks_it(store):
+    store._enqueue("job", "video", 1, {})
+    store._lease("job", "a", 60)
+    store._retry("job", "boom", delay=60)
+    assert store._lease("job", "a", 60) is None
+    [job] = store._recoverable()
+    assert job["status"] == "pending" and job["last_error"] == "boom" and job["available_at"] > time.time() + 50
+
+    store._retry("job", "boom", delay=0)
+    assert store._lease("job", "a", 60)["attempts"] == 2
+    store._bury("job", "gave up")
+    assert store._recoverable() == []
+    assert store._lease("job", "a", 60) is None
+
+def test_ack_removes_the_job(store):
+    store._enqueue("job", "document", None, {"doc_id": "job"})
+    store._lease("job", "a", 60)
+    store._ack("job")
+    assert store._recoverable() == []
+
+def test_only_rejected_input_is_permanent():
+    assert DocumentProcessingQueue.is_permanent(PermanentJobError("unsupported"))
+    assert DocumentProcessingQueue.is_permanent(HTTPException(status_code=400))
+    assert not DocumentProcessingQueue.is_permanent(HTTPException(status_code=503))
+    assert not DocumentProcessingQueue.is_permanent(json.JSONDecodeError("bad", "", 0))
+    assert not DocumentProcessingQueue.is_permanent(UnicodeDecodeError("utf-8", b"\xff", 0, 1, "bad"))
+    assert not DocumentProcessingQueue.is_permanent(ValueError("transient"))
+
+def test_heartbeat_stops_when_the_job_is_cancelled(monkeypatch, store):
+    monkeypatch.setattr(queue_module, "job_store", store)
+
+    async def process_document_background(**payload):
+        raise asyncio.CancelledError()
+
+    async def scenario():
+        queue = DocumentProcessingQueue(num_workers=1, max_size=4, lane_limits={})
+        await store.enqueue("job", "document", 1, {"doc_id": "job"})
+        with pytest.raises(asyncio.CancelledError):
+            await queue._run_job({"doc_id": "job"})
+        await asyncio.sleep(0)
+        # The lease-renewal task must not outlive the job.
+        return [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+
+    monkeypatch.setattr(queue_module, "process_document_background", process_document_background)
+    assert asyncio.run(scenario()) == []
+
+def _queue_with_pushes(monkeypatch, store):
+    monkeypatch.setattr(queue_module, "job_store", store)
+    queue = DocumentProcessingQueue(num_workers=1, max_size=4, lane_limits={})
+    pushes = []
+    monkeypatch.setattr(queue, "_push_later", lambda task_data, delay: pushes.append((task_data["doc_id"], delay)))
+    return queue, pushes
+
+def test_unclaimable_job_is_requeued_for_when_its_lease_expires(monkeypatch, store):
+    queue, pushes = _queue_with_pushes(monkeypatch, store)
+    store._enqueue("leased", "document", 1, {"doc_id": "leased"})
+    store._lease("leased", "other-process", lease_seconds=60)
+    store._enqueue("done", "document", 1, {"doc_id": "done"})
+    store._ack("done")
+
+    asyncio.run(queue._run_job({"doc_id": "leased"}))
+    asyncio.run(queue._run_job({"doc_id": "done"}))
+
+    [(job_id, delay)] = pushes
+    assert job_id == "leased" and 55 < delay <= 60
+
+def test_lease_errors_requeue_the_job(monkeypatch, store):
+    queue, pushes = _queue_with_pushes(monkeypatch, store)
+
+    async def lease(*args):
+        raise OSError("database is locked")
+
+    monkeypatch.setattr(store, "lease", lease)
+    asyncio.run(queue._run_job({"doc_id": "job"}))
+    assert pushes == [("job", queue_module.settings.JOB_RETRY_BASE_DELAY)]
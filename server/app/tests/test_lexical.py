@@ -0,0 +1,52 @@
+import numpy as np
+
+from app.services.lexical import BM25Index, _Postings, _encode_varint, decode_varints, reciprocal_rank_fusion, tokenize
+
+def test_tokenize_keeps_identifiers_and_splits_compounds():
+    assert tokenize("How is pd.read_csv used in CS101?") == ["pd.read_csv", "pd", "read_csv", "used", "cs101"]
+
+def test_varints_round_trip():
+    values = [0, 1, 127, 128, 300, 16383, 16384, 2**31 - 1]
+    data = bytearray()
+    for value in values:
+        _encode_varint(value, data)
+    assert decode_varints(bytes(data)).tolist() == values
+    assert decode_varints(b"").tolist() == []
+
+def test_postings_store_gaps_compactly():
+    docs = np.array([3, 4, 10, 500, 501])
+    postings = _Postings.from_arrays(docs, np.array([1, 2, 1, 7, 1]))
+    decoded_docs, freqs = postings.decode()
+    assert decoded_docs.tolist() == docs.tolist()
+    assert freqs.tolist() == [1, 2, 1, 7, 1]
+    assert len(postings.gaps) == 6  # one byte per gap except 10 -> 500
+
+def test_search_ranks_exact_term_first_and_replaces_keys():
+    index = BM25Index()
+    index.add([
+        (("a", 0), "gradient descent updates weights"),
+        (("a", 1), "the loss function fn_backprop computes gradients"),
+        (("b", 0), "weights and biases of a layer"),
+    ])
+    assert index.search("what does fn_backprop do", 2)[0][0] == ("a", 1)
+
+    index.add([(("a", 1), "nothing relevant here")])
+    assert index.search("fn_backprop", 5) == []
+    assert len(index) == 3
+
+def test_discard_and_compaction_keep_results():
+    index = BM25Index()
+    index.add([((f"doc{i % 4}", i), f"common words term{i}") for i in range(3000)])
+    index.discard("doc0")
+    index.discard("doc1")
+    # Half the index is dead, so the postings were compacted to the live docs.
+    assert len(index._keys) == len(index) == 1500
+    assert index.stats()["postings"] == 1500 * 3
+    assert index.search("term2", 1)[0][0] == ("doc2", 2)
+    assert index.search("term1", 1) == []
+    assert index.min_document_frequency("common term3") == 1
+    assert index.min_document_frequency("absent") is None
+
+def test_reciprocal_rank_fusion_rewards_agreement():
+    fused = reciprocal_rank_fusion([[("a", 0), ("b", 0)], [("b", 0), ("c", 0)]], k=60)
+    assert [key for key, _ in fused] == [("b", 0), ("a", 0), ("c", 0)]
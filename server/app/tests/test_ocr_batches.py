@@ -0,0 +1,77 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from app.services import rag_processing
+from app.services.rag_processing import _plan_ocr_batches, content_hash, extract_text_from_pdf
+
+@pytest.fixture(autouse=True)
+def ocr_settings(monkeypatch):
+    for name, value in {
+        "BATCH_SIZE": 2, "OCR_CONCURRENCY": 4, "OCR_MAX_BATCH_PAGES": 8, "OCR_MAX_BATCH_BYTES": 1_000_000, "PDF_TEXT_LAYER": False,
+    }.items():
+        monkeypatch.setattr(rag_processing.settings, name, value)
+
+    async def get_many(namespace, keys):
+        return {}
+
+    monkeypatch.setattr(rag_processing.content_cache, "get_many", get_many)
+
+def _pdf(pages):
+    return SimpleNamespace(size=1000 * pages, page_count=pages, file_hash="file")
+
+def test_batches_are_contiguous_runs():
+    assert _plan_ocr_batches([0, 1, 2, 5, 6, 9], avg_page_bytes=1000, headroom=100) == [(0, 1), (2, 2), (5, 6), (9, 9)]
+    assert _plan_ocr_batches([], avg_page_bytes=1000, headroom=100) == []
+
+def test_batch_size_follows_headroom_and_payload_size():
+    pages = list(range(16))
+    # Plenty of headroom: spread over OCR_CONCURRENCY requests.
+    assert len(_plan_ocr_batches(pages, avg_page_bytes=1000, headroom=100)) == 4
+    # Little headroom: fewer, larger requests, capped at OCR_MAX_BATCH_PAGES.
+    assert _plan_ocr_batches(pages, avg_page_bytes=1000, headroom=1) == [(0, 7), (8, 15)]
+    # Big pages: OCR_MAX_BATCH_BYTES wins over everything else.
+    assert all(end == start for start, end in _plan_ocr_batches(pages, avg_page_bytes=600_000, headroom=1))
+
+def test_failed_batches_are_bisected_down_to_the_bad_page(monkeypatch):
+    requests = []
+
+    async def ocr_page_range(pdf, start_page, end_page):
+        requests.append((start_page, end_page))
+        if start_page <= 5 <= end_page:
+            raise RuntimeError("bad page")
+        return {page: f"text {page}" for page in range(start_page, end_page + 1)}
+
+    async def headroom(service):
+        return 1
+
+    cached = {}
+
+    async def set_many(namespace, values):
+        cached.update(values)
+
+    monkeypatch.setattr(rag_processing, "_ocr_page_range", ocr_page_range)
+    monkeypatch.setattr(rag_processing.rate_limiter, "headroom", headroom)
+    monkeypatch.setattr(rag_processing.content_cache, "set_many", set_many)
+
+    texts, _ = asyncio.run(extract_text_from_pdf(_pdf(8)))
+
+    assert texts == [f"text {page}" if page != 5 else "" for page in range(8)]
+    assert requests[0] == (0, 7)
+    assert (5, 5) in requests
+    assert requests.count((5, 5)) == 1  # pages reached by bisection are not retried again
+    assert sorted(cached) == sorted(content_hash("file", page) for page in (0, 1, 2, 3, 4, 6, 7))
+
+def test_all_pages_failing_raises(monkeypatch):
+    async def ocr_page_range(pdf, start_page, end_page):
+        raise RuntimeError("service down")
+
+    async def headroom(service):
+        return 10
+
+    monkeypatch.setattr(rag_processing, "_ocr_page_range", ocr_page_range)
+    monkeypatch.setattr(rag_processing.rate_limiter, "headroom", headroom)
+
+    with pytest.raises(RuntimeError, match="all 3 requested pages"):
+        asyncio.run(extract_text_from_pdf(_pdf(3)))
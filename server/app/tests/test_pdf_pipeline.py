@@ -0,0 +1,88 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from app.services import rag_processing
+from app.services.checkpoints import DocumentCheckpoints
+
+@pytest.fixture
+def pipeline(monkeypatch):
+    """Stubs every service behind _run_pdf_pipeline; returns the list of stored chunk batches."""
+    stored = []
+
+    async def identify_diagram_pages(pdf):
+        return []
+
+    async def summarize_chunks(texts):
+        return list(texts)
+
+    async def generate_embeddings_safely(texts):
+        return [[0.0] for _ in texts]
+
+    async def store_chunks_in_supabase(chunks, doc_id, user_id, classroom_id, start_index=0, replace_existing=False):
+        stored.append([chunk['metadata']['page_number'] for chunk in chunks])
+        return len(chunks)
+
+    async def get_many(namespace, keys):
+        return {}
+
+    async def set_many(namespace, values):
+        pass
+
+    async def headroom(service):
+        return 1
+
+    monkeypatch.setattr(rag_processing.settings, "PIPELINE_PAGE_GROUP_SIZE", 2)
+    monkeypatch.setattr(rag_processing.settings, "PDF_TEXT_LAYER", False)
+    monkeypatch.setattr(rag_processing.content_cache, "get_many", get_many)
+    monkeypatch.setattr(rag_processing.content_cache, "set_many", set_many)
+    monkeypatch.setattr(rag_processing.rate_limiter, "headroom", headroom)
+    monkeypatch.setattr(rag_processing, "identify_diagram_pages", identify_diagram_pages)
+    monkeypatch.setattr(rag_processing, "summarize_chunks", summarize_chunks)
+    monkeypatch.setattr(rag_processing, "generate_embeddings_safely", generate_embeddings_safely)
+    monkeypatch.setattr(rag_processing, "store_chunks_in_supabase", store_chunks_in_supabase)
+    return stored
+
+def _pdf(pages):
+    return SimpleNamespace(size=1000 * pages, page_count=pages, file_hash="file")
+
+def _run(pdf):
+    return asyncio.run(rag_processing._run_pdf_pipeline(pdf, "notes.pdf", "doc", "user", 1, DocumentCheckpoints.disabled()))
+
+def test_groups_are_extracted_concurrently_and_stored_in_order(monkeypatch, pipeline):
+    monkeypatch.setattr(rag_processing.settings, "PIPELINE_EXTRACT_LOOKAHEAD", 2)
+    in_flight, peak = set(), []
+
+    async def extract_text_from_pdf(pdf, first_page, last_page, plan=None):
+        in_flight.add(first_page)
+        peak.append(len(in_flight))
+        # Later groups finish first; the writer must still see them in order.
+        await asyncio.sleep(0.01 * (pdf.page_count - first_page))
+        in_flight.discard(first_page)
+        return [f"text of page {page + 1}" for page in range(first_page, last_page + 1)], pdf.page_count
+
+    monkeypatch.setattr(rag_processing, "extract_text_from_pdf", extract_text_from_pdf)
+
+    chunks_added, total_pages = _run(_pdf(8))
+
+    assert (chunks_added, total_pages) == (8, 8)
+    assert max(peak) == 2
+    assert pipeline == [[1, 2], [3, 4], [5, 6], [7, 8]]
+
+def test_ocr_batches_are_planned_across_page_groups(monkeypatch, pipeline):
+    monkeypatch.setattr(rag_processing.settings, "OCR_MAX_BATCH_PAGES", 8)
+    requests = []
+
+    async def ocr_page_range(pdf, start_page, end_page):
+        requests.append((start_page, end_page))
+        return {page: f"text of page {page + 1}" for page in range(start_page, end_page + 1)}
+
+    monkeypatch.setattr(rag_processing, "_ocr_page_range", ocr_page_range)
+
+    chunks_added, _ = _run(_pdf(16))
+
+    assert chunks_added == 16
+    # Each request covers four 2-page groups.
+    assert requests == [(0, 7), (8, 15)]
+    assert pipeline == [[page, page + 1] for page in range(1, 17, 2)]
@@ -0,0 +1,65 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from app.services.rate_limiter import (
+    DEFAULT_RETRY_AFTER, MIN_RATE_SCALE, BucketState, ServiceLimits, SQLiteBucketBackend, retry_after_from_error,
+)
+
+LIMITS = ServiceLimits(rpm=60, tpm=6000, burst_seconds=10)  # 10 requests / 1000 tokens of burst
+
+def test_burst_is_free_then_requests_are_paced():
+    state = BucketState.full(LIMITS, now=0.0)
+    assert [state.reserve(LIMITS, 0.0, 1, 0) for _ in range(10)] == [0.0] * 10
+    # 60 RPM refills one request per second; debts queue callers in order.
+    assert state.reserve(LIMITS, 0.0, 1, 0) == pytest.approx(1.0)
+    assert state.reserve(LIMITS, 0.0, 1, 0) == pytest.approx(2.0)
+    assert state.reserve(LIMITS, 5.0, 1, 0) == pytest.approx(0.0)
+
+def test_token_budget_limits_large_requests():
+    state = BucketState.full(LIMITS, now=0.0)
+    assert state.reserve(LIMITS, 0.0, 1, 1000) == 0.0
+    # 6000 TPM refills 100 tokens per second.
+    assert state.reserve(LIMITS, 0.0, 1, 500) == pytest.approx(5.0)
+
+def test_throttle_blocks_and_halves_rate_then_recovers():
+    state = BucketState.full(LIMITS, now=0.0)
+    state.throttled(LIMITS, 0.0, retry_after=3.0)
+    assert state.scale == 0.5
+    assert state.available(LIMITS, 1.0) == 0.0
+    assert state.reserve(LIMITS, 1.0, 1, 0) == pytest.approx(2.0)
+
+    for _ in range(10):
+        state.throttled(LIMITS, 1.0, retry_after=0.0)
+    assert state.scale == MIN_RATE_SCALE
+    for _ in range(1000):
+        state.succeeded(LIMITS, 1.0)
+    assert state.scale == 1.0
+
+def test_available_does_not_reserve():
+    state = BucketState.full(LIMITS, now=0.0)
+    assert state.available(LIMITS, 0.0) == 10
+    assert state.available(LIMITS, 0.0) == 10
+
+def test_retry_after_parsing():
+    def error(status, headers):
+        return SimpleNamespace(status_code=status, response=SimpleNamespace(status_code=status, headers=headers))
+
+    assert retry_after_from_error(error(429, {"retry-after-ms": "1500"})) == 1.5
+    assert retry_after_from_error(error(429, {"Retry-After": "7"})) == 7.0
+    assert retry_after_from_error(error(429, {"Retry-After": "soon"})) == DEFAULT_RETRY_AFTER
+    assert retry_after_from_error(error(500, {"Retry-After": "7"})) is None
+    assert retry_after_from_error(ValueError("not http")) is None
+
+def test_sqlite_backend_shares_buckets_between_instances(tmp_path):
+    path = str(tmp_path / "buckets.sqlite3")
+    first, second = SQLiteBucketBackend(path), SQLiteBucketBackend(path)
+    limits = ServiceLimits(rpm=6, burst_seconds=10)  # one request of burst
+
+    async def scenario():
+        return await first.reserve("ocr", limits, 1, 0), await second.reserve("ocr", limits, 1, 0)
+
+    waits = asyncio.run(scenario())
+    assert waits[0] == 0.0
+    assert waits[1] == pytest.approx(10.0, abs=0.1)
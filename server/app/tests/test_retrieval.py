@@ -0,0 +1,121 @@
+import asyncio
+import re
+from types import SimpleNamespace
+
+import numpy as np
+
+from app.services import retrieval
+from app.services.retrieval import ClassroomIndex, RetrievalIndex, VectorIndex
+
+def _rows(vectors, texts):
+    return [
+        {"document_id": "doc", "chunk_index": i, "content": text, "metadata": {}, "embedding": vector}
+        for i, (vector, text) in enumerate(zip(vectors, texts))
+    ]
+
+def _classroom(chunks=400, dim=16, seed=0):
+    rng = np.random.default_rng(seed)
+    vectors = rng.normal(size=(chunks, dim)).astype(np.float32)
+    texts = [f"lecture notes on topic{i % 20} with examples" for i in range(chunks)]
+    texts[123] += " using read_csv"
+    index = ClassroomIndex()
+    index.add_rows(_rows(vectors, texts))
+    return index, vectors
+
+def test_common_wording_uses_vector_ranking_only():
+    index, vectors = _classroom()
+    hits = index.search(vectors[7], 5, query_text="notes on topic7 examples")
+    assert hits == index.vectors.search(vectors[7], 5)
+
+def test_rare_term_is_fused_into_results():
+    index, vectors = _classroom()
+    assert index.has_rare_term("how do I call read_csv")
+    assert 123 not in [hit.chunk_index for hit in index.vectors.search(vectors[7], 5)]
+    hits = index.search(vectors[7], 5, query_text="how do I call read_csv")
+    assert 123 in [hit.chunk_index for hit in hits]
+    assert hits[0].chunk_index in (7, 123)
+
+def test_ivf_search_matches_exact_search(monkeypatch):
+    monkeypatch.setattr(retrieval.settings, "RETRIEVAL_IVF_MIN_VECTORS", 1000)
+    monkeypatch.setattr(retrieval.settings, "RETRIEVAL_IVF_NPROBE", 8)
+    rng = np.random.default_rng(1)
+    centers = rng.normal(size=(40, 32)).astype(np.float32)
+    vectors = centers[rng.integers(40, size=4000)] + 0.3 * rng.normal(size=(4000, 32)).astype(np.float32)
+    index = VectorIndex()
+    index.add_rows(_rows(vectors, [""] * len(vectors)))
+    queries = vectors[rng.choice(len(vectors), 50, replace=False)] + 0.05 * rng.normal(size=(50, 32)).astype(np.float32)
+    exact = [[hit.chunk_index for hit in index.search(query, 5)] for query in queries]
+
+    assert index.needs_training()
+    index.train()
+    assert not index.needs_training()
+    assert index.stats()["partitions"] > 1
+
+    recall = np.mean([len(set(e) & {hit.chunk_index for hit in index.search(q, 5)}) / 5 for q, e in zip(queries, exact)])
+    assert recall >= 0.9
+
+    # Rows added after training land in partitions; dropped rows never come back.
+    index.add_rows([{"document_id": "new", "chunk_index": 0, "content": "", "metadata": {}, "embedding": queries[0]}])
+    assert index.search(queries[0], 1)[0].document_id == "new"
+    index.discard("new")
+    assert all(hit.document_id == "doc" for hit in index.search(queries[0], 5))
+
+class _FakeChunksTable:
+    """Just enough of the PostgREST builder for RetrievalIndex._load's keyset paging."""
+    def __init__(self, rows, on_page=None):
+        self.rows, self.on_page, self.pages = rows, on_page, 0
+
+    def table(self, name):
+        self._after, self._limit = None, None
+        return self
+
+    def select(self, columns):
+        return self
+
+    def eq(self, column, value):
+        return self
+
+    def order(self, column):
+        return self
+
+    def or_(self, condition):
+        match = re.fullmatch(r"document_id\.gt\.(.+),and\(document_id\.eq\.\1,chunk_index\.gt\.(\d+)\)", condition)
+        self._after = (match.group(1), int(match.group(2)))
+        return self
+
+    def limit(self, count):
+        self._limit = count
+        return self
+
+    def execute(self):
+        ordered = sorted(self.rows, key=lambda row: (row["document_id"], row["chunk_index"]))
+        if self._after is not None:
+            ordered = [row for row in ordered if (row["document_id"], row["chunk_index"]) > self._after]
+        page = ordered[:self._limit]
+        self.pages += 1
+        if self.on_page:
+            self.on_page(self)
+        return SimpleNamespace(data=page)
+
+def test_load_pages_by_key_despite_concurrent_deletes(monkeypatch):
+    monkeypatch.setattr(retrieval.settings, "RETRIEVAL_LOAD_PAGE_SIZE", 10)
+    rng = np.random.default_rng(2)
+    rows = [
+        {"document_id": f"doc{d}", "chunk_index": i, "content": "", "metadata": {}, "embedding": rng.normal(size=8).tolist()}
+        for d in range(3) for i in range(12)
+    ]
+
+    def delete_loaded_rows(table):
+        # With offset paging, removing rows behind the cursor would shift the next page past unread rows.
+        if table.pages == 1:
+            table.rows[:5] = []
+
+    table = _FakeChunksTable(list(rows), delete_loaded_rows)
+    monkeypatch.setattr(retrieval.client_manager, "get_supabase_client", lambda: table)
+
+    async def load():
+        return await RetrievalIndex(max_classrooms=2).get(1)
+
+    index = asyncio.run(load())
+    assert set(index.vectors._row_of) == {(r["document_id"], r["chunk_index"]) for r in rows}
+    assert table.pages == 4
@@ -0,0 +1,97 @@
+import asyncio
+
+import pytest
+
+from app.services import rag_processing
+
+class _FakeQuery:
+    def __init__(self, updates):
+        self.updates = updates
+
+    def update(self, values):
+        self.updates.append(values)
+        return self
+
+    def eq(self, column, value):
+        return self
+
+    def execute(self):
+        return None
+
+class _FakeSupabase:
+    def __init__(self):
+        self.updates = []
+
+    def table(self, name):
+        return _FakeQuery(self.updates)
+
+def test_process_video_runs_with_stubbed_stages(monkeypatch):
+    seen, stored = {}, {}
+    supabase = _FakeSupabase()
+
+    async def transcribe_audio(path):
+        seen["transcribe"] = path
+        return [{"type": "transcript", "timestamp": 5000, "content": "later"}]
+
+    async def extract_key_frames(path):
+        seen["frames"] = path
+        return [(1000, b"frame")]
+
+    async def ocr_key_frame(image):
+        return "slide text"
+
+    async def describe_diagram(image):
+        return ""
+
+    async def embed_and_store_video_chunks(chunks, video_id, user_id, classroom_id, filename):
+        stored.update(chunks=chunks, video_id=video_id, classroom_id=classroom_id)
+
+    monkeypatch.setattr(rag_processing, "transcribe_audio", transcribe_audio)
+    monkeypatch.setattr(rag_processing, "extract_key_frames", extract_key_frames)
+    monkeypatch.setattr(rag_processing, "ocr_key_frame", ocr_key_frame)
+    monkeypatch.setattr(rag_processing, "describe_diagram", describe_diagram)
+    monkeypatch.setattr(rag_processing, "embed_and_store_video_chunks", embed_and_store_video_chunks)
+    monkeypatch.setattr(rag_processing.client_manager, "get_supabase_client", lambda: supabase)
+
+    asyncio.run(rag_processing.process_video("vid", "user", 7, "/tmp/lecture.mp4", "lecture.mp4"))
+
+    assert seen == {"transcribe": "/tmp/lecture.mp4", "frames": "/tmp/lecture.mp4"}
+    assert stored["video_id"] == "vid" and stored["classroom_id"] == 7
+    assert [c["timestamp"] for c in stored["chunks"]] == [1000, 5000]
+    assert stored["chunks"][0]["type"] == "ocr_frame"
+    assert supabase.updates == [{"status": "completed"}]
+
+def _stub_transcription(monkeypatch, failing):
+    monkeypatch.setattr(rag_processing.settings, "AZURE_WHISPER_ENDPOINT", "https://whisper")
+    monkeypatch.setattr(rag_processing.settings, "AZURE_WHISPER_API_KEY", "key")
+    monkeypatch.setattr(rag_processing.settings, "AZURE_WHISPER_API_VERSION", "2024-06-01")
+    monkeypatch.setattr(rag_processing.settings, "AZURE_WHISPER_DEPLOYMENT_NAME", "whisper")
+
+    async def extract_audio_wav(video_path, wav_path):
+        return True
+
+    async def run(func, *args, timeout=None):
+        return [(0, 10_000, "a.wav"), (10_000, 20_000, "b.wav")]
+
+    async def transcribe_segment(client, path, start_ms, end_ms):
+        if path in failing:
+            raise RuntimeError("whisper unavailable")
+        return [(start_ms, end_ms, f"speech from {path}")]
+
+    async def summarize_chunks(texts):
+        return list(texts)
+
+    monkeypatch.setattr(rag_processing, "_extract_audio_wav", extract_audio_wav)
+    monkeypatch.setattr(rag_processing.compute_pool, "run", run)
+    monkeypatch.setattr(rag_processing, "_transcribe_segment", transcribe_segment)
+    monkeypatch.setattr(rag_processing, "summarize_chunks", summarize_chunks)
+
+def test_failed_audio_segments_are_skipped(monkeypatch):
+    _stub_transcription(monkeypatch, failing={"a.wav"})
+    chunks = asyncio.run(rag_processing.transcribe_audio("/tmp/lecture.mp4"))
+    assert [(c["timestamp"], c["content"]) for c in chunks] == [(10_000, "speech from b.wav")]
+
+def test_transcription_raises_when_every_segment_fails(monkeypatch):
+    _stub_transcription(monkeypatch, failing={"a.wav", "b.wav"})
+    with pytest.raises(RuntimeError, match="all 2 audio segments"):
+        asyncio.run(rag_processing.transcribe_audio("/tmp/lecture.mp4"))
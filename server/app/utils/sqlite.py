@@ -0,0 +1,41 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+class SQLiteStore:
+    """
+    Base class for small, process-local SQLite stores.
+
+    Subclasses set `schema`; it is applied the first time a connection is opened.
+    Every call opens its own short-lived connection, so methods are safe to run
+    from `asyncio.to_thread` and from several processes sharing the same file.
+    """
+    schema: str = ""
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._init_lock = threading.Lock()
+        self._initialized = False
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        if not self._initialized:
+            with self._init_lock:
+                if not self._initialized:
+                    conn.execute("PRAGMA journal_mode=WAL")
+                    conn.executescript(self.schema)
+                    self._initialized = True
+        return conn
+
+    @contextmanager
+    def _connection(self):
+        conn = self._connect()
+        try:
+            yield conn
+        finally:
+            conn.close()
@@ -3,10 +3,12 @@ from contextlib import asynccontextmanager
 import logging
 from fastapi.middleware.cors import CORSMiddleware
 
-from app.api.routes import classroom, dashboard, exception_handler, classroom_details
+from app.api.routes import classroom, dashboard, exception_handler, classroom_details, metrics, search
 from app.core.config import get_settings
 from app.core.clients import client_manager
+from app.services.compute_pool import compute_pool
 from app.services.document_queue import document_queue
+from app.services.loop_monitor import loop_monitor
 
 # Initialize settings and logger
 settings = get_settings()
@@ -19,12 +21,16 @@ async def lifespan(app: FastAPI):
     """
     # Startup event
     logger.info("Application startup: Initializing services...")
+    loop_monitor.start()
     await client_manager.ensure_containers_exist()
+    await document_queue.resume_pending_jobs()
     document_queue.start_worker()
     logger.info("All services initialized.")
     yield
     # Shutdown event
     logger.info("Application shutdown.")
+    await loop_monitor.stop()
+    compute_pool.shutdown()
 
 # Create the FastAPI app instance with the lifespan manager
 app = FastAPI(title="AI Classroom API", lifespan=lifespan)
@@ -46,6 +52,8 @@ app.add_exception_handler(Exception, exception_handler.http_exception_handler)
 app.include_router(classroom.router, prefix="/api", tags=["Classroom"])
 app.include_router(dashboard.router, prefix="/api", tags=["Dashboard"])
 app.include_router(classroom_details.router, prefix="/api", tags=["Classroom Details"])
+app.include_router(metrics.router, prefix="/api", tags=["Metrics"])
+app.include_router(search.router, prefix="/api", tags=["Search"])
 
 
 @app.get("/")